@@ -5,9 +5,9 @@ os.environ["NO_PROXY"] = "localhost,127.0.0.1,0.0.0.0"
 
 import streamlit as st
 from core.session_state import init_session
-from core.ui_manager import render_sidebar, render_settings
+from core.ui_manager import render_sidebar, render_settings, render_index_jobs
+from core.index_jobs import index_jobs
 from core.workflow import process_chat
-from tools.knowledge import knowledge_tool
 from utils.stream_parser import StreamParser
 # 引入工具
 from utils.file_utils import is_image_file
@@ -39,24 +39,34 @@ else:
             first_file = uploaded_files[0]
             st.session_state.current_file = os.path.join("uploads", first_file.name)
             
+            to_index = []
+            processed = st.session_state.setdefault("processed_files", set())
+            current_embed = st.session_state.get("selected_embed_model", "nomic-embed-text")
             for f in uploaded_files:
                 path = os.path.join("uploads", f.name)
-                with open(path, "wb") as w: w.write(f.getbuffer())
+                # 每次 rerun 都会走到这里：只处理新上传的文件，避免覆盖正在被后台索引读取的文件
+                upload_id = getattr(f, "file_id", None) or f"{f.name}_{f.size}"
+                is_new = upload_id not in processed
+                if is_new:
+                    with open(path, "wb") as w: w.write(f.getbuffer())
+                    processed.add(upload_id)
                 
                 is_excel = f.name.endswith(".xlsx") or f.name.endswith(".xls")
                 
                 if is_excel:
                     st.caption(f"📊 Excel 已就绪: {f.name} (可使用工具读取/分析)")
                 
-                if st.session_state.use_rag:
-                    if not is_excel: 
-                        current_embed = st.session_state.get("selected_embed_model", "nomic-embed-text")
-                        with st.spinner(f"正在索引 {f.name}..."):
-                            msg = knowledge_tool.add_document(path, current_embed)
-                            if "失败" in msg or "不支持" in msg: 
-                                st.warning(msg) 
-                            else: 
-                                st.toast(msg)
+                index_key = f"{upload_id}@{current_embed}"
+                if st.session_state.use_rag and not is_excel and index_key not in processed:
+                    to_index.append(path)
+                    processed.add(index_key)
+
+            # 提交到后台索引队列，页面不再阻塞，可以继续对话
+            if to_index:
+                if index_jobs.submit(to_index, current_embed):
+                    st.toast(f"已加入后台索引队列: {len(to_index)} 个文件")
+
+        render_index_jobs()
 
     # === 历史消息渲染 ===
     for msg in st.session_state.messages:
@@ -29,7 +29,42 @@ DEFAULT_CONFIG = {
             "3. If the request is trivial (e.g. 'hello'), reply with 'No plan needed'."
         )
     },
-    "mcp_servers": {} # 新增：存储 MCP 服务器配置
+    "mcp_servers": {}, # 新增：存储 MCP 服务器配置
+    # === RAG 索引性能参数 ===
+    "rag": {
+        "embed_batch_size": 32,  # 每次 /api/embed 请求携带的切片数
+        "embed_workers": 4,      # 同时在途的嵌入批次数
+        "embed_cache": True,     # 持久化嵌入缓存 (cache/embeddings.db)
+        "embed_cache_max_entries": 200000,
+        "ingest_processes": 0,   # 批量索引的解析进程数，0 表示使用全部 CPU 核
+        "hybrid_search": True,   # BM25 + 向量混合检索 (RRF 融合)
+        "rrf_k": 60,
+        "search_cache_size": 256, # kb_search 查询向量/结果缓存条数
+        "search_cache_ttl": 600,  # 缓存有效期 (秒)
+        "onnx_threads": 4,        # 本地 ONNX 嵌入模型的 intra-op 线程数
+        "onnx_batch_size": 32,
+        "rerank_model": "ms-marco-TinyBERT-L-2-v2", # 启动时预加载的重排序模型
+        "rerank_threads": 2,       # 重排序 ONNX intra-op 线程数
+        "rerank_max_batch": 64,    # 并发查询合批的最大 (query, passage) 对数
+        "rerank_batch_wait_ms": 5, # 合批等待窗口
+        "vector_store": "chroma",  # chroma / quantized (内存映射的 int8/float16 向量库，首次打开时从 Chroma 迁移)
+        "vector_dtype": "int8",    # quantized 库的存储精度: int8 / float16
+        "vector_rescore": 0,       # 全精度重打分的候选数；>0 时额外保留一份 float32 副本，磁盘占用为 int8 的 5 倍、比 Chroma 还大
+        "dedup_near": True,        # 索引时用 MinHash/LSH 合并近似重复切片
+        "dedup_threshold": 0.9,    # 估算 Jaccard 相似度达到该值视为重复 (越高越保守)
+        "hierarchical_search": False, # 分层检索：先按文档摘要向量选文件，再在文件内检索切片
+        "hierarchical_top_docs": 8,   # 每个查询选出的候选文件数
+        "hierarchical_min_docs": 20,  # 文件数少于该值时直接全库检索
+        "hnsw": {"M": 16, "construction_ef": 200, "search_ef": 64}, # 新建 Chroma collection 的 HNSW 参数
+        "hnsw_overrides": {},         # 按 collection 覆盖，如 {"kb_nomic-embed-text": {"M": 32}}
+        "federated_search": False,    # 联合检索：同时检索其他嵌入模型建过的 collection，按排名融合
+        "federated_models": [],       # 参与联合检索的其他模型，留空表示曾经建过库的全部模型
+        "federated_workers": 4,       # 并发检索的线程数
+        "pdf_workers": 0,             # PDF 按页段并行提取的进程数，0 表示 CPU 核数，1 表示不并行
+        "pdf_parallel_min_pages": 32, # 待提取页数达到该值才启用多进程 (进程启动有固定开销)
+        "pdf_page_cache": True,       # 逐页文本缓存 (chroma_db/pdf_pages.db)，重试/换模型索引时复用
+        "pdf_page_cache_mb": 512
+    }
 }
 
 class ConfigHandler:
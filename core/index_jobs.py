@@ -0,0 +1,184 @@
+import os
+import json
+import time
+import uuid
+import sqlite3
+import threading
+from tools.knowledge import knowledge_tool
+from utils.doc_extract import calculate_hash
+from utils.logger import logger
+
+class IndexJobManager:
+    """
+    后台索引任务队列
+    - 任务持久化在 SQLite，页面 rerun / 进程重启后依然存在 (运行中的任务重启后重新排队)
+    - 单个后台线程按提交顺序执行，每个任务内部仍走 add_documents 的进程池 + 批量嵌入
+    - 记录进度 (已写入切片 / 已解析切片)，支持取消与重试
+    """
+    ACTIVE = ("queued", "running", "cancelling")
+
+    def __init__(self, db_path=os.path.join("chroma_db", "index_jobs.db")):
+        self.db_path = db_path
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._cancel_events = {} # job_id -> Event (仅运行中的任务)
+        self._worker = None
+        os.makedirs(os.path.dirname(db_path) or ".", exist_ok=True)
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS jobs ("
+            "id TEXT PRIMARY KEY, embed_model TEXT NOT NULL, files TEXT NOT NULL, status TEXT NOT NULL, "
+            "done INTEGER DEFAULT 0, total INTEGER DEFAULT 0, results TEXT, error TEXT, "
+            "created_at REAL NOT NULL, updated_at REAL NOT NULL)"
+        )
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS job_files (job_id TEXT, file_hash TEXT, embed_model TEXT)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_job_files ON job_files(file_hash, embed_model)")
+        # 上次进程退出时未完成的任务：运行中的重新排队，取消中的直接标记为已取消
+        with self._conn:
+            self._conn.execute("UPDATE jobs SET status='queued', done=0, total=0 WHERE status='running'")
+            self._conn.execute("UPDATE jobs SET status='cancelled' WHERE status='cancelling'")
+        # 有遗留的排队任务时立即启动后台线程，不必等到下一次提交
+        if self._conn.execute("SELECT 1 FROM jobs WHERE status='queued' LIMIT 1").fetchone():
+            self._ensure_worker()
+
+    # === 对外接口 ===
+    def submit(self, file_paths, embed_model_name="nomic-embed-text"):
+        """
+        提交索引任务，返回 job_id。
+        同一内容 + 嵌入模型已在排队/运行中的文件会被跳过，全部被跳过时返回 None。
+        """
+        files = []
+        marks = ",".join("?" * len(self.ACTIVE))
+        with self._lock:
+            for path in file_paths:
+                fhash = calculate_hash(path)
+                seen = self._conn.execute(
+                    "SELECT 1 FROM job_files f JOIN jobs j ON f.job_id = j.id "
+                    f"WHERE f.file_hash=? AND f.embed_model=? AND j.status IN ({marks}) LIMIT 1",
+                    (fhash, embed_model_name) + self.ACTIVE
+                ).fetchone()
+                if not seen and fhash not in [f["hash"] for f in files]:
+                    files.append({"path": path, "hash": fhash})
+            if not files: return None
+
+            job_id = uuid.uuid4().hex[:12]
+            now = time.time()
+            with self._conn:
+                self._conn.execute(
+                    "INSERT INTO jobs (id, embed_model, files, status, created_at, updated_at) VALUES (?, ?, ?, 'queued', ?, ?)",
+                    (job_id, embed_model_name, json.dumps(files, ensure_ascii=False), now, now)
+                )
+                self._conn.executemany(
+                    "INSERT INTO job_files VALUES (?, ?, ?)", [(job_id, f["hash"], embed_model_name) for f in files]
+                )
+        self._ensure_worker()
+        self._wakeup.set()
+        return job_id
+
+    def list_jobs(self, limit=10):
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT id, embed_model, files, status, done, total, results, error, created_at, updated_at "
+                "FROM jobs ORDER BY created_at DESC LIMIT ?", (limit,)
+            ).fetchall()
+        return [self._row_to_job(r) for r in rows]
+
+    def get(self, job_id):
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT id, embed_model, files, status, done, total, results, error, created_at, updated_at "
+                "FROM jobs WHERE id=?", (job_id,)
+            ).fetchone()
+        return self._row_to_job(row) if row else None
+
+    def cancel(self, job_id):
+        with self._lock:
+            event = self._cancel_events.get(job_id)
+            if event is not None:
+                event.set()
+                self._set(job_id, status="cancelling")
+            else:
+                self._set(job_id, status="cancelled", only_if="queued")
+
+    def retry(self, job_id):
+        """已取消 / 失败的任务重新排队"""
+        with self._lock:
+            self._set(job_id, status="queued", done=0, total=0, results=None, error=None, only_if=("cancelled", "failed"))
+        self._ensure_worker()
+        self._wakeup.set()
+
+    # === 内部实现 ===
+    @staticmethod
+    def _row_to_job(row):
+        keys = ["id", "embed_model", "files", "status", "done", "total", "results", "error", "created_at", "updated_at"]
+        job = dict(zip(keys, row))
+        job["files"] = json.loads(job["files"])
+        job["results"] = json.loads(job["results"]) if job["results"] else {}
+        return job
+
+    def _set(self, job_id, only_if=None, **fields):
+        """更新任务字段 (调用方持有 _lock)"""
+        fields["updated_at"] = time.time()
+        if "results" in fields and fields["results"] is not None:
+            fields["results"] = json.dumps(fields["results"], ensure_ascii=False)
+        sql = f"UPDATE jobs SET {', '.join(f'{k}=?' for k in fields)} WHERE id=?"
+        params = list(fields.values()) + [job_id]
+        if only_if:
+            states = (only_if,) if isinstance(only_if, str) else tuple(only_if)
+            sql += f" AND status IN ({','.join('?' * len(states))})"
+            params += list(states)
+        with self._conn:
+            self._conn.execute(sql, params)
+
+    def _ensure_worker(self):
+        if self._worker is None or not self._worker.is_alive():
+            self._worker = threading.Thread(target=self._run_forever, name="kb-index-worker", daemon=True)
+            self._worker.start()
+
+    def _next_job(self):
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT id FROM jobs WHERE status='queued' ORDER BY created_at LIMIT 1"
+            ).fetchone()
+            if not row: return None
+            self._cancel_events[row[0]] = threading.Event()
+            self._set(row[0], status="running")
+        return self.get(row[0])
+
+    def _run_forever(self):
+        while True:
+            job = self._next_job()
+            if job is None:
+                self._wakeup.wait(timeout=5)
+                self._wakeup.clear()
+                continue
+            self._run_job(job)
+
+    def _run_job(self, job):
+        job_id = job["id"]
+        event = self._cancel_events[job_id]
+
+        def progress(done, total):
+            with self._lock:
+                self._set(job_id, done=done, total=total)
+
+        try:
+            paths = [f["path"] for f in job["files"] if os.path.exists(f["path"])]
+            missing = {os.path.basename(f["path"]): "❌ 文件不存在" for f in job["files"] if f["path"] not in paths}
+            results = knowledge_tool.add_documents(paths, job["embed_model"], progress=progress, cancel_event=event) if paths else {}
+            results.update(missing)
+            status = "cancelled" if event.is_set() else "done"
+            with self._lock:
+                self._set(job_id, status=status, results=results)
+        except Exception as e:
+            logger.error(f"[IndexJob] {job_id} 失败: {e}")
+            with self._lock:
+                self._set(job_id, status="failed", error=str(e))
+        finally:
+            with self._lock:
+                self._cancel_events.pop(job_id, None)
+
+index_jobs = IndexJobManager()
@@ -30,6 +30,7 @@ def init_session():
     st.session_state['use_mcp_protocol'] = g_conf.get("use_mcp_protocol", False)
     st.session_state['use_rag'] = g_conf.get("use_rag", False)
     st.session_state['use_rerank'] = g_conf.get("use_rerank", False)
+    st.session_state['federated_search'] = config.get("rag", {}).get("federated_search", False)
     st.session_state['system_prompt'] = g_conf.get("system_prompt", "")
     
     # === 恢复 Plan-and-Solve 配置 ===
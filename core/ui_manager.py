@@ -7,6 +7,15 @@ from utils.llm_factory import LLMFactory
 from tools.registry import tool_registry
 from tools.knowledge import knowledge_tool
 from core.mcp_manager import McpManager
+from core.index_jobs import index_jobs
+
+# st.fragment (Streamlit >= 1.37) 支持局部定时刷新；老版本退化为普通函数
+_fragment = getattr(st, "fragment", None)
+
+def _auto_refresh(seconds):
+    def decorator(func):
+        return _fragment(run_every=seconds)(func) if _fragment else func
+    return decorator
 
 def render_sidebar():
     config = ConfigHandler.load()
@@ -69,6 +78,7 @@ def render_sidebar():
 
             with st.expander("📊 Excel 工具", expanded=False):
                 st.checkbox("启用读取", value=st.session_state.get("tool_enabled_excel_read", True), key="tool_enabled_excel_read")
+                st.checkbox("启用数据概览", value=st.session_state.get("tool_enabled_excel_profile", True), key="tool_enabled_excel_profile")
                 st.checkbox("启用删除数据", value=st.session_state.get("tool_enabled_excel_delete", True), key="tool_enabled_excel_delete")
                 st.checkbox("启用写入数据", value=st.session_state.get("tool_enabled_excel_write", True), key="tool_enabled_excel_write")
 
@@ -135,18 +145,43 @@ def render_sidebar():
         if rag_on:
             with st.expander("⚙️ RAG 参数设置", expanded=True):
                 ollama_url = config.get("providers", {}).get("Ollama", {}).get("base_url", "http://127.0.0.1:11434")
-                embed_models = LLMFactory.get_embedding_models(ollama_url)
-                st.selectbox("嵌入模型 (Ollama)", embed_models, key="selected_embed_model")
+                embed_models = LLMFactory.get_embedding_models(ollama_url) + LLMFactory.get_local_embedding_models()
+                st.selectbox("嵌入模型 (Ollama / 本地 ONNX)", embed_models, key="selected_embed_model")
                 rerank_on = st.toggle("启用重排序", key="use_rerank", on_change=lambda: sync_setting("use_rerank", "global.use_rerank"))
                 if rerank_on:
                     local_models = LLMFactory.get_local_rerank_models()
-                    st.selectbox("重排序模型", local_models, key="selected_rerank_model")
+                    saved = config.get("rag", {}).get("rerank_model", "")
+                    idx = next((i for i, m in enumerate(local_models) if m.split(" ")[0] == saved.split(" ")[0]), 0)
+                    sel_rerank = st.selectbox("重排序模型", local_models, index=idx, key="selected_rerank_model",
+                                              on_change=lambda: sync_setting("selected_rerank_model", "rag.rerank_model"))
+                    # 后台加载 + 预热，首个查询不再等待模型初始化
+                    knowledge_tool.preload_ranker(sel_rerank)
+                    stats = knowledge_tool.get_rerank_stats(sel_rerank)
+                    if stats and stats["queries"]:
+                        st.caption(f"重排序延迟 p50 {stats['p50_ms']}ms / p95 {stats['p95_ms']}ms · 平均批次 {stats['avg_batch']} · 分数缓存命中率 {stats['score_cache']['hit_rate']:.0%}")
+                    elif stats and stats["load_error"]:
+                        st.caption(f"⚠️ 重排序模型加载失败: {stats['load_error']}")
+                # 切换嵌入模型后旧库仍可检索，迁移在后台进行
+                st.toggle("🔀 跨嵌入模型联合检索", key="federated_search", on_change=lambda: sync_setting("federated_search", "rag.federated_search"))
 
             with st.expander("📂 已索引文件列表", expanded=False):
                 curr_embed = st.session_state.get("selected_embed_model", "nomic-embed-text")
                 files = knowledge_tool.get_files(curr_embed)
+                to_migrate = knowledge_tool.get_migration_candidates(curr_embed)
+                if to_migrate:
+                    st.caption(f"其他嵌入模型的库中有 {len(to_migrate)} 个文件尚未用当前模型索引")
+                    if st.button("🔀 后台迁移到当前模型", key="migrate_embed"):
+                        if index_jobs.submit(to_migrate, curr_embed):
+                            st.toast(f"已加入后台索引队列: {len(to_migrate)} 个文件")
                 if not files: st.caption(f"当前库为空")
                 else:
+                    dedup = knowledge_tool.get_dedup_stats(curr_embed)
+                    if dedup and dedup["refs"]:
+                        st.caption(f"近似重复切片已合并 {dedup['refs']} 个 (共 {dedup['canonical']} 个向量)")
+                    idx_info = knowledge_tool.get_index_info(curr_embed)
+                    if idx_info.get("tombstone_ratio", 0) > 0.2 or idx_info.get("needs_rebuild"):
+                        st.caption(f"⚠️ 索引中已删除切片占 {idx_info['tombstone_ratio']:.0%}，建议离线执行 "
+                                   f"`python -m utils.index_maintenance rebuild --model {curr_embed}`")
                     for f in files:
                         c1, c2 = st.columns([0.8, 0.2])
                         c1.text(f)
@@ -268,4 +303,41 @@ def render_settings():
             if st.form_submit_button("添加") and n and u:
                 ConfigHandler.add_provider(n, u, k, m)
                 LLMFactory.get_all_models.clear()
-                st.rerun()
\ No newline at end of file
+                st.rerun()
+
+@_auto_refresh(2)
+def render_index_jobs():
+    """后台索引任务面板：轮询任务状态，不阻塞对话"""
+    jobs = index_jobs.list_jobs(limit=5)
+    if not jobs: return
+
+    status_label = {
+        "queued": "⏳ 排队中", "running": "⚙️ 索引中", "cancelling": "⏹️ 取消中",
+        "cancelled": "⏹️ 已取消", "done": "✅ 完成", "failed": "❌ 失败"
+    }
+    st.caption("📚 后台索引任务")
+    for job in jobs:
+        names = ", ".join(os.path.basename(f["path"]) for f in job["files"])
+        c1, c2 = st.columns([0.8, 0.2])
+        with c1:
+            label = f"{status_label.get(job['status'], job['status'])} · {names}"
+            if job["status"] in ("running", "cancelling"):
+                total = max(job["total"], job["done"], 1)
+                st.progress(min(job["done"] / total, 1.0), text=f"{label} ({job['done']}/{job['total']} 切片)")
+            else:
+                st.text(label)
+            if job["status"] == "done":
+                for fname, msg in job["results"].items():
+                    if "失败" in msg or "不支持" in msg:
+                        st.warning(f"{fname}: {msg}")
+            elif job["status"] == "failed" and job["error"]:
+                st.warning(job["error"])
+        with c2:
+            if job["status"] in ("queued", "running"):
+                if st.button("取消", key=f"cancel_job_{job['id']}"):
+                    index_jobs.cancel(job["id"])
+                    st.rerun()
+            elif job["status"] in ("cancelled", "failed"):
+                if st.button("重试", key=f"retry_job_{job['id']}"):
+                    index_jobs.retry(job["id"])
+                    st.rerun()
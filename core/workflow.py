@@ -14,6 +14,7 @@ from core.config_handler import ConfigHandler
 from utils.logger import logger
 from utils.stream_parser import StreamParser
 from core.mcp_manager import McpManager
+from utils.excel_writer import write_buffer
 
 def save_history():
     if not st.session_state.messages: return
@@ -302,8 +303,10 @@ def process_chat(prompt):
                             from tools.knowledge import knowledge_tool
                             embed_model = st.session_state.get("selected_embed_model", "nomic-embed-text")
                             rerank_model = st.session_state.get("selected_rerank_model") if st.session_state.get("use_rerank") else None
-                            res = knowledge_tool.search(args.get("query"), embed_model, rerank_model)
-                            s.update(label=f"✅ Step {step_counter}: 检索完成", state="complete")
+                            res = knowledge_tool.search(args.get("query"), embed_model, rerank_model, queries=args.get("queries"),
+                                                        sources=args.get("sources"), folder=args.get("folder"))
+                            n_queries = len(args.get("queries") or [])
+                            s.update(label=f"✅ Step {step_counter}: 检索完成" + (f" ({n_queries} 个查询)" if n_queries > 1 else ""), state="complete")
                             with st.expander("📚 引用内容", expanded=False):
                                 st.markdown(str(res))
                         
@@ -363,6 +366,14 @@ def process_chat(prompt):
                             "content": f"Error: {str(e)}"
                         })
                 step_counter += 1
+
+            # excel_write 的追加在本步内合并，这里一次性保存；失败信息附到本步最后一条工具结果里
+            write_errors = write_buffer.flush()
+            if write_errors:
+                note = "\n".join(f"[excel_write 保存失败] {err}" for err in write_errors.values())
+                st.error(note)
+                if st.session_state.messages[-1]["role"] == "tool":
+                    st.session_state.messages[-1]["content"] += "\n" + note
             
             continue 
         
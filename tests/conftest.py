@@ -0,0 +1,58 @@
+import os
+import sys
+import copy
+import zlib
+import tempfile
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# utils.logger 导入时在当前目录下创建 logs/ 日志文件：先在临时目录中导入，测试日志不写入仓库
+_cwd = os.getcwd()
+os.chdir(tempfile.mkdtemp(prefix="test-logs-"))
+try:
+    import utils.logger  # noqa: F401
+finally:
+    os.chdir(_cwd)
+
+from core.config_handler import ConfigHandler, DEFAULT_CONFIG
+
+
+class FakeBackend:
+    """确定性的词袋嵌入，避免测试依赖 Ollama"""
+    cache_key = "fake"
+    batch_size = 32
+    max_workers = 1
+    dim = 64
+
+    def embed(self, texts):
+        out = []
+        for text in texts:
+            vec = [0.0] * self.dim
+            for word in text.split():
+                vec[zlib.crc32(word.encode("utf-8")) % self.dim] += 1.0
+            out.append(vec)
+        return out
+
+
+@pytest.fixture
+def rag_config(tmp_path, monkeypatch):
+    """在临时目录中运行，使用默认配置 (不读写真实的 settings.json / chroma_db)"""
+    monkeypatch.chdir(tmp_path)
+    config = copy.deepcopy(DEFAULT_CONFIG)
+    config["rag"]["embed_cache"] = False
+    monkeypatch.setattr(ConfigHandler, "_config", config)
+    monkeypatch.setattr(ConfigHandler, "save", classmethod(lambda cls: None))
+    return config["rag"]
+
+
+@pytest.fixture
+def kb(rag_config):
+    from chromadb.api.client import SharedSystemClient
+    from tools.knowledge import KnowledgeBase
+    # Chroma 按路径缓存客户端，而 chroma_db 是相对路径：每个测试换了目录，需要清掉旧的
+    SharedSystemClient.clear_system_cache()
+    base = KnowledgeBase()
+    base._get_backend = lambda model: FakeBackend()
+    yield base
+    SharedSystemClient.clear_system_cache()
@@ -0,0 +1,92 @@
+import datetime
+
+import pytest
+from openpyxl import Workbook
+
+from utils.excel_query import get_table, execute, DEFAULT_LIMIT
+
+
+@pytest.fixture
+def table(tmp_path):
+    wb = Workbook()
+    ws = wb.active
+    ws.title = "Data"
+    ws.append(["id", "region", "amount", "date", "code"])
+    regions = ["east", "west", "north", None]
+    for i in range(80):
+        code = i if i % 2 else f"c{i}" # 数值与文本混合 -> 文本列
+        ws.append([i, regions[i % 4], None if i % 10 == 0 else float(i), datetime.date(2024, 1, 1) + datetime.timedelta(days=i), code])
+    path = tmp_path / "data.xlsx"
+    wb.save(path)
+    table, _ = get_table(str(path), cache_dir=str(tmp_path / "cache"))
+    return table
+
+
+def _rows(table, query):
+    results, order, matched, _ = execute(table, query)
+    return [tuple(r.display(int(i)) for r in results) for i in order], matched
+
+
+def test_where_conditions(table):
+    rows, matched = _rows(table, "SELECT id WHERE region = 'east' AND amount >= 40")
+    assert [r[0] for r in rows] == [str(i) for i in range(44, 80, 4) if i % 10] and matched == 8
+    rows, _ = _rows(table, "SELECT id WHERE region IN ('west', 'north') AND id < 8")
+    assert [r[0] for r in rows] == ["1", "2", "5", "6"]
+    rows, _ = _rows(table, "SELECT id WHERE code LIKE 'c1_'")
+    assert [r[0] for r in rows] == [str(i) for i in range(10, 20, 2)]
+    rows, _ = _rows(table, "SELECT id WHERE date BETWEEN '2024-01-03' AND '2024-01-05'")
+    assert [r[0] for r in rows] == ["2", "3", "4"]
+    rows, _ = _rows(table, "SELECT id WHERE amount IS NULL OR NOT region IS NOT NULL LIMIT 500")
+    assert len(rows) == 8 + 20 # 空金额 8 行 (偶数 id)，空地区 20 行 (奇数 id)
+
+
+def test_group_by_with_aggregates_and_order_by_alias(table):
+    rows, _ = _rows(table, "SELECT region, COUNT(*) AS n, COUNT(amount), SUM(amount) AS total, MIN(date), MAX(id) "
+                           "GROUP BY region ORDER BY total DESC, region")
+    assert rows[0] == ("", "20", "20", "820", "2024-01-04", "79") # 地区为空的行自成一组
+    assert [r[:4] for r in rows[1:]] == [("west", "20", "20", "780"), ("east", "20", "16", "640"), ("north", "20", "16", "640")]
+    rows, _ = _rows(table, "SELECT region, AVG(amount) AS avg_amount GROUP BY region ORDER BY avg_amount LIMIT 1")
+    assert rows == [("west", "39")]
+
+
+def test_order_by_aggregate_requires_grouping(table):
+    with pytest.raises(ValueError, match="GROUP BY"):
+        execute(table, "SELECT region ORDER BY COUNT(*)")
+    rows, _ = _rows(table, "SELECT region GROUP BY region ORDER BY COUNT(amount), region")
+    assert rows == [("east",), ("north",), ("west",), ("",)]
+
+
+def test_sidecar_written_in_blocks(tmp_path, monkeypatch):
+    import utils.excel_query as excel_query
+    monkeypatch.setattr(excel_query, "SIDECAR_BLOCK_ROWS", 7) # 多个块，且列类型在后面的块中才变成文本
+    wb = Workbook()
+    ws = wb.active
+    ws.append(["n", "mixed"])
+    for i in range(30):
+        ws.append([i, i if i < 25 else f"t{i}"] + (["extra"] if i == 20 else []))
+    path = tmp_path / "blocks.xlsx"
+    wb.save(path)
+    table, _ = get_table(str(path), cache_dir=str(tmp_path / "cache"))
+    assert table.rows == 30 and [c.kind for c in table.columns] == ["num", "num", "str", "str"]
+    rows, _ = _rows(table, "SELECT _row, n, mixed, C WHERE n >= 19 AND n <= 26")
+    assert rows == [("21", "19", "19", ""), ("22", "20", "20", "extra"), ("23", "21", "21", ""), ("24", "22", "22", ""),
+                    ("25", "23", "23", ""), ("26", "24", "24", ""), ("27", "25", "t25", ""), ("28", "26", "t26", "")]
+
+
+def test_limit(table):
+    rows, matched = _rows(table, "SELECT id")
+    assert len(rows) == DEFAULT_LIMIT and matched == 80
+    rows, matched = _rows(table, "SELECT id LIMIT 0")
+    assert rows == [] and matched == 80
+    rows, _ = _rows(table, "SELECT id ORDER BY id DESC LIMIT 2")
+    assert rows == [("79",), ("78",)]
+    with pytest.raises(ValueError):
+        execute(table, "SELECT id LIMIT -1")
+
+
+def test_mixed_type_column_compares_as_text(table):
+    assert table.column("code").kind == "str"
+    rows, _ = _rows(table, "SELECT code WHERE code > 7 AND code < 8")
+    assert [r[0] for r in rows] == ["71", "73", "75", "77", "79"] # 字典序: "71" 介于 "7" 与 "8" 之间，"9" 不在其中
+    rows, _ = _rows(table, "SELECT MIN(code), MAX(code)")
+    assert rows == [("1", "c8")]
@@ -0,0 +1,44 @@
+import openpyxl
+from openpyxl import Workbook
+
+from utils.excel_reader import SheetRows
+
+
+def _open(tmp_path, n=300):
+    wb = Workbook()
+    ws = wb.active
+    ws.append(["id", "name"])
+    for i in range(n):
+        ws.append([i, f"name{i}"])
+    ws.cell(row=n + 4, column=1, value="tail")
+    ws.cell(row=n + 10, column=1).number_format = "0.00" # 只有格式的空行，只读模式会按维度补出
+    path = tmp_path / "rows.xlsx"
+    wb.save(path)
+    return openpyxl.load_workbook(path, read_only=True, data_only=True)
+
+
+def test_window_stays_bounded_and_seeks_back(tmp_path, monkeypatch):
+    monkeypatch.setattr(SheetRows, "WINDOW", 50)
+    wb = _open(tmp_path)
+    rows = SheetRows(wb.active)
+    assert rows.header() == ("id", "name")
+
+    far = [item for item, _ in zip(rows.iter_from(250), range(2))]
+    assert far == [(250, (248, "name248")), (251, (249, "name249"))]
+    assert len(rows._window) <= 50
+
+    back = [(r, v) for (r, v), _ in zip(rows.iter_from(10), range(2))]
+    assert back == [(10, (8, "name8")), (11, (9, "name9"))]
+    assert len(rows._window) <= 50
+    wb.close()
+
+
+def test_trailing_rows_and_total(tmp_path):
+    wb = _open(tmp_path)
+    rows = SheetRows(wb.active)
+    tail = list(rows.iter_from(300))
+    assert [r for r, _ in tail] == [300, 301, 302, 303, 304]
+    assert tail[-1] == (304, ("tail", None))
+    assert rows.complete and rows.total_rows() == 304
+    assert rows.has_row(304) and not rows.has_row(305)
+    wb.close()
@@ -0,0 +1,73 @@
+import random
+
+import pytest
+from openpyxl import Workbook
+from openpyxl.worksheet.datavalidation import DataValidation
+
+from utils.excel_writer import parse_row_spec, delete_rows, contains_predicate
+
+
+def _sheet(n=60):
+    wb = Workbook()
+    ws = wb.active
+    ws.append(["id", "name", "note"])
+    for i in range(n):
+        ws.append([i, f"name{i}", "drop" if i % 4 == 0 else "keep"])
+    return ws
+
+
+def _values(ws):
+    return [tuple(c.value for c in row) for row in ws.iter_rows()]
+
+
+def test_parse_row_spec():
+    assert parse_row_spec("2, 5-7，9") == [(2, 2), (5, 7), (9, 9)]
+    assert parse_row_spec("2-100000000") == [(2, 100000000)]
+    with pytest.raises(ValueError):
+        parse_row_spec("5-3")
+    with pytest.raises(ValueError):
+        parse_row_spec("a-b")
+
+
+def test_delete_rows_matches_sequential_delete():
+    rng = random.Random(3)
+    rows = sorted(rng.sample(range(1, 70), 25))
+    bulk, sequential = _sheet(), _sheet()
+    deleted = delete_rows(bulk, [(r, r) for r in rows] + [(65, 100000000)])
+    for r in sorted(set(deleted), reverse=True):
+        sequential.delete_rows(r)
+    assert _values(bulk) == _values(sequential)
+    assert bulk.max_row == sequential.max_row
+    bulk.append(["appended"])
+    assert bulk.cell(bulk.max_row, 1).value == "appended"
+    assert bulk.max_row == sequential.max_row + 1
+
+
+def test_delete_rows_by_predicate_skips_header():
+    ws = _sheet(12)
+    deleted = delete_rows(ws, predicate=contains_predicate("DROP"))
+    assert deleted == [2, 6, 10]
+    assert ws.cell(1, 1).value == "id"
+    assert all(row[2] == "keep" for row in _values(ws)[1:])
+
+
+def test_delete_rows_moves_formatting_with_rows():
+    ws = _sheet(20)
+    ws.merge_cells("B10:C12")       # 首行被删，由剩余行接替
+    ws.merge_cells("A15:A16")       # 整体上移
+    ws.merge_cells("B18:C18")
+    ws.row_dimensions[14].height = 33
+    ws.cell(14, 2).hyperlink = "https://example.com/14"
+    dv = DataValidation(type="list", formula1='"keep,drop"')
+    dv.add("C13:C16")
+    ws.add_data_validation(dv)
+    ws.merge_cells("A4:C4")         # 整行被删
+
+    delete_rows(ws, [(3, 4), (10, 10)])
+
+    merged = sorted(str(r) for r in ws.merged_cells.ranges)
+    assert merged == ["A12:A13", "B15:C15", "B8:C9"]
+    assert ws.row_dimensions[11].height == 33
+    assert ws.cell(11, 2).hyperlink.ref == "B11"
+    assert ws.cell(11, 1).value == 12
+    assert str(dv.sqref) == "C10:C13"
@@ -0,0 +1,42 @@
+import os
+import time
+import json
+import sqlite3
+
+
+def _wait_for(predicate, timeout=10):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if predicate(): return True
+        time.sleep(0.05)
+    return False
+
+
+def test_restart_resumes_interrupted_job(rag_config, tmp_path, monkeypatch):
+    import core.index_jobs as index_jobs_module
+    from core.index_jobs import IndexJobManager
+
+    calls = []
+    def add_documents(paths, embed_model, progress=None, cancel_event=None):
+        calls.append((paths, embed_model))
+        return {os.path.basename(p): "✅ 成功" for p in paths}
+    monkeypatch.setattr(index_jobs_module.knowledge_tool, "add_documents", add_documents)
+
+    doc = tmp_path / "a.txt"
+    doc.write_text("hello", encoding="utf-8")
+    db_path = str(tmp_path / "jobs" / "index_jobs.db")
+    IndexJobManager(db_path)._conn.close() # 建表
+    conn = sqlite3.connect(db_path)
+    with conn: # 模拟上次进程退出时正在运行的任务
+        conn.execute(
+            "INSERT INTO jobs (id, embed_model, files, status, done, total, created_at, updated_at) "
+            "VALUES ('job1', 'fake', ?, 'running', 3, 10, 0, 0)",
+            (json.dumps([{"path": str(doc), "hash": "h"}]),)
+        )
+    conn.close()
+
+    manager = IndexJobManager(db_path)
+    assert manager._worker is not None
+    assert _wait_for(lambda: manager.get("job1")["status"] == "done")
+    assert calls == [([str(doc)], "fake")]
+    assert manager.get("job1")["results"] == {"a.txt": "✅ 成功"}
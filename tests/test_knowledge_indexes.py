@@ -0,0 +1,35 @@
+import time
+import threading
+
+import pytest
+
+
+@pytest.mark.parametrize("getter, cls_name", [
+    ("_get_lexical_index", "BM25Index"), ("_get_catalog", "DocumentCatalog"),
+    ("_get_near_dup_index", "NearDupIndex"), ("_get_doc_summary", "DocSummaryIndex"),
+])
+def test_concurrent_first_access_creates_one_index(kb, tmp_path, monkeypatch, getter, cls_name):
+    # 后台索引线程与页面线程同时首次访问时，只能创建一份索引，否则其中一份的更新会丢失
+    import tools.knowledge as knowledge
+    doc = tmp_path / "a.txt"
+    doc.write_text("alpha beta gamma " * 50, encoding="utf-8")
+    kb.add_document(str(doc), "fake")
+    coll = kb._get_collection("fake")
+    getattr(kb, {"BM25Index": "_lexical_indexes", "DocumentCatalog": "_catalogs",
+                 "NearDupIndex": "_near_dup_indexes", "DocSummaryIndex": "_doc_summaries"}[cls_name]).clear()
+
+    original = getattr(knowledge, cls_name)
+    created = []
+    def slow_init(*args, **kwargs):
+        time.sleep(0.05) # 放大首次创建的竞争窗口
+        obj = original(*args, **kwargs)
+        created.append(obj)
+        return obj
+    monkeypatch.setattr(knowledge, cls_name, slow_init)
+
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(getattr(kb, getter)(coll))) for _ in range(6)]
+    for t in threads: t.start()
+    for t in threads: t.join()
+    assert len(created) == 1
+    assert len(results) == 6 and all(r is created[0] for r in results)
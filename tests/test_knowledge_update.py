@@ -0,0 +1,48 @@
+import random
+
+from utils.doc_extract import iter_file_chunks
+
+
+def _paragraphs(seed, count=8):
+    rng = random.Random(seed)
+    words = [f"term{i}" for i in range(400)]
+    return [" ".join(rng.choice(words) for _ in range(90)) for _ in range(count)]
+
+
+def _write(path, paragraphs):
+    path.write_text("\n\n".join(paragraphs), encoding="utf-8")
+
+
+def _edit_one_word(kb, tmp_path, seed, marker):
+    """索引一个文件，再只改其中一段的一个词后重新索引；返回 (更新结果, 被替换的词)"""
+    doc = tmp_path / "notes.txt"
+    paragraphs = _paragraphs(seed)
+    _write(doc, paragraphs)
+    assert "❌" not in kb.add_document(str(doc), "fake")
+    old_word = paragraphs[3].split()[10]
+    paragraphs[3] = paragraphs[3].replace(old_word, marker)
+    _write(doc, paragraphs)
+    return kb.add_document(str(doc), "fake"), old_word
+
+
+def test_update_indexes_edited_chunk(kb, tmp_path):
+    # 改动后的切片与它替换掉的旧切片近似重复，不能被合并成旧切片的引用
+    result, _ = _edit_one_word(kb, tmp_path, seed=7, marker="editedmarker")
+    assert "增量更新完成" in result
+    assert "近似重复" not in result
+
+    coll = kb._get_collection("fake")
+    docs = coll.get(include=["documents"])["documents"]
+    assert any("editedmarker" in d for d in docs)
+    assert "editedmarker" in kb.search("editedmarker", "fake")
+
+
+def test_update_matches_fresh_chunking(kb, tmp_path):
+    # 更新后库中的切片应与新版本文件重新切分的结果完全一致：旧切片不会被过户保留
+    _edit_one_word(kb, tmp_path, seed=11, marker="freshmarker")
+
+    coll = kb._get_collection("fake")
+    data = coll.get(include=["documents", "metadatas"])
+    expected = list(iter_file_chunks(str(tmp_path / "notes.txt"), chunk_size=600, overlap=100))
+    assert sorted(data["documents"]) == sorted(expected)
+    assert len({m["file_hash"] for m in data["metadatas"]}) == 1
@@ -0,0 +1,58 @@
+import pytest
+
+ollama = pytest.importorskip("ollama")
+if not hasattr(ollama, "ResponseError"): pytest.skip("需要真实的 ollama 客户端", allow_module_level=True)
+
+
+class FlakyClient:
+    """embed 按预设依次抛出异常或返回结果，embeddings 为逐条接口"""
+    def __init__(self, errors):
+        self.errors = list(errors)
+        self.batch_calls = 0
+        self.single_calls = 0
+
+    def embed(self, model, input):
+        self.batch_calls += 1
+        if self.errors:
+            error = self.errors.pop(0)
+            if error is not None: raise error
+        return {"embeddings": [[float(len(t))] for t in input]}
+
+    def embeddings(self, model, prompt):
+        self.single_calls += 1
+        return {"embedding": [float(len(prompt))]}
+
+
+def _backend(client):
+    # tools.knowledge 导入时会在当前目录创建知识库，需在 rag_config 切换到临时目录之后再导入
+    from tools.knowledge import OllamaBackend
+    backend = OllamaBackend(batch_size=2, max_workers=1)
+    backend.client = client
+    backend._batch_supported = True
+    return backend
+
+
+@pytest.mark.parametrize("error", [TimeoutError("timed out"), ConnectionResetError("reset"),
+                                   ollama.ResponseError("server busy", 503)])
+def test_transient_error_keeps_batch_mode(rag_config, error):
+    client = FlakyClient([error])
+    backend = _backend(client)
+    assert backend.embed(["a", "bb"]) == [[1.0], [2.0]] # 本批次逐条重试
+    assert client.single_calls == 2 and backend._batch_supported
+    assert backend.embed(["ccc", "d"]) == [[3.0], [1.0]]
+    assert client.batch_calls == 2 and client.single_calls == 2
+
+
+def test_missing_endpoint_disables_batch_mode(rag_config):
+    client = FlakyClient([ollama.ResponseError("404 page not found", 404)])
+    backend = _backend(client)
+    assert backend.embed(["a", "bb"]) == [[1.0], [2.0]]
+    assert not backend._batch_supported
+    backend.embed(["ccc"])
+    assert client.batch_calls == 1 and client.single_calls == 3
+
+
+def test_missing_model_is_not_a_missing_endpoint(rag_config):
+    from tools.knowledge import OllamaBackend
+    error = ollama.ResponseError('{"error": "model \\"x\\" not found, try pulling it first"}', 404)
+    assert not OllamaBackend._endpoint_missing(error)
@@ -0,0 +1,28 @@
+import threading
+
+import tools.reranker as reranker
+
+
+def test_preload_starts_once_and_remembers_failure(monkeypatch):
+    attempts = []
+    release = threading.Event()
+
+    class FailingRanker:
+        def __init__(self, **kwargs):
+            attempts.append(kwargs)
+            release.wait(5)
+            raise RuntimeError("download failed")
+
+    monkeypatch.setattr(reranker, "HAS_FLASHRANK", True)
+    monkeypatch.setattr(reranker, "Ranker", FailingRanker, raising=False)
+    svc = reranker.RerankerService("test-model")
+
+    assert svc.preload()
+    assert not any(svc.preload() for _ in range(5)) # 加载中：页面重跑不再启动新线程
+    release.set()
+    for t in threading.enumerate():
+        if t.name == "reranker-preload-test-model": t.join(5)
+
+    assert svc.load_error == "download failed" and svc.stats()["load_error"] == "download failed"
+    assert not svc.preload() # 失败后不再自动重试
+    assert len(attempts) == 1
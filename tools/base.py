@@ -73,13 +73,15 @@ class ToolRegistry:
             "type": "function",
             "function": {
                 "name": "kb_search",
-                "description": "Search the knowledge base.",
+                "description": "Search the knowledge base. To look up several sub-questions, pass them all in `queries` in a single call.",
                 "parameters": {
                     "type": "object",
                     "properties": {
-                        "query": {"type": "string", "description": "The search query string"}
-                    },
-                    "required": ["query"]
+                        "query": {"type": "string", "description": "The search query string"},
+                        "queries": {"type": "array", "items": {"type": "string"}, "description": "Multiple search queries answered in one call"},
+                        "sources": {"type": "array", "items": {"type": "string"}, "description": "Optional: only search inside these file names"},
+                        "folder": {"type": "string", "description": "Optional: only search files uploaded under this folder"}
+                    }
                 }
             }
         }
\ No newline at end of file
@@ -1,69 +1,151 @@
+import os
 import openpyxl
 from tools.registry import tool_registry
+from utils.excel_reader import get_workbook, invalidate, resolve_columns, format_cell, column_label
+from utils.excel_query import run_query
+from utils.excel_profile import get_profile, render_profile
+from utils.excel_writer import write_buffer, parse_row, parse_row_spec, delete_rows, contains_predicate
 from utils.security import SecurityManager
 from utils.error_handling import safe_execute
 
 @tool_registry.register(
     name="excel_delete",
-    description="Delete rows from Excel.",
+    description="Delete rows from Excel in one pass. Give row numbers/ranges, a text the rows must contain, or both "
+                "(then only the listed rows that contain the text are deleted).",
     parameters={
         "type": "object",
         "properties": {
             "file_path": {"type": "string"},
-            "row_index": {"type": "string", "description": "Rows to delete, e.g. '2,3'"},
-            "target_content": {"type": "string", "description": "Ignored, kept for compatibility"}
+            "row_index": {"type": "string", "description": "Excel row numbers or ranges to delete, e.g. '2,3,10-20'"},
+            "target_content": {"type": "string", "description": "Delete data rows where any cell contains this text (case-insensitive); the header row is never matched"},
+            "sheet_name": {"type": "string", "description": "Optional sheet name, default is active sheet"}
         },
         "required": ["file_path"]
     }
 )
 @safe_execute("Excel删除失败")
-def delete_excel_rows(file_path, row_index=None, target_content=None):
+def delete_excel_rows(file_path, row_index=None, target_content=None, sheet_name=None):
     # 1. 路径安全检查
     clean_path = SecurityManager.sanitize_path(file_path)
     
-    # 2. 业务逻辑
+    # 2. 业务逻辑 (先写出本步内尚未保存的追加，行号才与文件一致)
+    _flush_pending(clean_path)
+    invalidate(clean_path)
     wb = openpyxl.load_workbook(clean_path)
-    sheet = wb.active
-    
-    if row_index:
-        # 倒序删除防止索引偏移
-        idxs = sorted([int(i) for i in str(row_index).split(",") if i.strip().isdigit()], reverse=True)
-        count = 0
-        for i in idxs:
-            sheet.delete_rows(i)
-            count += 1
-        wb.save(clean_path)
-        return f"已删除 {count} 行"
-    
-    return "未提供 row_index"
+    sheet = wb[sheet_name] if sheet_name and sheet_name in wb.sheetnames else wb.active
+
+    rows = parse_row_spec(row_index) if row_index else None
+    predicate = contains_predicate(target_content) if target_content not in (None, "") else None
+    if rows is None and predicate is None: return "未提供 row_index 或 target_content"
+
+    # 一次遍历完成筛选与删除，保留行整体上移
+    deleted = delete_rows(sheet, rows, predicate)
+    if not deleted: return "没有符合条件的行，未删除任何数据"
+    wb.save(clean_path)
+    invalidate(clean_path)
+    shown = ", ".join(str(r) for r in deleted[:20]) + (" ..." if len(deleted) > 20 else "")
+    return f"已删除 {len(deleted)} 行 (原行号: {shown})"
+
+def _flush_pending(clean_path):
+    error = write_buffer.flush(clean_path).get(os.path.abspath(clean_path))
+    if error: raise RuntimeError(error)
+
+EXCEL_PAGE_SIZE = 50
+EXCEL_MAX_PAGE_SIZE = 500
 
 @tool_registry.register(
     name="excel_read",
-    description="Read Excel data.",
+    description="Read Excel rows page by page. The first row is treated as the header and is always shown. "
+                "Pick the sheet, a row range, the columns you need and a page; the footer tells you how to fetch the next page. "
+                "For filtering, aggregation or sorting over large sheets pass `query` instead of paging through rows.",
     parameters={
         "type": "object",
         "properties": {
             "file_path": {"type": "string"},
-            "query": {"type": "string"}
+            "sheet": {"type": "string", "description": "Sheet name or 1-based index, default is the active sheet"},
+            "columns": {"type": "array", "items": {"type": "string"}, "description": "Header names or column letters to return, default all"},
+            "start_row": {"type": "integer", "description": "First Excel row number to read, default 2 (first data row)"},
+            "end_row": {"type": "integer", "description": "Last Excel row number to read (inclusive)"},
+            "page": {"type": "integer", "description": "1-based page within the row range, default 1"},
+            "page_size": {"type": "integer", "description": f"Rows per page, default {EXCEL_PAGE_SIZE}, max {EXCEL_MAX_PAGE_SIZE}"},
+            "query": {"type": "string", "description": "SQL-like query over the sheet, e.g. "
+                      "\"SELECT region, SUM(amount) AS total WHERE year >= 2023 AND status IN ('paid','sent') GROUP BY region ORDER BY total DESC LIMIT 10\". "
+                      "Supports = != > >= < <= IN LIKE BETWEEN IS [NOT] NULL AND OR NOT, COUNT(*) COUNT(DISTINCT col) SUM AVG MIN MAX. "
+                      "Quote column names containing spaces with \"double quotes\", string values with 'single quotes'. "
+                      "Columns mixing numbers and text are treated as text, so comparisons on them are alphabetical. "
+                      "When given, columns/start_row/end_row/page are ignored"}
         },
         "required": ["file_path"]
     }
 )
 @safe_execute("Excel读取失败")
-def read_excel(file_path, query=None):
+def read_excel(file_path, query=None, sheet=None, columns=None, start_row=None, end_row=None, page=1, page_size=EXCEL_PAGE_SIZE):
+    """
+    只读流式分页读取：解析结果按 (路径, 修改时间) 缓存，
+    往后翻页时从流的当前位置继续读取，最近读过的行直接从内存窗口返回
+    给出 query 时改在列式缓存上做过滤/聚合，只返回结果
+    """
+    clean_path = SecurityManager.sanitize_path(file_path)
+    _flush_pending(clean_path)
+    if query: return run_query(clean_path, query, sheet)
+    page = max(1, int(page or 1))
+    page_size = min(EXCEL_MAX_PAGE_SIZE, max(1, int(page_size or EXCEL_PAGE_SIZE)))
+    start_row = max(2, int(start_row or 2))
+
+    wb = get_workbook(clean_path)
+    with wb.lock:
+        rows = wb.sheet(sheet)
+        header = rows.header()
+        cols = resolve_columns(header, columns)
+        first = start_row + (page - 1) * page_size
+        last = first + page_size - 1
+        if end_row: last = min(last, int(end_row))
+
+        lines = [" | ".join(["行"] + [column_label(i, header) for i in cols])]
+        shown = 0
+        for row_no, values in rows.iter_from(first):
+            if row_no > last: break
+            lines.append(" | ".join([str(row_no)] + [format_cell(values[i]) if i < len(values) else "" for i in cols]))
+            shown += 1
+        has_more = not (end_row and last >= int(end_row)) and rows.has_row(last + 1) # 多读一行以判断是否还有下一页
+        total = rows.total_rows()
+
+    others = [n for n in wb.sheetnames if n != rows.title]
+    total_note = f"共 {total} 行" if rows.complete else (f"约 {total} 行" if total else "总行数未知")
+    head = f"[工作表: {rows.title}{' (其他: ' + ', '.join(others) + ')' if others else ''} | {total_note} (含表头)]"
+    if not shown:
+        return f"{head}\n第 {first} 行之后没有数据"
+    foot = f"[第 {first}-{first + shown - 1} 行" + (f"，下一页: page={page + 1}]" if has_more else "，已到末尾]")
+    return "\n".join([head] + lines + [foot])
+
+
+@tool_registry.register(
+    name="excel_profile",
+    description="Get a compact overview of an Excel workbook in one call: for every sheet and column the inferred type, "
+                "null count, min/max, distinct-value count (estimated for large columns) and most frequent values. "
+                "Use this first to understand an unfamiliar spreadsheet instead of reading rows.",
+    parameters={
+        "type": "object",
+        "properties": {
+            "file_path": {"type": "string"},
+            "sheet": {"type": "string", "description": "Only show this sheet (name or 1-based index), default all sheets"}
+        },
+        "required": ["file_path"]
+    }
+)
+@safe_execute("Excel概览失败")
+def profile_excel(file_path, sheet=None):
+    """只读流式遍历一次得到逐列统计，按文件哈希缓存，文件未改动时直接返回"""
     clean_path = SecurityManager.sanitize_path(file_path)
-    wb = openpyxl.load_workbook(clean_path, data_only=True)
-    sheet = wb.active
-    data = []
-    # 简单读取前20行
-    for row in sheet.iter_rows(max_row=20, values_only=True):
-        data.append(str(row))
-    return "\n".join(data)
+    _flush_pending(clean_path)
+    profile, cached = get_profile(clean_path)
+    return render_profile(profile, sheet, cached)
 
 
 @tool_registry.register(
     name="excel_write",  # 这里的名字必须和模型调用的名字完全一致
-    description="Write or append data to an Excel file.",
+    description="Append rows to an Excel file. Pass many rows at once via `rows` instead of calling this tool once per row. "
+                "Appends are buffered and saved together at the end of the current step.",
     parameters={
         "type": "object",
         "properties": {
@@ -76,42 +158,33 @@ def read_excel(file_path, query=None):
                 "items": {"type": "string"},
                 "description": "A list of data to append as a new row, e.g. ['Tom', '18', 'Student']"
             },
+            "rows": {
+                "type": "array",
+                "items": {"type": "array", "items": {"type": "string"}},
+                "description": "Several rows to append in order, e.g. [['Tom', '18'], ['Ann', '20']]"
+            },
             "sheet_name": {
                 "type": "string",
                 "description": "Optional sheet name, default is active sheet"
             }
         },
-        "required": ["file_path", "data"]
+        "required": ["file_path"]
     }
 )
 @safe_execute("Excel写入失败")
-def write_excel_row(file_path, data, sheet_name=None):
+def write_excel_row(file_path, data=None, sheet_name=None, rows=None):
     # 1. 路径安全清洗
     clean_path = SecurityManager.sanitize_path(file_path)
-    
-    # 2. 加载工作簿 (注意：这里不能用 read_only=True，因为要写入)
-    wb = openpyxl.load_workbook(clean_path)
-    
-    # 3. 选择工作表
-    if sheet_name and sheet_name in wb.sheetnames:
-        sheet = wb[sheet_name]
-    else:
-        sheet = wb.active
-        
-    # 4. 追加数据 (openpyxl 的 append 方法可以直接接受列表)
-    # 注意：如果 data 是字符串形式的列表 "[a,b]"，可能需要先转成 list
-    if isinstance(data, str):
-        # 简单的字符串转列表处理，防止模型传错类型
-        import ast
-        try:
-            data = ast.literal_eval(data)
-        except:
-            # 如果转换失败，就把字符串当做单列数据
-            data = [data]
-            
-    sheet.append(data)
-    
-    # 5. 保存文件
-    wb.save(clean_path)
-    
-    return f"成功写入数据: {data}"
\ No newline at end of file
+    if not os.path.exists(clean_path): raise FileNotFoundError(f"文件不存在: {file_path}")
+
+    # 2. 整理待追加的行 (data 为单行，rows 为多行；字符串形式的列表先解析)
+    if isinstance(rows, str): rows = parse_row(rows)
+    new_rows = [parse_row(r) for r in (rows or [])]
+    if data is not None: new_rows.insert(0, parse_row(data))
+    if not new_rows: return "未提供 data 或 rows"
+
+    # 3. 加入写入缓冲：同一步内对同一文件的追加合并为一次加载、一次保存
+    pending = write_buffer.append(clean_path, new_rows, sheet_name)
+    preview = new_rows[0] if len(new_rows) == 1 else f"{new_rows[0]} 等 {len(new_rows)} 行"
+    if not pending: return f"成功写入数据: {preview}"
+    return f"成功写入数据: {preview} (该文件共 {pending} 行待保存，本步结束时统一写入)"
\ No newline at end of file
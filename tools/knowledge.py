@@ -1,298 +1,1299 @@
 import os
-import hashlib
 import chromadb
 from chromadb.api.types import Documents, EmbeddingFunction, Embeddings
 from utils.logger import logger
-from utils.error_handling import safe_execute
+from utils.error_handling import safe_execute, TaskCancelled
 from tools.registry import tool_registry
 import ollama
 import re
+import json
+import time
+import queue
+import threading
+import multiprocessing
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, as_completed
+from core.config_handler import ConfigHandler
+from utils.embedding_cache import EmbeddingCache, get_embedding_cache
+from utils.ttl_cache import TTLCache
+from utils.doc_catalog import DocumentCatalog
+from utils.lexical_index import BM25Index, reciprocal_rank_fusion
+from utils.vector_store import QuantizedVectorStore, migrate_from_chroma
+from utils.near_dup import NearDupIndex
+from utils.doc_summary import DocSummaryIndex
+from utils.kb_snapshot import write_snapshot, read_manifest, iter_snapshot
+from utils.index_maintenance import (MaintenanceLog, hnsw_settings, hnsw_metadata, current_hnsw, apply_search_ef,
+                                     rebuild_chroma_collection, probe_hnsw)
+from utils.doc_extract import (IMAGE_EXTS, PDF_OPTIONS, calculate_hash, chunk_hash, is_supported, iter_text_segments, iter_chunks,
+                               iter_file_chunks, extract_chunks, configure_pdf_extraction)
 
 # === 可选依赖导入 ===
-try:
-    import pypdf
-except ImportError:
-    pypdf = None
+from tools.reranker import HAS_FLASHRANK, get_reranker_service, preload_reranker
+if not HAS_FLASHRANK:
+    logger.warning("FlashRank not installed. Rerank disabled.")
 
 try:
-    import docx
+    import numpy as np
+    import onnxruntime as ort
+    from tokenizers import Tokenizer
+    HAS_ONNX = True
 except ImportError:
-    docx = None
+    HAS_ONNX = False
 
-try:
-    from flashrank import Ranker, RerankRequest
-    HAS_FLASHRANK = True
-except ImportError:
-    HAS_FLASHRANK = False
-    logger.warning("FlashRank not installed. Rerank disabled.")
+LOCAL_EMBED_PREFIX = "onnx:" # 本地 ONNX 嵌入模型在模型列表中的前缀，如 onnx:bge-small-zh-v1.5
 
-class OllamaEmbeddingFunction(EmbeddingFunction):
-    def __init__(self, model_name="nomic-embed-text", base_url="http://127.0.0.1:11434"):
+# === 嵌入后端 ===
+class EmbeddingBackend:
+    """
+    嵌入后端接口：embed(texts) 返回与 texts 等长的向量列表，失败项为 None。
+    cache_key 用于区分不同后端/模型的缓存条目。
+    """
+    cache_key = "base"
+    batch_size = 32
+    max_workers = 1
+    dim = 768
+
+    def embed(self, texts):
+        raise NotImplementedError
+
+class OllamaBackend(EmbeddingBackend):
+    """
+    Ollama HTTP 后端 (批量 + 并发)
+    - 每次请求通过 /api/embed 批量发送 batch_size 个切片
+    - 线程池同时保持 max_workers 个批次在途
+    - 服务端没有批量接口 (旧版 Ollama，/api/embed 返回 404) 时永久回退到逐条 /api/embeddings；
+      超时、连接中断等临时错误只让当前批次逐条重试，之后仍走批量接口
+    """
+    def __init__(self, model_name="nomic-embed-text", base_url="http://127.0.0.1:11434", batch_size=32, max_workers=4):
         self.model_name = model_name
+        self.cache_key = model_name
         self.client = ollama.Client(host=base_url)
+        self.batch_size = max(1, int(batch_size))
+        self.max_workers = max(1, int(max_workers))
+        self._batch_supported = hasattr(self.client, "embed")
 
-    def __call__(self, input: Documents) -> Embeddings:
-        embeddings = []
-        for text in input:
+    def _embed_single(self, text):
+        try:
+            resp = self.client.embeddings(model=self.model_name, prompt=text)
+            vec = resp["embedding"]
+            self.dim = len(vec) or self.dim
+            return vec
+        except Exception as e:
+            logger.error(f"Embedding Error: {e}")
+            return None # 失败标记，由上层补零且不写入缓存
+
+    def _embed_batch(self, texts):
+        if self._batch_supported:
+            try:
+                resp = self.client.embed(model=self.model_name, input=texts)
+                vecs = resp["embeddings"]
+                if len(vecs) == len(texts):
+                    if vecs: self.dim = len(vecs[0]) or self.dim
+                    return [list(v) for v in vecs]
+                logger.warning(f"Batch embedding size mismatch: {len(vecs)} != {len(texts)}, fallback")
+            except Exception as e:
+                if self._endpoint_missing(e):
+                    logger.warning(f"Batch embedding not supported by server, fallback to single mode: {e}")
+                    self._batch_supported = False
+                else:
+                    logger.warning(f"Batch embedding failed, retrying this batch one by one: {e}")
+        return [self._embed_single(t) for t in texts]
+
+    @staticmethod
+    def _endpoint_missing(error):
+        """旧版 Ollama 对 /api/embed 返回 404；模型不存在同样是 404，但错误信息会提到 model"""
+        if not isinstance(error, getattr(ollama, "ResponseError", ())): return False
+        return getattr(error, "status_code", None) == 404 and "model" not in str(getattr(error, "error", error)).lower()
+
+    def embed(self, texts):
+        batches = [texts[i:i + self.batch_size] for i in range(0, len(texts), self.batch_size)]
+        if len(batches) == 1 or self.max_workers == 1:
+            results = [self._embed_batch(b) for b in batches]
+        else:
+            with ThreadPoolExecutor(max_workers=min(self.max_workers, len(batches))) as pool:
+                # map 保证返回顺序与输入一致
+                results = list(pool.map(self._embed_batch, batches))
+        return [vec for batch in results for vec in batch]
+
+class OnnxBackend(EmbeddingBackend):
+    """
+    进程内 ONNX/CPU 后端 (fastembed / sentence-transformers 导出的模型)
+    模型目录: models/<name>/ 下包含 *.onnx 与 tokenizer.json。
+    不经过 HTTP，也不占用 Ollama，查询向量只需几毫秒。
+    """
+    def __init__(self, model_dir, threads=4, batch_size=32, max_length=512, pooling=None):
+        if not HAS_ONNX: raise ImportError("缺少 onnxruntime / tokenizers / numpy，无法使用本地嵌入模型")
+        self.model_dir = model_dir
+        self.cache_key = f"{LOCAL_EMBED_PREFIX}{os.path.basename(os.path.normpath(model_dir))}"
+        self.batch_size = max(1, int(batch_size))
+        self.pooling = pooling or self._detect_pooling(model_dir)
+
+        onnx_files = sorted(f for f in os.listdir(model_dir) if f.endswith(".onnx"))
+        if not onnx_files: raise FileNotFoundError(f"{model_dir} 中没有 .onnx 模型文件")
+        model_file = "model.onnx" if "model.onnx" in onnx_files else onnx_files[0]
+
+        opts = ort.SessionOptions()
+        opts.intra_op_num_threads = max(1, int(threads))
+        opts.inter_op_num_threads = 1
+        self.session = ort.InferenceSession(os.path.join(model_dir, model_file), sess_options=opts, providers=["CPUExecutionProvider"])
+        self.input_names = {i.name for i in self.session.get_inputs()}
+
+        self.tokenizer = Tokenizer.from_file(os.path.join(model_dir, "tokenizer.json"))
+        self.tokenizer.enable_truncation(max_length=max_length)
+        if self.tokenizer.padding is None:
+            self.tokenizer.enable_padding()
+
+    @staticmethod
+    def _detect_pooling(model_dir):
+        """sentence-transformers 目录结构里的 1_Pooling/config.json 指明池化方式，缺省为 mean"""
+        conf_path = os.path.join(model_dir, "1_Pooling", "config.json")
+        if os.path.exists(conf_path):
+            try:
+                with open(conf_path, 'r', encoding='utf-8') as f:
+                    if json.load(f).get("pooling_mode_cls_token"): return "cls"
+            except Exception: pass
+        return "mean"
+
+    def _run(self, texts):
+        enc = self.tokenizer.encode_batch(texts)
+        mask = np.array([e.attention_mask for e in enc], dtype=np.int64)
+        feeds = {
+            "input_ids": np.array([e.ids for e in enc], dtype=np.int64),
+            "attention_mask": mask,
+            "token_type_ids": np.array([e.type_ids for e in enc], dtype=np.int64)
+        }
+        out = self.session.run(None, {k: v for k, v in feeds.items() if k in self.input_names})[0]
+        if out.ndim == 3:
+            if self.pooling == "cls":
+                out = out[:, 0]
+            else:
+                m = mask[..., None].astype(out.dtype)
+                out = (out * m).sum(axis=1) / np.clip(m.sum(axis=1), 1e-9, None)
+        out = out / np.clip(np.linalg.norm(out, axis=1, keepdims=True), 1e-12, None)
+        self.dim = out.shape[1]
+        return out.tolist()
+
+    def embed(self, texts):
+        results = []
+        for i in range(0, len(texts), self.batch_size):
+            batch = texts[i:i + self.batch_size]
             try:
-                resp = self.client.embeddings(model=self.model_name, prompt=text)
-                embeddings.append(resp["embedding"])
+                results.extend(self._run(batch))
             except Exception as e:
-                logger.error(f"Embedding Error: {e}")
-                embeddings.append([0.0]*768)
+                logger.error(f"ONNX Embedding Error: {e}")
+                results.extend([None] * len(batch))
+        return results
+
+def is_local_embedding_model(model_dir):
+    """含 onnx + tokenizer.json 且不是 FlashRank 重排序模型 (SequenceClassification) 的目录"""
+    if not os.path.isdir(model_dir): return False
+    files = os.listdir(model_dir)
+    if "tokenizer.json" not in files or not any(f.endswith(".onnx") for f in files): return False
+    if any(f.startswith("flashrank") for f in files): return False
+    conf_path = os.path.join(model_dir, "config.json")
+    if os.path.exists(conf_path):
+        try:
+            with open(conf_path, 'r', encoding='utf-8') as f:
+                archs = json.load(f).get("architectures") or []
+            if any("SequenceClassification" in a for a in archs): return False
+        except Exception: pass
+    return True
+
+class CachedEmbeddingFunction(EmbeddingFunction):
+    """
+    Chroma 嵌入函数：先查内容寻址缓存，只把未命中的切片交给后端
+    """
+    def __init__(self, backend, cache=None):
+        self.backend = backend
+        self.cache = cache
+        # 最近一次调用的吞吐统计，便于按模型调参
+        self.last_stats = {"chunks": 0, "cached": 0, "model_calls": 0, "seconds": 0.0, "chunks_per_sec": 0.0}
+
+    @property
+    def model_name(self):
+        return self.backend.cache_key
+
+    @property
+    def batch_size(self):
+        return self.backend.batch_size
+
+    @property
+    def max_workers(self):
+        return self.backend.max_workers
+
+    def __call__(self, input: Documents) -> Embeddings:
+        texts = list(input)
+        if not texts: return []
+        start_time = time.perf_counter()
+
+        # 1. 查缓存
+        hashes = [EmbeddingCache.text_hash(t) for t in texts]
+        cached = self.cache.get_many(self.model_name, hashes) if self.cache else {}
+
+        # 2. 未命中的切片去重后请求模型
+        pending = {}
+        for h, t in zip(hashes, texts):
+            if h not in cached and h not in pending:
+                pending[h] = t
+        fresh = {}
+        if pending:
+            vecs = self.backend.embed(list(pending.values()))
+            fresh = dict(zip(pending.keys(), vecs))
+            if self.cache:
+                self.cache.put_many(self.model_name, [(h, v) for h, v in fresh.items() if v is not None])
+
+        embeddings = []
+        for h in hashes:
+            vec = cached.get(h) or fresh.get(h)
+            embeddings.append(vec if vec is not None else [0.0] * self.backend.dim)
+
+        elapsed = time.perf_counter() - start_time
+        rate = len(texts) / elapsed if elapsed > 0 else 0.0
+        self.last_stats = {
+            "chunks": len(texts), "cached": len(texts) - len(pending) if self.cache else 0, "model_calls": len(pending),
+            "seconds": round(elapsed, 3), "chunks_per_sec": round(rate, 1)
+        }
+        if len(texts) > 1:
+            logger.info(f"[Embedding] {self.model_name}: {len(texts)} chunks ({len(pending)} uncached) in {elapsed:.2f}s ({rate:.1f} chunks/s, batch={self.batch_size}, workers={self.max_workers})")
         return embeddings
 
+class OllamaEmbeddingFunction(CachedEmbeddingFunction):
+    """兼容旧接口：Ollama 后端 + 可选缓存"""
+    def __init__(self, model_name="nomic-embed-text", base_url="http://127.0.0.1:11434", batch_size=32, max_workers=4, cache=None):
+        super().__init__(OllamaBackend(model_name, base_url, batch_size, max_workers), cache)
+
 class KnowledgeBase:
     _client = None
     _collection = None
     _current_embed_model = None
-    _ranker = None
-    _current_ranker_model = None
+    _current_store = None
+    _embed_fn = None
+    PIPELINE_DEPTH = 4 # 提取线程与嵌入之间最多缓冲的批次数
 
     def __init__(self):
         self.db_path = "chroma_db"
+        self._lexical_indexes = {}
+        self._catalogs = {}
+        self._near_dup_indexes = {}
+        self._doc_summaries = {}
+        # 上面几类按 collection 懒加载的索引：后台索引线程与页面线程都会首次访问，创建过程需加锁；
+        # 可重入，因为创建摘要索引时会取文档目录
+        self._indexes_lock = threading.RLock()
+        self._local_backends = {}
+        self._collections = {} # (嵌入模型, 存储后端) -> (collection, 嵌入函数)
+        self._collections_lock = threading.Lock()
+        rag_conf = ConfigHandler.load().get("rag", {})
+        cache_size = rag_conf.get("search_cache_size", 256)
+        cache_ttl = rag_conf.get("search_cache_ttl", 600)
+        self._query_embed_cache = TTLCache(cache_size, cache_ttl)
+        self._result_cache = TTLCache(cache_size, cache_ttl)
         os.makedirs(self.db_path, exist_ok=True)
+        configure_pdf_extraction(
+            workers=rag_conf.get("pdf_workers", 0), min_pages=rag_conf.get("pdf_parallel_min_pages", 32),
+            cache_path=os.path.join(self.db_path, "pdf_pages.db") if rag_conf.get("pdf_page_cache", True) else None,
+            cache_max_mb=rag_conf.get("pdf_page_cache_mb", 512)
+        )
+        self._maintenance = MaintenanceLog(os.path.join(self.db_path, "maintenance.json"))
         try:
             self._client = chromadb.PersistentClient(path=self.db_path)
         except Exception as e:
             logger.error(f"Chroma Init Fail: {e}")
 
     def _get_collection(self, embed_model_name):
-        if not self._client: return None
-        if self._collection is None or self._current_embed_model != embed_model_name:
-            self._current_embed_model = embed_model_name
+        entry = self._open_collection(embed_model_name)
+        if entry is None: return None
+        self._collection, self._embed_fn = entry
+        self._current_embed_model = embed_model_name
+        self._current_store = ConfigHandler.load().get("rag", {}).get("vector_store", "chroma")
+        return self._collection
+
+    def _get_embed_fn(self, embed_model_name):
+        entry = self._open_collection(embed_model_name)
+        return entry[1] if entry else None
+
+    @staticmethod
+    def _collection_name(embed_model_name):
+        return f"kb_{embed_model_name.replace(':', '_').replace('.', '_')}"
+
+    def _open_collection(self, embed_model_name):
+        """
+        按 (嵌入模型, 存储后端) 缓存已打开的 collection 及其嵌入函数，返回 (collection, 嵌入函数)
+        多个模型的 collection 可同时打开：后台索引任务、联合检索与界面切换模型互不挤占
+        """
+        rag_conf = ConfigHandler.load().get("rag", {})
+        store_type = rag_conf.get("vector_store", "chroma")
+        if not self._client and store_type != "quantized": return None
+        key = (embed_model_name, store_type)
+        with self._collections_lock:
+            entry = self._collections.get(key)
+            if entry is not None: return entry
             try:
-                safe_name = f"kb_{embed_model_name.replace(':', '_').replace('.', '_')}"
-                self._collection = self._client.get_or_create_collection(
-                    name=safe_name,
-                    embedding_function=OllamaEmbeddingFunction(model_name=embed_model_name)
+                safe_name = self._collection_name(embed_model_name)
+                embed_fn = CachedEmbeddingFunction(
+                    self._get_backend(embed_model_name),
+                    cache=get_embedding_cache(max_entries=rag_conf.get("embed_cache_max_entries", 200000)) if rag_conf.get("embed_cache", True) else None
                 )
+                if store_type == "quantized":
+                    coll = self._open_quantized_store(safe_name, embed_fn, rag_conf)
+                else:
+                    coll = self._open_chroma_collection(safe_name, embed_fn, rag_conf)
             except Exception as e:
                 logger.error(f"Collection Error: {e}")
                 return None
-        return self._collection
+            self._maintenance.record_model(safe_name, embed_model_name)
+            entry = self._collections[key] = (coll, embed_fn)
+            return entry
+
+    def _open_chroma_collection(self, safe_name, embed_fn, rag_conf):
+        """
+        HNSW 参数 (rag.hnsw + rag.hnsw_overrides) 只在创建时生效；
+        已有 collection 的 search_ef 与配置不同时尝试在线修改，M / construction_ef 需离线重建
+        """
+        settings = hnsw_settings(safe_name, rag_conf)
+        try:
+            coll = self._client.get_collection(name=safe_name, embedding_function=embed_fn)
+        except Exception:
+            return self._client.create_collection(name=safe_name, embedding_function=embed_fn, metadata=hnsw_metadata(settings))
+        if current_hnsw(coll)["search_ef"] != settings["search_ef"]:
+            apply_search_ef(coll, settings["search_ef"])
+        return coll
+
+    def _open_quantized_store(self, safe_name, embed_fn, rag_conf):
+        """
+        量化向量库存放在 chroma_db/quantized/<collection>/，与 Chroma 同名，
+        词法索引和文档目录可直接沿用。库为空而 Chroma 中已有同名 collection 时一次性迁移。
+        """
+        rescore = rag_conf.get("vector_rescore", 0)
+        store = QuantizedVectorStore(
+            os.path.join(self.db_path, "quantized", safe_name), safe_name,
+            embedding_function=embed_fn,
+            dtype=rag_conf.get("vector_dtype", "int8"),
+            keep_full=rescore > 0, rescore_k=rescore
+        )
+        if not store.count() and self._client:
+            try:
+                legacy = self._client.get_collection(name=safe_name, embedding_function=embed_fn)
+            except Exception:
+                legacy = None
+            if legacy is not None and legacy.count():
+                logger.info(f"[VectorStore] 开始从 Chroma 迁移 {safe_name} ({legacy.count()} 个切片)...")
+                migrate_from_chroma(legacy, store)
+        return store
+
+    def _get_backend(self, embed_model_name):
+        """按模型名选择嵌入后端：onnx:<目录名> 走进程内 ONNX，其余走 Ollama HTTP"""
+        config = ConfigHandler.load()
+        rag_conf = config.get("rag", {})
+        if embed_model_name.startswith(LOCAL_EMBED_PREFIX):
+            # ONNX 会话加载较慢，按模型缓存复用
+            backend = self._local_backends.get(embed_model_name)
+            if backend is None:
+                backend = OnnxBackend(
+                    os.path.join("models", embed_model_name[len(LOCAL_EMBED_PREFIX):]),
+                    threads=rag_conf.get("onnx_threads", 4),
+                    batch_size=rag_conf.get("onnx_batch_size", 32)
+                )
+                self._local_backends[embed_model_name] = backend
+            return backend
+        ollama_url = config.get("providers", {}).get("Ollama", {}).get("base_url", "http://127.0.0.1:11434")
+        return OllamaBackend(
+            model_name=embed_model_name,
+            base_url=ollama_url,
+            batch_size=rag_conf.get("embed_batch_size", 32),
+            max_workers=rag_conf.get("embed_workers", 4)
+        )
+
+    @staticmethod
+    def _reranker_options():
+        rag_conf = ConfigHandler.load().get("rag", {})
+        return {
+            "cache_dir": "models",
+            "threads": rag_conf.get("rerank_threads", 2),
+            "max_batch": rag_conf.get("rerank_max_batch", 64),
+            "batch_wait_ms": rag_conf.get("rerank_batch_wait_ms", 5)
+        }
 
     def _get_ranker(self, model_name):
+        """共享的重排序服务 (模型名可能带 " (Auto Download)" 之类的后缀)"""
         if not HAS_FLASHRANK: return None
         real_name = model_name.split(" ")[0]
-        if self._ranker is None or self._current_ranker_model != real_name:
-            try:
-                self._ranker = Ranker(model_name=real_name, cache_dir="models")
-                self._current_ranker_model = real_name
-            except Exception as e:
-                logger.error(f"Reranker Init Fail: {e}")
-                return None
-        return self._ranker
+        svc = get_reranker_service(real_name, **self._reranker_options())
+        try:
+            return svc.load()
+        except Exception as e:
+            logger.error(f"Reranker Init Fail: {e}")
+            return None
+
+    def preload_ranker(self, model_name):
+        """启动时后台加载并预热重排序模型"""
+        if not HAS_FLASHRANK or not model_name: return None
+        return preload_reranker(model_name.split(" ")[0], **self._reranker_options())
+
+    def get_rerank_stats(self, model_name):
+        if not HAS_FLASHRANK or not model_name: return None
+        return get_reranker_service(model_name.split(" ")[0], **self._reranker_options()).stats()
+
+    def _get_lexical_index(self, coll):
+        """每个 collection 对应一个 BM25 索引，存放在 chroma_db/lexical/ 下"""
+        with self._indexes_lock:
+            idx = self._lexical_indexes.get(coll.name)
+            if idx is None:
+                idx = BM25Index(os.path.join(self.db_path, "lexical", f"{coll.name}.db"))
+                # 兼容老数据：向量库有内容但词法索引为空时，一次性重建
+                if not len(idx) and coll.count():
+                    idx.rebuild_from(coll)
+                self._lexical_indexes[coll.name] = idx
+            return idx
+
+    def _get_catalog(self, coll):
+        """每个 collection 对应一份文档目录，存放在 chroma_db/catalog/ 下"""
+        with self._indexes_lock:
+            catalog = self._catalogs.get(coll.name)
+            if catalog is None:
+                catalog = DocumentCatalog(os.path.join(self.db_path, "catalog", f"{coll.name}.db"))
+                if not len(catalog) and coll.count():
+                    catalog.rebuild_from(coll)
+                self._catalogs[coll.name] = catalog
+            return catalog
+
+    def _get_near_dup_index(self, coll):
+        """每个 collection 对应一份 MinHash/LSH 近似去重索引，存放在 chroma_db/neardup/ 下；关闭或缺少 numpy 时返回 None"""
+        rag_conf = ConfigHandler.load().get("rag", {})
+        if not rag_conf.get("dedup_near", True): return None
+        with self._indexes_lock:
+            idx = self._near_dup_indexes.get(coll.name)
+            if idx is None:
+                try:
+                    idx = NearDupIndex(os.path.join(self.db_path, "neardup", f"{coll.name}.db"), threshold=rag_conf.get("dedup_threshold", 0.9))
+                except ImportError as e:
+                    logger.warning(f"Near-duplicate detection disabled: {e}")
+                    return None
+                if not len(idx) and coll.count():
+                    idx.rebuild_from(coll)
+                self._near_dup_indexes[coll.name] = idx
+            return idx
+
+    def _get_doc_summary(self, coll):
+        """每个 collection 对应一份文档级摘要向量索引 (分层检索第一层)，存放在 chroma_db/docsum/ 下"""
+        with self._indexes_lock:
+            idx = self._doc_summaries.get(coll.name)
+            if idx is None:
+                try:
+                    idx = DocSummaryIndex(os.path.join(self.db_path, "docsum", f"{coll.name}.db"))
+                except ImportError as e:
+                    logger.warning(f"Hierarchical search disabled: {e}")
+                    return None
+                catalog = self._get_catalog(coll)
+                if not len(idx) and len(catalog):
+                    idx.rebuild_from(catalog, lambda source: self._file_vectors(coll, source))
+                self._doc_summaries[coll.name] = idx
+            return idx
+
+    def _file_vectors(self, coll, fname):
+        """文件的全部切片向量：自有切片 + 以近似重复方式引用的切片"""
+        data = coll.get(where={"source": fname}, include=['embeddings'])
+        vecs = list(data['embeddings']) if data.get('embeddings') is not None else []
+        near = self._get_near_dup_index(coll)
+        extra = list(near.chunks_referenced_by([fname])) if near is not None else []
+        if extra:
+            more = coll.get(ids=extra, include=['embeddings'])
+            if more.get('embeddings') is not None: vecs.extend(more['embeddings'])
+        return vecs
+
+    def _register_file(self, coll, fname, fhash, chunk_count, file_path):
+        """文件的全部切片写入成功后：登记文档目录，并刷新其摘要向量"""
+        summary = self._get_doc_summary(coll) # 先取索引：老数据的一次性重建不应包含本文件
+        self._get_catalog(coll).upsert(fname, fhash, chunk_count, file_path)
+        if summary is not None:
+            summary.upsert(fname, fhash, self._file_vectors(coll, fname), file_path)
+
+    def _upsert_chunks(self, coll, documents, ids, metadatas, exclude=None):
+        """
+        所有切片写入的唯一入口：向量库与词法索引同步更新
+        近似重复的切片不再嵌入入库，只登记为已有切片的引用；返回这些切片的 id
+        exclude: 不可作为查重对象的已有切片 id (增量更新时为旧版本的切片)
+        """
+        near = self._get_near_dup_index(coll)
+        refs = []
+        if near is not None:
+            sigs, dup_of = near.plan(ids, documents, exclude)
+            if dup_of:
+                refs = [(cid, dup_of[cid], m.get("source"), m.get("file_hash")) for cid, m in zip(ids, metadatas) if cid in dup_of]
+                keep = [i for i, cid in enumerate(ids) if cid not in dup_of]
+                documents, ids, metadatas = [documents[i] for i in keep], [ids[i] for i in keep], [metadatas[i] for i in keep]
+                sigs = [sigs[i] for i in keep]
+        lexical = self._get_lexical_index(coll)
+        if ids:
+            coll.add(documents=documents, ids=ids, metadatas=metadatas)
+            lexical.add(ids, documents, metadatas)
+        if near is not None: near.commit(list(zip(ids, sigs)), refs)
+        self._invalidate_search_cache(coll)
+        return [r[0] for r in refs]
+
+    def _delete_chunks(self, coll, where=None, ids=None):
+        """所有切片删除的唯一入口，where 为 {"source": ...} 或 {"file_hash": ...}，或直接给出 ids"""
+        near = self._get_near_dup_index(coll)
+        if where is not None:
+            # 先去掉该文件作为引用方的记录，再按 id 删除 (便于过户与统计删除量)
+            if near is not None: near.drop_refs(where)
+            ids = coll.get(where=where, include=[])['ids']
+        if near is not None:
+            # 仍被其他文件引用的切片过户，剩下的才真正删除
+            ids = self._transfer_referenced(coll, near, ids)
+            near.remove_chunks(ids)
+        if not ids: return
+        coll.delete(ids=ids)
+        self._get_lexical_index(coll).delete_ids(ids)
+        # HNSW 删除只留墓碑，累计删除量用于提示重建
+        self._maintenance.record_deletes(coll.name, len(ids))
+        self._invalidate_search_cache(coll)
+
+    def _transfer_referenced(self, coll, near, ids):
+        """被其他文件引用的规范切片改挂到其中一个引用方名下，返回不再被引用、可以删除的 id"""
+        referenced = near.refs_for(ids)
+        if not referenced: return list(ids)
+        current = coll.get(ids=list(referenced), include=['metadatas'])
+        moved_ids, moved_metas = [], []
+        for cid, meta in zip(current['ids'], current['metadatas']):
+            owner = near.take_ref(cid)
+            if owner is None: continue
+            moved_ids.append(cid)
+            moved_metas.append({**(meta or {}), **owner})
+        self._update_chunk_metadata(coll, moved_ids, moved_metas)
+        moved = set(moved_ids)
+        return [cid for cid in ids if cid not in moved]
+
+    def _update_chunk_metadata(self, coll, ids, metadatas):
+        """只改元数据 (不重新嵌入)"""
+        if not ids: return
+        coll.update(ids=ids, metadatas=metadatas)
+        self._get_lexical_index(coll).update_metadata(ids, metadatas)
+        self._invalidate_search_cache(coll)
+
+    def _invalidate_search_cache(self, coll):
+        """collection 内容变化后，丢弃该 collection 的所有检索结果缓存 (含联合检索到它的结果)"""
+        self._result_cache.invalidate(lambda key: key[0] == coll.name or coll.name in key[-1])
 
     def _calculate_hash(self, file_path):
-        h = hashlib.md5()
-        with open(file_path, 'rb') as f: h.update(f.read())
-        return h.hexdigest()
+        return calculate_hash(file_path)
 
     def _extract_text(self, file_path):
-        """提取文本：支持 txt, md, xlsx, pdf, docx"""
-        ext = os.path.splitext(file_path)[1].lower()
-        
-        # 1. Excel
-        if ext in ['.xlsx', '.xls']:
-            import openpyxl
-            wb = openpyxl.load_workbook(file_path, data_only=True)
-            text = []
-            for sheet in wb.worksheets:
-                text.append(f"--- Sheet: {sheet.title} ---")
-                for row in sheet.iter_rows(values_only=True):
-                    cleaned_row = [str(c) for c in row if c is not None]
-                    if cleaned_row:
-                        row_txt = " | ".join(cleaned_row)
-                        text.append(row_txt)
-            return "\n".join(text)
-        
-        # 2. PDF
-        elif ext == '.pdf':
-            if not pypdf: return "Error: 缺少 pypdf 库，无法解析 PDF"
-            try:
-                reader = pypdf.PdfReader(file_path)
-                text = []
-                for page in reader.pages:
-                    text.append(page.extract_text() or "")
-                return "\n".join(text)
-            except Exception as e:
-                return f"PDF解析失败: {e}"
-
-        # 3. Word (Docx)
-        elif ext == '.docx':
-            if not docx: return "Error: 缺少 python-docx 库，无法解析 Docx"
-            try:
-                doc = docx.Document(file_path)
-                return "\n".join([p.text for p in doc.paragraphs])
-            except Exception as e:
-                return f"Docx解析失败: {e}"
-        
-        # 4. 图片 (不支持)
-        elif ext in ['.png', '.jpg', '.jpeg', '.bmp']:
-            return None # 返回 None 表示不支持，上层会处理
-            
-        # 5. 纯文本
-        elif ext in ['.txt', '.md', '.py', '.json', '.csv', '.html']:
-            try:
-                with open(file_path, 'r', encoding='utf-8', errors='ignore') as f: return f.read()
-            except: return None
-            
-        return None
+        """提取完整文本：支持 txt, md, xlsx, pdf, docx (大文件请使用流式的 iter_text_segments)"""
+        if not is_supported(file_path): return None # 返回 None 表示不支持，上层会处理
+        try:
+            return "\n".join(iter_text_segments(file_path))
+        except Exception as e:
+            return f"解析失败: {e}"
 
     # === 安全的迭代切分算法 (修复内存溢出/崩溃) ===
     def _safe_split_text(self, text, chunk_size=600, overlap=100):
         if not text: return []
-        
-        chunks = []
-        total_len = len(text)
-        start = 0
-        
-        while start < total_len:
-            # 确定硬截止点
-            end = min(start + chunk_size, total_len)
-            
-            # 如果还没到文件末尾，尝试优化切分点（找换行符）
-            if end < total_len:
-                # 在窗口后半部分寻找最近的换行符
-                # 搜索范围：[end - chunk_size//2, end]
-                lookback_limit = max(start, end - chunk_size // 2)
-                
-                # 优先找双换行（段落）
-                last_newline = text.rfind('\n\n', lookback_limit, end)
-                if last_newline != -1:
-                    end = last_newline + 2 # 保留换行符
-                else:
-                    # 其次找单换行
-                    last_newline = text.rfind('\n', lookback_limit, end)
-                    if last_newline != -1:
-                        end = last_newline + 1
-                    else:
-                        # 再其次找句号
-                        last_period = text.rfind('。', lookback_limit, end)
-                        if last_period != -1:
-                            end = last_period + 1
-                        
-                        # 实在找不到分隔符，就硬切，不回退，防止死循环
-            
-            # 提取切片
-            chunk = text[start:end].strip()
-            if chunk:
-                chunks.append(chunk)
-            
-            # 计算下一个 start
-            # 正常步进是 chunk长度 - overlap
-            # 但要防止死循环（步进为0），强制至少前进 1
-            step = max(1, (end - start) - overlap)
-            
-            # 如果是硬切且到了末尾，直接退出
-            if end == total_len:
-                break
-                
-            start += step
-            
-        return chunks
+        return list(iter_chunks([text], chunk_size, overlap))
+
+    def _stream_upsert(self, coll, chunk_iter, fname, fhash, batch_size, progress=None, cancel_event=None, exclude=None):
+        """
+        流式索引管道：后台线程负责 提取 -> 切分，当前线程负责 嵌入 -> 写入。
+        两者之间是有界队列，内存中最多只有 PIPELINE_DEPTH 个批次，
+        第一批切片就绪后立即开始嵌入，不必等整个文件解析完。
+        chunk_iter 产出 (切片序号, 切片文本)，切片 id 为 "{file_hash}_{序号}"。
+        progress(已写入, 已切出) 每批回调一次；cancel_event 被置位时抛出 TaskCancelled。
+        exclude 原样传给 _upsert_chunks。返回 (处理的切片数, 其中被合并为近似重复的切片数)。
+        """
+        q = queue.Queue(maxsize=self.PIPELINE_DEPTH)
+        stop = threading.Event()
+        done = object()
+        errors = []
+        produced = [0]
+
+        def _put(item):
+            while not stop.is_set():
+                try:
+                    q.put(item, timeout=0.5)
+                    return True
+                except queue.Full:
+                    continue
+            return False
+
+        def producer():
+            try:
+                batch = []
+                for chunk in chunk_iter:
+                    batch.append(chunk)
+                    produced[0] += 1
+                    if len(batch) >= batch_size:
+                        if not _put(batch): return
+                        batch = []
+                if batch: _put(batch)
+            except Exception as e:
+                errors.append(e)
+            finally:
+                _put(done)
+
+        worker = threading.Thread(target=producer, name=f"kb-extract-{fname}", daemon=True)
+        worker.start()
+
+        total = deduped = 0
+        try:
+            while True:
+                batch = q.get()
+                if batch is done: break
+                if cancel_event is not None and cancel_event.is_set():
+                    raise TaskCancelled("索引任务已取消")
+                deduped += len(self._upsert_chunks(
+                    coll,
+                    documents=[chunk for _, chunk in batch],
+                    ids=[f"{fhash}_{i}" for i, _ in batch],
+                    metadatas=[{"source": fname, "file_hash": fhash, "chunk_hash": chunk_hash(chunk)} for _, chunk in batch],
+                    exclude=exclude
+                ))
+                total += len(batch)
+                if progress: progress(total, produced[0])
+        finally:
+            stop.set()
+            worker.join()
+
+        if errors: raise errors[0]
+        return total, deduped
 
     @safe_execute("文档索引失败")
-    def add_document(self, file_path, embed_model_name="nomic-embed-text"):
+    def add_document(self, file_path, embed_model_name="nomic-embed-text", progress=None, cancel_event=None):
         coll = self._get_collection(embed_model_name)
         if not coll: return "DB连接失败"
         
         fname = os.path.basename(file_path)
-        fhash = self._calculate_hash(file_path)
-        
-        # 检查是否已存在
-        existing = coll.get(where={"file_hash": fhash})
-        if existing['ids']:
-            return f"文件 {fname} 已存在"
-            
-        content = self._extract_text(file_path)
-        
-        if content is None:
+        ext = os.path.splitext(file_path)[1].lower()
+        if not is_supported(file_path):
             # 特殊处理图片等不支持格式
-            ext = os.path.splitext(file_path)[1].lower()
-            if ext in ['.png', '.jpg', '.jpeg']:
+            if ext in IMAGE_EXTS:
                 return "❌ 图片文件不支持文本索引。请使用'代码解释器'或 Vision 模型进行分析。"
             return f"❌ 格式 {ext} 不支持文本解析"
-            
-        if not content.strip(): 
-            return "文件内容为空"
-        
-        # 使用新的安全切分策略
-        chunks = self._safe_split_text(content, chunk_size=600, overlap=100)
-        
-        if not chunks: return "未能生成有效切片"
 
-        ids = [f"{fhash}_{i}" for i in range(len(chunks))]
-        metas = [{"source": fname, "file_hash": fhash} for _ in chunks]
+        fhash = self._calculate_hash(file_path)
         
+        # 检查是否已存在 (查目录表，不扫描切片)
+        catalog = self._get_catalog(coll)
+        if catalog.has_hash(fhash):
+            return f"文件 {fname} 已存在"
+
         # 批量添加，防止单次请求过大
-        batch_size = 100
-        for i in range(0, len(chunks), batch_size):
-            coll.add(
-                documents=chunks[i:i+batch_size], 
-                ids=ids[i:i+batch_size], 
-                metadatas=metas[i:i+batch_size]
-            )
-            
-        return f"索引成功，共生成 {len(chunks)} 个切片"
+        # 每次 add 至少覆盖 batch_size * workers 个切片，让嵌入线程池跑满
+        embed_fn = self._get_embed_fn(embed_model_name)
+        batch_size = max(100, embed_fn.batch_size * embed_fn.max_workers)
+
+        # 同名文件的旧版本存在时，走增量更新
+        if catalog.get(fname):
+            previous = coll.get(where={"source": fname}, include=['documents', 'metadatas'])
+            return self._update_document(coll, file_path, fname, fhash, previous, batch_size, progress, cancel_event)
+
+        start_time = time.perf_counter()
+        cache = embed_fn.cache
+        hits_before = cache.hits if cache else 0
+
+        chunk_iter = enumerate(iter_file_chunks(file_path, chunk_size=600, overlap=100))
+        try:
+            total, deduped = self._stream_upsert(coll, chunk_iter, fname, fhash, batch_size, progress, cancel_event)
+        except Exception as e:
+            # 清理半途写入的切片，避免下次被误判为"已存在"
+            self._delete_chunks(coll, {"file_hash": fhash})
+            if isinstance(e, TaskCancelled): return "⏹️ 已取消"
+            if isinstance(e, ImportError): return f"❌ {e}"
+            return f"❌ 文件解析失败: {e}"
+
+        if not total: return "文件内容为空"
+        # 向量写入全部成功后再登记目录，失败时目录不会出现半成品
+        self._register_file(coll, fname, fhash, total, file_path)
+
+        elapsed = time.perf_counter() - start_time
+        rate = total / elapsed if elapsed > 0 else 0.0
+        cache_note = f"，缓存命中 {cache.hits - hits_before} 个" if cache else ""
+        return f"索引成功，共生成 {total} 个切片{self._dedup_note(deduped)}{cache_note} ({rate:.1f} 切片/秒)"
+
+    @staticmethod
+    def _dedup_note(deduped):
+        return f"，其中 {deduped} 个与已有切片近似重复，直接引用 (节省 {deduped} 次嵌入)" if deduped else ""
+
+    def _update_document(self, coll, file_path, fname, fhash, previous, batch_size, progress=None, cancel_event=None):
+        """
+        增量更新：按切片内容哈希对比新旧版本
+        - 内容未变的切片保留原向量，只改元数据里的 file_hash
+        - 只嵌入、写入新出现的切片
+        - 删除新版本中已不存在的切片
+        """
+        # 旧切片按内容哈希分组 (同一文本可能出现多次)
+        old_by_hash = {}
+        for cid, doc, meta in zip(previous['ids'], previous['documents'], previous['metadatas']):
+            h = (meta or {}).get("chunk_hash") or chunk_hash(doc or "")
+            old_by_hash.setdefault(h, []).append(cid)
+        kept = []
+
+        def _diff(chunks):
+            for i, chunk in enumerate(chunks):
+                ids = old_by_hash.get(chunk_hash(chunk))
+                if ids:
+                    kept.append(ids.pop())
+                    continue
+                yield i, chunk
+
+        chunk_iter = _diff(iter_file_chunks(file_path, chunk_size=600, overlap=100))
+        try:
+            # 旧版本的切片不参与查重：改动过的切片必然与它替换掉的旧切片近似，
+            # 若被合并为其引用，旧切片会在下面的删除中被过户保留，新内容反而不入库
+            added, deduped = self._stream_upsert(coll, chunk_iter, fname, fhash, batch_size, progress, cancel_event,
+                                                 exclude=set(previous['ids']))
+        except Exception as e:
+            # 回滚新写入的切片，旧版本保持不变
+            self._delete_chunks(coll, {"file_hash": fhash})
+            if isinstance(e, TaskCancelled): return "⏹️ 已取消"
+            if isinstance(e, ImportError): return f"❌ {e}"
+            return f"❌ 文件解析失败: {e}"
+
+        if not added and not kept: return "文件内容为空"
+
+        removed = [cid for ids in old_by_hash.values() for cid in ids]
+        kept_metas = {cid: (meta or {}) for cid, meta in zip(previous['ids'], previous['metadatas'])}
+        self._update_chunk_metadata(coll, kept, [{**kept_metas[cid], "file_hash": fhash} for cid in kept])
+        # 旧版本登记的近似重复引用作废 (新版本的引用已在写入时重新登记)
+        near = self._get_near_dup_index(coll)
+        old_entry = self._get_catalog(coll).get(fname)
+        if near is not None and old_entry and old_entry["file_hash"] != fhash:
+            near.drop_refs({"file_hash": old_entry["file_hash"]})
+        self._delete_chunks(coll, ids=removed)
+        self._register_file(coll, fname, fhash, added + len(kept), file_path)
+        return f"增量更新完成：新增 {added} 个切片{self._dedup_note(deduped)}，删除 {len(removed)} 个，复用 {len(kept)} 个"
+
+    @safe_execute("批量索引失败")
+    def add_documents(self, file_paths, embed_model_name="nomic-embed-text", max_workers=None, progress=None, cancel_event=None):
+        """
+        批量索引多个文件：
+        1. 进程池并行 解析 + 切分 (pypdf / python-docx 是 CPU 密集且持有 GIL)
+        2. 各文件的切片汇入同一个批量 嵌入 -> 写入 阶段，子进程继续解析后续文件
+        progress(已写入切片数, 已解析切片数) / cancel_event 语义同 add_document。
+        返回 {文件名: 结果消息}
+        """
+        file_paths = list(file_paths)
+        if len(file_paths) == 1:
+            return {os.path.basename(file_paths[0]): self.add_document(file_paths[0], embed_model_name, progress, cancel_event)}
+
+        coll = self._get_collection(embed_model_name)
+        if not coll: return {os.path.basename(p): "DB连接失败" for p in file_paths}
+
+        catalog = self._get_catalog(coll)
+        results = {}
+        pending = {} # file_path -> file_hash
+        updates = []
+        seen_hashes = set()
+        for path in file_paths:
+            fname = os.path.basename(path)
+            ext = os.path.splitext(path)[1].lower()
+            if not is_supported(path):
+                if ext in IMAGE_EXTS:
+                    results[fname] = "❌ 图片文件不支持文本索引。请使用'代码解释器'或 Vision 模型进行分析。"
+                else:
+                    results[fname] = f"❌ 格式 {ext} 不支持文本解析"
+                continue
+            fhash = self._calculate_hash(path)
+            if fhash in seen_hashes or catalog.has_hash(fhash):
+                results[fname] = f"文件 {fname} 已存在"
+                continue
+            seen_hashes.add(fhash)
+            # 已有旧版本的文件走单文件增量更新
+            if catalog.get(fname):
+                updates.append(path)
+                continue
+            pending[path] = fhash
+
+        for path in updates:
+            if cancel_event is not None and cancel_event.is_set():
+                results[os.path.basename(path)] = "⏹️ 已取消"
+                continue
+            results[os.path.basename(path)] = self.add_document(path, embed_model_name, progress, cancel_event)
+        if not pending: return results
+
+        if max_workers is None:
+            max_workers = ConfigHandler.load().get("rag", {}).get("ingest_processes", 0)
+        max_workers = min(len(pending), max_workers or os.cpu_count() or 1)
+        embed_fn = self._get_embed_fn(embed_model_name)
+        batch_size = max(100, embed_fn.batch_size * embed_fn.max_workers)
+
+        # 跨文件的写入缓冲：凑满 batch_size 再统一嵌入写入
+        buf_docs, buf_ids, buf_metas, buf_files = [], [], [], set()
+        counts = {}
+        deduped = {} # file_hash -> 近似重复切片数
+        failed = set()
+        written = [0]
+
+        def _flush():
+            if not buf_docs: return
+            try:
+                for cid in self._upsert_chunks(coll, documents=list(buf_docs), ids=list(buf_ids), metadatas=list(buf_metas)):
+                    h = cid.rsplit("_", 1)[0]
+                    deduped[h] = deduped.get(h, 0) + 1
+                written[0] += len(buf_docs)
+                if progress: progress(written[0], sum(counts.values()))
+            except Exception as e:
+                # 本批次涉及的文件全部回滚
+                for path in buf_files:
+                    failed.add(path)
+                    self._delete_chunks(coll, {"file_hash": pending[path]})
+                    results[os.path.basename(path)] = f"❌ 文档索引失败: {e}"
+                    counts.pop(path, None)
+            buf_docs.clear(); buf_ids.clear(); buf_metas.clear(); buf_files.clear()
+
+        start_time = time.perf_counter()
+        # spawn: 避免在多线程的 Streamlit 进程里 fork
+        ctx = multiprocessing.get_context("spawn")
+        with ProcessPoolExecutor(max_workers=max_workers, mp_context=ctx) as pool:
+            # 已经按文件并行，子进程内不再按页开进程
+            futures = [pool.submit(extract_chunks, path, 600, 100, {**PDF_OPTIONS, "workers": 1}) for path in pending]
+            for fut in as_completed(futures):
+                if cancel_event is not None and cancel_event.is_set(): break
+                path, chunks, error = fut.result()
+                fname = os.path.basename(path)
+                fhash = pending[path]
+                if error:
+                    results[fname] = f"❌ 文件解析失败: {error}"
+                    continue
+                if not chunks:
+                    results[fname] = "文件内容为空"
+                    continue
+                counts[path] = len(chunks)
+                for i, chunk in enumerate(chunks):
+                    buf_docs.append(chunk)
+                    buf_ids.append(f"{fhash}_{i}")
+                    buf_metas.append({"source": fname, "file_hash": fhash, "chunk_hash": chunk_hash(chunk)})
+                    buf_files.add(path)
+                    if len(buf_docs) >= batch_size:
+                        _flush()
+                        if path in failed: break
+                        if cancel_event is not None and cancel_event.is_set(): break
+
+            cancelled = cancel_event is not None and cancel_event.is_set()
+            if cancelled:
+                for f in futures: f.cancel()
+            else:
+                _flush()
+
+        if cancelled:
+            # 回滚本次已写入的全部切片 (目录尚未登记)
+            for path, fhash in pending.items():
+                if path in counts: self._delete_chunks(coll, {"file_hash": fhash})
+                results.setdefault(os.path.basename(path), "⏹️ 已取消")
+            for path in counts: results[os.path.basename(path)] = "⏹️ 已取消"
+            return results
+
+        elapsed = time.perf_counter() - start_time
+        total = sum(counts.values())
+        for path, n in counts.items():
+            self._register_file(coll, os.path.basename(path), pending[path], n, path)
+            results.setdefault(os.path.basename(path), f"索引成功，共生成 {n} 个切片{self._dedup_note(deduped.get(pending[path], 0))}")
+        logger.info(f"[Ingest] {len(counts)} files, {total} chunks ({sum(deduped.values())} near-duplicates merged) in {elapsed:.2f}s with {max_workers} processes")
+        return results
 
     @tool_registry.register(
         name="kb_search",
-        description="Search the external Knowledge Base. Use this tool WHENEVER the user asks for information, facts, documents, or details that might be stored in the database.",
+        description="Search the external Knowledge Base. Use this tool WHENEVER the user asks for information, facts, documents, or details that might be stored in the database. When several sub-questions need looking up, pass them together in `queries` instead of calling the tool repeatedly.",
         parameters={
             "type": "object",
             "properties": {
-                "query": {"type": "string", "description": "Keywords to search for"}
-            },
-            "required": ["query"]
+                "query": {"type": "string", "description": "Keywords to search for"},
+                "queries": {"type": "array", "items": {"type": "string"}, "description": "Several independent searches (e.g. one per sub-question), answered in one call"},
+                "sources": {"type": "array", "items": {"type": "string"}, "description": "Optional: only search inside these file names"},
+                "folder": {"type": "string", "description": "Optional: only search files uploaded under this folder"}
+            }
         }
     )
-    def search(self, query, embed_model_name="nomic-embed-text", rerank_model_name=None):
+    def search(self, query=None, embed_model_name="nomic-embed-text", rerank_model_name=None, queries=None, sources=None, folder=None):
+        """
+        query 为单个查询；queries (或 query 传列表) 为多个子查询：
+        一次批量嵌入、一次多查询向量检索、跨查询去重、一次重排序。
+        sources / folder 限定检索范围；开启分层检索时先按文档摘要向量选出候选文件，再只在这些文件内检索切片。
+        开启联合检索 (rag.federated_search) 时同时检索其他嵌入模型的 collection，见 _federated_retrieve。
+        """
+        query_list = self._query_list(query, queries)
+        if not query_list: return "未提供查询内容"
         coll = self._get_collection(embed_model_name)
         if not coll: return "DB Error"
         
         top_k = 15 if rerank_model_name else 5
+        rag_conf = ConfigHandler.load().get("rag", {})
+        use_hybrid = rag_conf.get("hybrid_search", True)
+        if isinstance(sources, str): sources = [sources]
+        models = self._federated_models(embed_model_name, rag_conf) if rag_conf.get("federated_search", False) else [embed_model_name]
+
+        # === 结果缓存：同一 collection 内相同 (规范化后) 的查询直接返回 ===
+        norm_queries = [self._normalize_query(q) for q in query_list]
+        cache_key = (coll.name, tuple(norm_queries), rerank_model_name, use_hybrid,
+                     tuple(sorted(sources or [])), folder or "", rag_conf.get("hierarchical_search", False),
+                     tuple(self._collection_name(m) for m in models[1:]))
+        cached = self._result_cache.get(cache_key)
+        if cached is not None: return cached
         
         try:
-            res = coll.query(query_texts=[query], n_results=top_k)
-            docs = res['documents'][0]
-            metas = res['metadatas'][0]
-            
-            if not docs: return "未找到相关内容"
+            if len(models) > 1:
+                candidates, owners = self._federated_retrieve(models, query_list, norm_queries, top_k, sources, folder, rag_conf)
+            else:
+                candidates = self._retrieve(coll, embed_model_name, query_list, norm_queries, top_k, sources, folder, rag_conf)
+                owners = {cid: coll for cands in candidates for cid, _, _ in cands}
             
-            final_res = []
+            if not any(candidates):
+                result = "未找到相关内容"
+                self._result_cache.set(cache_key, result)
+                return result
             
+            per_query = None
             if rerank_model_name and HAS_FLASHRANK:
                 ranker = self._get_ranker(rerank_model_name)
                 if ranker:
-                    passages = [{"id": str(i), "text": d, "meta": m} for i, (d, m) in enumerate(zip(docs, metas))]
-                    rerank_req = RerankRequest(query=query, passages=passages)
-                    ranked_res = ranker.rerank(rerank_req)
-                    
-                    for item in ranked_res[:5]:
-                        src = item['meta'].get('source', 'unknown')
-                        final_res.append(f"📄 [Source: {src}]\n{item['text']}")
-                    return "\n\n".join(final_res)
-
-            for i in range(min(5, len(docs))):
-                src = metas[i].get('source', 'unknown')
-                final_res.append(f"📄 [Source: {src}]\n{docs[i]}")
-            return "\n\n".join(final_res)
+                    # 所有子查询的 (query, passage) 对合成一个批次打分
+                    requests = [(q, [{"id": i, "text": d, "meta": m} for i, d, m in cands]) for q, cands in zip(query_list, candidates)]
+                    ranked_lists = ranker.rerank_many(requests)
+                    per_query = [[(p["id"], p["text"], p["meta"]) for p in ranked[:5]] for ranked in ranked_lists]
+
+            if per_query is None:
+                per_query = [cands[:5] for cands in candidates]
+
+            refs = self._lookup_refs({cid for items in per_query for cid, _, _ in items}, owners)
+            result = self._format_results(query_list, per_query, refs)
+            self._result_cache.set(cache_key, result)
+            return result
             
         except Exception as e:
             return f"检索异常: {e}"
 
+    def _retrieve(self, coll, embed_model_name, query_list, norm_queries, top_k, sources, folder, rag_conf):
+        """单个 collection 内的候选切片 (向量检索 + BM25 融合 + 范围过滤)，返回每个查询的 [(id, doc, meta)]"""
+        q_vecs = self._embed_queries(embed_model_name, query_list, norm_queries)
+        scope = self._search_scope(coll, q_vecs, sources, folder, rag_conf)
+        if scope is None:
+            res = coll.query(query_embeddings=q_vecs, n_results=top_k)
+        elif scope["sources"]:
+            # 引用了其他文件的重复切片时多取一些，过滤后仍能凑满 top_k
+            n = top_k * 2 if scope["ref_ids"] else top_k
+            res = coll.query(query_embeddings=q_vecs, n_results=n, where=scope["where"])
+        else:
+            res = {key: [[] for _ in query_list] for key in ("ids", "documents", "metadatas")}
+
+        use_hybrid = rag_conf.get("hybrid_search", True)
+        candidates = []
+        for qi, q in enumerate(query_list):
+            ids, docs, metas = res['ids'][qi], res['documents'][qi], res['metadatas'][qi]
+            # === 混合检索：BM25 词法结果与向量结果做 RRF 融合 ===
+            allow = None
+            if scope is not None:
+                allow = lambda cid, meta: (meta or {}).get("source") in scope["sources"] or cid in scope["ref_ids"]
+            if use_hybrid and (scope is None or scope["sources"]):
+                ids, docs, metas = self._fuse_lexical(coll, q, ids, docs, metas, top_k, rag_conf.get("rrf_k", 60), allow)
+            cands = [(i, d, m or {}) for i, d, m in zip(ids, docs, metas) if allow is None or allow(i, m)]
+            candidates.append(cands[:top_k])
+        return candidates
+
+    # === 联合检索 (跨嵌入模型) ===
+    def _federated_models(self, embed_model_name, rag_conf):
+        """参与联合检索的模型：当前模型在前，其余取 rag.federated_models，未配置时取曾经建过库的全部模型"""
+        others = rag_conf.get("federated_models") or sorted(set(self._maintenance.models().values()))
+        return [embed_model_name] + [m for m in others if m != embed_model_name]
+
+    def _federated_retrieve(self, models, query_list, norm_queries, top_k, sources, folder, rag_conf):
+        """
+        各模型的 collection 在线程池中并发检索，各自用自己的嵌入函数嵌入查询；
+        不同模型的向量距离不可比，每个查询的各路结果按倒数排名融合 (RRF)，同一切片 id 只保留一份。
+        单个 collection 失败 (如 Ollama 中已删除该模型) 只记录日志，不影响其余结果。
+        返回 (每个查询的候选列表, {切片id: 所属 collection})
+        """
+        def _run(model):
+            entry = self._open_collection(model)
+            if entry is None or not entry[0].count(): return None
+            return entry[0], self._retrieve(entry[0], model, query_list, norm_queries, top_k, sources, folder, rag_conf)
+
+        workers = max(1, min(len(models), rag_conf.get("federated_workers", 4)))
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="kb-federated") as pool:
+            futures = [pool.submit(_run, m) for m in models]
+        results = []
+        for model, fut in zip(models, futures):
+            try:
+                res = fut.result()
+            except Exception as e:
+                logger.warning(f"[Federated] {model} 检索失败，已跳过: {e}")
+                continue
+            if res is not None: results.append(res)
+
+        owners, candidates = {}, []
+        for qi in range(len(query_list)):
+            lookup, rankings = {}, []
+            for coll, cands in results:
+                rankings.append([cid for cid, _, _ in cands[qi]])
+                for cand in cands[qi]:
+                    if cand[0] not in lookup: lookup[cand[0]] = cand
+                    owners.setdefault(cand[0], coll)
+            fused = reciprocal_rank_fusion(rankings, k=rag_conf.get("rrf_k", 60))[:top_k] if rankings else []
+            candidates.append([lookup[cid] for cid in fused])
+        return candidates, owners
+
+    def _lookup_refs(self, chunk_ids, owners):
+        """{规范切片id: [引用方 source]}，按切片所属 collection 分别查近似去重索引"""
+        by_coll = {}
+        for cid in chunk_ids:
+            coll = owners.get(cid)
+            if coll is not None: by_coll.setdefault(coll.name, (coll, set()))[1].add(cid)
+        refs = {}
+        for coll, ids in by_coll.values():
+            near = self._get_near_dup_index(coll)
+            if near is None: continue
+            for cid, srcs in near.refs_for(ids).items():
+                merged = refs.setdefault(cid, [])
+                merged.extend(s for s in srcs if s not in merged)
+        return refs
+
+    def get_migration_candidates(self, embed_model_name="nomic-embed-text", upload_dir="uploads"):
+        """
+        切换嵌入模型后的增量迁移：其他模型的文档目录中有、当前模型还没有、且原文件仍在 upload_dir 中的文件路径。
+        只读文档目录，不打开其他模型的 collection；迁移完成前可用联合检索继续检索旧库。
+        """
+        current = set(self.get_files(embed_model_name))
+        current_name = self._collection_name(embed_model_name)
+        paths = set()
+        for name in self._maintenance.models():
+            db = os.path.join(self.db_path, "catalog", f"{name}.db")
+            if name == current_name or not os.path.exists(db): continue
+            with self._indexes_lock:
+                catalog = self._catalogs.get(name)
+                if catalog is None: catalog = self._catalogs[name] = DocumentCatalog(db)
+            for source in catalog.list_sources():
+                path = os.path.join(upload_dir, source)
+                if source not in current and os.path.isfile(path): paths.add(path)
+        return sorted(paths)
+
+    def _search_scope(self, coll, q_vecs, sources, folder, rag_conf):
+        """
+        确定切片检索范围，返回 None 表示全库检索，否则返回
+        {"sources": 允许的文件名集合, "ref_ids": 这些文件引用的重复切片, "where": 向量库过滤条件}
+        """
+        hierarchical = rag_conf.get("hierarchical_search", False)
+        if not (sources or folder or hierarchical): return None
+        summary = self._get_doc_summary(coll)
+        if summary is None:
+            if folder: logger.warning("Folder scoping needs the document summary index; ignored")
+            allowed = list(sources) if sources else None
+        else:
+            allowed = summary.scope(sources, folder)
+            # 分层检索：文件数足够多时，先在文档摘要向量中为每个查询选出候选文件
+            if hierarchical and len(summary) >= rag_conf.get("hierarchical_min_docs", 20):
+                allowed = summary.search(q_vecs, rag_conf.get("hierarchical_top_docs", 8), allowed)
+        if allowed is None: return None
+
+        allowed = set(allowed)
+        ref_ids, where_sources = set(), set(allowed)
+        near = self._get_near_dup_index(coll)
+        if near is not None and allowed:
+            # 以引用方式包含的切片归属于其他文件，过滤条件要带上这些拥有者
+            ref_ids = near.chunks_referenced_by(allowed)
+            if ref_ids:
+                owners = coll.get(ids=list(ref_ids), include=['metadatas'])['metadatas']
+                where_sources.update(m.get("source") for m in owners if m and m.get("source"))
+        where_sources = sorted(where_sources)
+        where = {"source": where_sources[0]} if len(where_sources) == 1 else {"source": {"$in": where_sources}}
+        return {"sources": allowed, "ref_ids": ref_ids, "where": where}
+
+    @staticmethod
+    def _query_list(query, queries=None):
+        """合并 query / queries 参数，去掉空串与重复查询"""
+        items = []
+        for q in (query, queries):
+            if isinstance(q, (list, tuple)): items.extend(q)
+            elif q: items.append(q)
+        seen, result = set(), []
+        for q in items:
+            q = str(q).strip()
+            key = KnowledgeBase._normalize_query(q)
+            if q and key not in seen:
+                seen.add(key)
+                result.append(q)
+        return result
+
+    def _embed_queries(self, embed_model_name, query_list, norm_queries):
+        """查询向量缓存：与 collection 内容无关，写入时无需失效；未命中的查询一次批量嵌入"""
+        vecs = [self._query_embed_cache.get((embed_model_name, n)) for n in norm_queries]
+        missing = [i for i, v in enumerate(vecs) if v is None]
+        if missing:
+            fresh = self._get_embed_fn(embed_model_name)([query_list[i] for i in missing])
+            for i, v in zip(missing, fresh):
+                vecs[i] = v
+                if any(v): self._query_embed_cache.set((embed_model_name, norm_queries[i]), v)
+        return vecs
+
+    @staticmethod
+    def _format_results(query_list, per_query, refs=None):
+        """单查询保持原格式；多查询按名次轮流合并、跨查询去重，并标注命中的子查询"""
+        refs = refs or {}
+
+        def _source(cid, meta):
+            src = meta.get('source', 'unknown')
+            others = [r for r in refs.get(cid, []) if r != src]
+            return f"{src} | 相似版本: {', '.join(others)}" if others else src
+
+        if len(query_list) == 1:
+            return "\n\n".join(f"📄 [Source: {_source(cid, m)}]\n{d}" for cid, d, m in per_query[0])
+
+        order, hits = [], {}
+        for rank in range(max(len(items) for items in per_query)):
+            for qi, items in enumerate(per_query):
+                if rank >= len(items): continue
+                cid, doc, meta = items[rank]
+                if cid not in hits:
+                    hits[cid] = []
+                    order.append((cid, doc, meta))
+                if query_list[qi] not in hits[cid]: hits[cid].append(query_list[qi])
+        return "\n\n".join(
+            f"📄 [Source: {_source(cid, m)}] [Query: {' | '.join(hits[cid])}]\n{d}" for cid, d, m in order
+        )
+
+    @staticmethod
+    def _normalize_query(query):
+        """合并空白并忽略大小写，使近似相同的查询命中同一缓存"""
+        return " ".join(str(query).split()).lower()
+
+    def _fuse_lexical(self, coll, query, vec_ids, docs, metas, top_k, rrf_k=60, allow=None):
+        """
+        把 BM25 命中与向量命中按倒数排名融合，返回融合后的 (ids, docs, metas)
+        allow(id, meta) 用于限定检索范围：BM25 是全库检索，范围外的命中在截断前剔除
+        """
+        lex_hits = self._get_lexical_index(coll).search(query, top_k * 3 if allow else top_k)
+        if not lex_hits: return vec_ids, docs, metas
+
+        fused_ids = reciprocal_rank_fusion([vec_ids, [doc_id for doc_id, _ in lex_hits]], k=rrf_k)
+        if not allow: fused_ids = fused_ids[:top_k]
+        lookup = {i: (d, m) for i, d, m in zip(vec_ids, docs, metas)}
+        missing = [i for i in fused_ids if i not in lookup]
+        if missing:
+            extra = coll.get(ids=missing, include=['documents', 'metadatas'])
+            for i, d, m in zip(extra['ids'], extra['documents'], extra['metadatas']):
+                lookup[i] = (d, m)
+        fused_ids = [i for i in fused_ids if i in lookup and (allow is None or allow(i, lookup[i][1]))][:top_k]
+        return fused_ids, [lookup[i][0] for i in fused_ids], [lookup[i][1] or {} for i in fused_ids]
+
     def get_files(self, embed_model_name="nomic-embed-text"):
         coll = self._get_collection(embed_model_name)
         if not coll: return []
         try:
-            data = coll.get(include=['metadatas'])
-            return list(set([m['source'] for m in data['metadatas'] if m]))
+            return self._get_catalog(coll).list_sources()
         except: return []
 
+    def get_dedup_stats(self, embed_model_name="nomic-embed-text"):
+        """近似去重统计：refs 即节省的嵌入/存储切片数"""
+        coll = self._get_collection(embed_model_name)
+        near = self._get_near_dup_index(coll) if coll else None
+        return near.stats() if near is not None else None
+
+    # === 索引维护 ===
+    def get_index_info(self, embed_model_name="nomic-embed-text"):
+        """向量索引状态：切片数、自上次重建以来的删除量 (墓碑)、HNSW 实际参数与配置参数"""
+        coll = self._get_collection(embed_model_name)
+        if not coll: return {}
+        count = coll.count()
+        backend = "quantized" if isinstance(coll, QuantizedVectorStore) else "chroma"
+        info = {"collection": coll.name, "backend": backend, "count": count, **self._maintenance.get(coll.name)}
+        if isinstance(coll, QuantizedVectorStore):
+            info["store"] = coll.stats()
+            deleted = info["store"]["dead_rows"]
+        else:
+            current = current_hnsw(coll)
+            configured = hnsw_settings(coll.name, ConfigHandler.load().get("rag", {}))
+            info["hnsw_current"] = current
+            info["hnsw_configured"] = configured
+            info["needs_rebuild"] = any(current[k] != configured[k] for k in ("M", "construction_ef"))
+            deleted = info.get("deleted_since_rebuild", 0)
+        info["tombstone_ratio"] = round(deleted / max(1, count + deleted), 4)
+        return info
+
+    def rebuild_index(self, embed_model_name="nomic-embed-text", settings=None, save=False, progress=None):
+        """
+        离线重建 / 压缩 (建议在没有索引任务时执行)
+        - Chroma: 以新的 HNSW 参数整体重建，顺带清除墓碑；save=True 时把参数写入 rag.hnsw_overrides
+        - 量化向量库: 压缩空行并缩小文件
+        """
+        coll = self._get_collection(embed_model_name)
+        if not coll: return "DB连接失败"
+        if isinstance(coll, QuantizedVectorStore):
+            removed = coll.compact()
+            self._maintenance.record_rebuild(coll.name, {}, coll.count())
+            return f"压缩完成：回收 {removed} 个空行，剩余 {coll.count()} 个切片"
+        settings = {**hnsw_settings(coll.name, ConfigHandler.load().get("rag", {})), **(settings or {})}
+        if save: ConfigHandler.update(f"rag.hnsw_overrides.{coll.name}", settings)
+        start = time.perf_counter()
+        embed_fn = self._get_embed_fn(embed_model_name)
+        new_coll = rebuild_chroma_collection(self._client, coll, settings, embed_fn, progress)
+        with self._collections_lock:
+            self._collections[(embed_model_name, "chroma")] = (new_coll, embed_fn)
+        self._collection = new_coll
+        self._invalidate_search_cache(new_coll)
+        self._maintenance.record_rebuild(coll.name, settings, new_coll.count())
+        return f"重建完成：{new_coll.count()} 个切片，HNSW {settings}，耗时 {time.perf_counter() - start:.1f}s"
+
+    def probe_index(self, embed_model_name="nomic-embed-text", candidates=None, sample_size=5000, n_queries=100, k=10):
+        """在临时索引上比较多组 HNSW 参数的 recall@k 与查询延迟，不修改现有索引"""
+        coll = self._get_collection(embed_model_name)
+        if not coll: raise RuntimeError("DB连接失败")
+        if isinstance(coll, QuantizedVectorStore):
+            raise ValueError("量化向量库为全量扫描，没有 HNSW 参数可调")
+        return probe_hnsw(coll, candidates or [current_hnsw(coll)], sample_size, n_queries, k)
+
+    # === 快照导出 / 导入 ===
+    def export_snapshot(self, out_dir, embed_model_name="nomic-embed-text", dtype="float32", progress=None):
+        """把当前模型的知识库导出为快照目录 (向量、切片、文档目录、近似重复引用)，建议在没有索引任务时执行"""
+        coll = self._get_collection(embed_model_name)
+        if not coll: return "DB连接失败"
+        near = self._get_near_dup_index(coll)
+        summary = self._get_doc_summary(coll)
+        files = self._get_catalog(coll).list_files()
+        if summary is not None:
+            folders = summary.folders()
+            files = [{**f, "folder": folders.get(f["source"], "")} for f in files]
+        info = {"collection": coll.name, "embed_model": embed_model_name,
+                "backend": "quantized" if isinstance(coll, QuantizedVectorStore) else "chroma"}
+        manifest = write_snapshot(coll, out_dir, info, files, near.all_refs() if near is not None else [], dtype, progress=progress)
+        return f"导出完成：{manifest['count']} 个切片，{len(files)} 个文件 -> {out_dir}"
+
+    def import_snapshot(self, snapshot_dir, embed_model_name=None, progress=None):
+        """
+        从快照批量写入向量，不调用嵌入模型；目标库必须为空 (新节点初始化)
+        词法索引、近似去重签名、文档摘要向量在导入时一并建好
+        """
+        manifest = read_manifest(snapshot_dir)
+        model = embed_model_name or manifest["embed_model"]
+        if model != manifest["embed_model"]:
+            return f"❌ 快照由 {manifest['embed_model']} 生成，向量与 {model} 不兼容"
+        coll = self._get_collection(model)
+        if not coll: return "DB连接失败"
+        if coll.count(): return f"❌ 目标知识库 {coll.name} 非空 ({coll.count()} 个切片)，请先清空再导入"
+
+        start = time.perf_counter()
+        # 先在空库上取各辅助索引，避免写入后触发逐个切片的一次性重建
+        lexical = self._get_lexical_index(coll)
+        catalog = self._get_catalog(coll)
+        near = self._get_near_dup_index(coll)
+        summary = self._get_doc_summary(coll)
+        done = 0
+        try:
+            for ids, docs, metas, vecs in iter_snapshot(snapshot_dir, manifest):
+                coll.add(ids=ids, embeddings=vecs, documents=docs, metadatas=metas)
+                lexical.add(ids, docs, metas)
+                if near is not None: near.commit([(cid, near.signature(d)) for cid, d in zip(ids, docs)], [])
+                done += len(ids)
+                if progress: progress(done, manifest["count"])
+        finally:
+            self._invalidate_search_cache(coll)
+        if near is not None: near.commit([], [tuple(r) for r in manifest["refs"]])
+        catalog.restore(manifest["files"])
+        if summary is not None:
+            for f in manifest["files"]:
+                summary.upsert(f["source"], f["file_hash"], self._file_vectors(coll, f["source"]), folder=f.get("folder", ""))
+        return f"导入完成：{done} 个切片，{len(manifest['files'])} 个文件，耗时 {time.perf_counter() - start:.1f}s (未调用嵌入模型)"
+
     def delete_file(self, fname, embed_model_name="nomic-embed-text"):
         coll = self._get_collection(embed_model_name)
-        if coll: coll.delete(where={"source": fname})
+        if coll:
+            self._delete_chunks(coll, {"source": fname})
+            self._get_catalog(coll).remove(fname)
+            summary = self._get_doc_summary(coll)
+            if summary is not None: summary.remove(fname)
 
 knowledge_tool = KnowledgeBase()
\ No newline at end of file
@@ -0,0 +1,257 @@
+import os
+import time
+import queue
+import hashlib
+import threading
+from collections import deque
+from concurrent.futures import Future
+from utils.logger import logger
+from utils.ttl_cache import TTLCache
+
+# === 可选依赖导入 ===
+try:
+    import numpy as np
+    import onnxruntime as ort
+    from flashrank import Ranker, RerankRequest
+    HAS_FLASHRANK = True
+except ImportError:
+    HAS_FLASHRANK = False
+
+try:
+    from importlib.metadata import version as _pkg_version
+    FLASHRANK_VERSION = _pkg_version("flashrank") if HAS_FLASHRANK else None
+except Exception:
+    FLASHRANK_VERSION = None
+
+# FlashRank 不提供会话参数；指定线程数与跨查询合批需要用到其内部属性 (session / tokenizer / model_dir)，
+# 只在 requirements.txt 固定的版本上启用，其他版本一律走公开的 Ranker.rerank
+FLASHRANK_PINNED = "0.2.10"
+
+class RerankerService:
+    """
+    FlashRank 重排序服务
+    - 启动时加载模型并跑一次预热批次，首个查询不再承担加载开销
+    - 可配置 ONNX intra-op 线程数 (仅限固定的 FlashRank 版本)
+    - 缓存 (query, passage 哈希) -> 分数，同一查询下已打过分的段落不再重复计算
+    - 并发查询的 (query, passage) 对在短时间窗口内合并成一个批次送入模型
+    - 记录延迟统计
+    """
+    def __init__(self, model_name, cache_dir="models", threads=2, max_batch=64, batch_wait_ms=5, cache_size=4096, cache_ttl=3600):
+        self.model_name = model_name
+        self.cache_dir = cache_dir
+        self.threads = max(1, int(threads))
+        self.max_batch = max(1, int(max_batch))
+        self.batch_wait = max(0, batch_wait_ms) / 1000.0
+        self._scores = TTLCache(cache_size, cache_ttl)
+        self._ranker = None
+        self._pairwise = False  # 是否可以直接跑交叉编码器 (可跨查询合批)
+        self._load_lock = threading.Lock()
+        self._state_lock = threading.Lock()
+        self._preloading = False
+        self.load_error = None  # 最近一次加载失败的原因；后台预加载失败后不再自动重试
+        self._queue = queue.Queue()
+        self._worker = None
+        self._latencies = deque(maxlen=500)
+        self._batch_sizes = deque(maxlen=500)
+        self.load_seconds = None
+
+    # === 加载与预热 ===
+    def load(self):
+        if self._ranker is not None: return self
+        with self._load_lock:
+            if self._ranker is not None: return self
+            if not HAS_FLASHRANK: raise ImportError("FlashRank not installed")
+            start = time.perf_counter()
+            try:
+                ranker = Ranker(model_name=self.model_name, cache_dir=self.cache_dir)
+            except Exception as e:
+                self.load_error = str(e)
+                raise
+            self.load_error = None
+            self._pairwise = self._configure_session(ranker)
+            self._ranker = ranker
+            self._warmup()
+            self.load_seconds = round(time.perf_counter() - start, 3)
+            logger.info(f"[Reranker] {self.model_name} 已加载并预热 ({self.load_seconds}s, threads={self.threads}, pairwise={self._pairwise})")
+        return self
+
+    def preload(self):
+        """后台加载 + 预热；已加载、正在加载或加载失败过时不再启动新线程，返回是否启动了线程"""
+        with self._state_lock:
+            if self._ranker is not None or self._preloading or self.load_error is not None: return False
+            self._preloading = True
+        threading.Thread(target=self._preload, name=f"reranker-preload-{self.model_name}", daemon=True).start()
+        return True
+
+    def _preload(self):
+        try:
+            self.load()
+        except Exception as e:
+            self.load_error = str(e)
+            logger.error(f"Reranker Init Fail: {e}")
+        finally:
+            with self._state_lock:
+                self._preloading = False
+
+    def _configure_session(self, ranker):
+        """
+        用指定线程数重建 ONNX 会话，成功时改为直接跑交叉编码器
+        FlashRank 版本不是 FLASHRANK_PINNED，或模型不是交叉编码器 (如 listwise LLM) 时保持其默认行为
+        """
+        if FLASHRANK_VERSION != FLASHRANK_PINNED:
+            logger.warning(f"[Reranker] FlashRank {FLASHRANK_VERSION} 不是固定版本 {FLASHRANK_PINNED}，使用其默认设置 (rerank_threads 与跨查询合批不生效)")
+            return False
+        if not all(hasattr(ranker, a) for a in ("session", "tokenizer", "model_dir")): return False
+        try:
+            onnx_files = [f for f in os.listdir(ranker.model_dir) if f.endswith(".onnx")]
+            if not onnx_files: return False
+            opts = ort.SessionOptions()
+            opts.intra_op_num_threads = self.threads
+            opts.inter_op_num_threads = 1
+            ranker.session = ort.InferenceSession(
+                os.path.join(str(ranker.model_dir), onnx_files[0]), sess_options=opts, providers=["CPUExecutionProvider"]
+            )
+            return True
+        except Exception as e:
+            logger.warning(f"[Reranker] 无法重建 ONNX 会话，使用 FlashRank 默认设置: {e}")
+            return False
+
+    def _warmup(self):
+        try:
+            pairs = [("warmup query", f"warmup passage {i}") for i in range(8)]
+            if self._pairwise:
+                self._score_pairs(pairs)
+            else:
+                self._ranker.rerank(RerankRequest(query=pairs[0][0], passages=[{"id": str(i), "text": p} for i, (_, p) in enumerate(pairs)]))
+        except Exception as e:
+            logger.warning(f"[Reranker] 预热失败: {e}")
+
+    # === 打分 ===
+    def _score_pairs(self, pairs):
+        """交叉编码器直接推理，与 FlashRank 0.2.10 Ranker.rerank 的 pairwise 打分一致"""
+        enc = self._ranker.tokenizer.encode_batch([[q, p] for q, p in pairs])
+        feeds = {
+            "input_ids": np.array([e.ids for e in enc], dtype=np.int64),
+            "attention_mask": np.array([e.attention_mask for e in enc], dtype=np.int64)
+        }
+        token_type_ids = np.array([e.type_ids for e in enc], dtype=np.int64)
+        if not np.all(token_type_ids == 0):
+            feeds["token_type_ids"] = token_type_ids
+        logits = self._ranker.session.run(None, feeds)[0]
+        if logits.shape[1] == 1:
+            scores = 1 / (1 + np.exp(-logits.flatten()))
+        else:
+            exp_logits = np.exp(logits)
+            scores = exp_logits[:, 1] / np.sum(exp_logits, axis=1)
+        return [float(s) for s in scores]
+
+    def _ensure_worker(self):
+        if self._worker is None or not self._worker.is_alive():
+            self._worker = threading.Thread(target=self._batch_loop, name=f"reranker-{self.model_name}", daemon=True)
+            self._worker.start()
+
+    def _batch_loop(self):
+        """合批线程：拿到第一个请求后再等 batch_wait 秒，把并发请求凑成一个批次"""
+        while True:
+            items = [self._queue.get()]
+            n_pairs = len(items[0][0])
+            deadline = time.perf_counter() + self.batch_wait
+            while n_pairs < self.max_batch:
+                remaining = deadline - time.perf_counter()
+                if remaining <= 0: break
+                try:
+                    item = self._queue.get(timeout=remaining)
+                except queue.Empty:
+                    break
+                items.append(item)
+                n_pairs += len(item[0])
+
+            all_pairs = [pair for pairs, _ in items for pair in pairs]
+            try:
+                scores = self._score_pairs(all_pairs)
+                self._batch_sizes.append(len(all_pairs))
+                offset = 0
+                for pairs, fut in items:
+                    fut.set_result(scores[offset:offset + len(pairs)])
+                    offset += len(pairs)
+            except Exception as e:
+                for _, fut in items:
+                    if not fut.done(): fut.set_exception(e)
+
+    def _score_uncached(self, pairs):
+        """pairs: [(query, text)]，整体作为一个请求进入合批队列"""
+        if self._pairwise:
+            fut = Future()
+            self._ensure_worker()
+            self._queue.put((pairs, fut))
+            return fut.result()
+        # 非 pairwise 模型：按查询分组交给 FlashRank 整体打分
+        by_query = {}
+        for i, (query, text) in enumerate(pairs):
+            by_query.setdefault(query, []).append((i, text))
+        scores = [0.0] * len(pairs)
+        for query, items in by_query.items():
+            ranked = self._ranker.rerank(RerankRequest(query=query, passages=[{"id": str(i), "text": t} for i, t in items]))
+            for r in ranked:
+                scores[int(r["id"])] = float(r["score"])
+        return scores
+
+    def rerank(self, query, passages):
+        """passages: [{"text": ..., "meta": ...}]，返回按分数降序、带 score 字段的新列表"""
+        return self.rerank_many([(query, passages)])[0]
+
+    def rerank_many(self, requests):
+        """
+        多个 (query, passages) 一次打分：所有未命中缓存的 (query, passage) 对合成一个批次，
+        返回与 requests 对应的排序结果列表
+        """
+        self.load()
+        start = time.perf_counter()
+        keys = [[(query, hashlib.md5(p["text"].encode("utf-8")).hexdigest()) for p in passages] for query, passages in requests]
+        scores = [[self._scores.get(k) for k in ks] for ks in keys]
+        missing = [(ri, pi) for ri, ss in enumerate(scores) for pi, sc in enumerate(ss) if sc is None]
+        if missing:
+            fresh = self._score_uncached([(requests[ri][0], requests[ri][1][pi]["text"]) for ri, pi in missing])
+            for (ri, pi), sc in zip(missing, fresh):
+                scores[ri][pi] = sc
+                self._scores.set(keys[ri][pi], sc)
+        self._latencies.append(time.perf_counter() - start)
+        results = []
+        for (_, passages), ss in zip(requests, scores):
+            ranked = [{**p, "score": sc} for p, sc in zip(passages, ss)]
+            ranked.sort(key=lambda x: x["score"], reverse=True)
+            results.append(ranked)
+        return results
+
+    def stats(self):
+        lat = sorted(self._latencies)
+        pct = lambda q: round(lat[min(len(lat) - 1, int(q * len(lat)))] * 1000, 2) if lat else 0.0
+        return {
+            "model": self.model_name,
+            "loaded": self._ranker is not None,
+            "load_error": self.load_error,
+            "load_seconds": self.load_seconds,
+            "queries": len(lat),
+            "p50_ms": pct(0.5),
+            "p95_ms": pct(0.95),
+            "avg_batch": round(sum(self._batch_sizes) / len(self._batch_sizes), 1) if self._batch_sizes else 0.0,
+            "score_cache": self._scores.stats()
+        }
+
+_services = {}
+_services_lock = threading.Lock()
+
+def get_reranker_service(model_name, **kwargs):
+    """每个模型一个共享服务实例 (跨会话)"""
+    with _services_lock:
+        svc = _services.get(model_name)
+        if svc is None:
+            svc = RerankerService(model_name, **kwargs)
+            _services[model_name] = svc
+        return svc
+
+def preload_reranker(model_name, **kwargs):
+    """后台线程加载 + 预热，不阻塞页面渲染；页面每次重跑都会调用，同一模型只加载一次"""
+    svc = get_reranker_service(model_name, **kwargs)
+    svc.preload()
+    return svc
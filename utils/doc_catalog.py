@@ -0,0 +1,96 @@
+import os
+import sqlite3
+import threading
+import time
+from utils.logger import logger
+
+class DocumentCatalog:
+    """
+    每个 collection 一份的文档目录 (SQLite)
+    记录每个文件的 hash / 大小 / 修改时间 / 切片数 / 索引时间，
+    文件列表、去重检查、删除都只查这张小表，不再扫描全部切片元数据。
+    """
+    def __init__(self, db_path):
+        self.db_path = db_path
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(db_path) or ".", exist_ok=True)
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS files ("
+            "source TEXT PRIMARY KEY, file_hash TEXT NOT NULL, size INTEGER, mtime REAL, "
+            "chunk_count INTEGER NOT NULL, indexed_at REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_files_hash ON files(file_hash)")
+        self._conn.commit()
+
+    def __len__(self):
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM files").fetchone()[0]
+
+    def has_hash(self, file_hash):
+        with self._lock:
+            return self._conn.execute("SELECT 1 FROM files WHERE file_hash=? LIMIT 1", (file_hash,)).fetchone() is not None
+
+    def get(self, source):
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT source, file_hash, size, mtime, chunk_count, indexed_at FROM files WHERE source=?", (source,)
+            ).fetchone()
+        if not row: return None
+        return dict(zip(["source", "file_hash", "size", "mtime", "chunk_count", "indexed_at"], row))
+
+    def list_sources(self):
+        with self._lock:
+            return [r[0] for r in self._conn.execute("SELECT source FROM files ORDER BY source")]
+
+    def list_files(self):
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT source, file_hash, size, mtime, chunk_count, indexed_at FROM files ORDER BY source"
+            ).fetchall()
+        return [dict(zip(["source", "file_hash", "size", "mtime", "chunk_count", "indexed_at"], r)) for r in rows]
+
+    def upsert(self, source, file_hash, chunk_count, file_path=None):
+        size = mtime = None
+        if file_path and os.path.exists(file_path):
+            st = os.stat(file_path)
+            size, mtime = st.st_size, st.st_mtime
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO files (source, file_hash, size, mtime, chunk_count, indexed_at) VALUES (?, ?, ?, ?, ?, ?)",
+                (source, file_hash, size, mtime, chunk_count, time.time())
+            )
+
+    def restore(self, entries):
+        """按 list_files() 的结果原样写回 (导入快照时使用，保留原大小/修改时间/索引时间)"""
+        with self._lock, self._conn:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO files (source, file_hash, size, mtime, chunk_count, indexed_at) VALUES (?, ?, ?, ?, ?, ?)",
+                [(e["source"], e["file_hash"], e.get("size"), e.get("mtime"), e["chunk_count"], e.get("indexed_at") or time.time()) for e in entries]
+            )
+
+    def remove(self, source):
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM files WHERE source=?", (source,))
+
+    def rebuild_from(self, coll, page_size=1000):
+        """从 Chroma 元数据重建目录 (老数据一次性迁移，大小/修改时间未知)"""
+        stats = {}
+        offset = 0
+        while True:
+            data = coll.get(include=['metadatas'], limit=page_size, offset=offset)
+            if not data['ids']: break
+            for m in data['metadatas']:
+                if not m or not m.get("source"): continue
+                entry = stats.setdefault(m["source"], [m.get("file_hash", ""), 0])
+                entry[1] += 1
+            offset += len(data['ids'])
+        now = time.time()
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM files")
+            self._conn.executemany(
+                "INSERT INTO files (source, file_hash, size, mtime, chunk_count, indexed_at) VALUES (?, ?, NULL, NULL, ?, ?)",
+                [(src, h, n, now) for src, (h, n) in stats.items()]
+            )
+        logger.info(f"[Catalog] 已从向量库重建文档目录: {len(stats)} 个文件")
@@ -0,0 +1,204 @@
+import os
+import hashlib
+from utils.pdf_extract import iter_pdf_pages
+
+# === 可选依赖导入 ===
+try:
+    import pypdf
+except ImportError:
+    pypdf = None
+
+try:
+    import docx
+except ImportError:
+    docx = None
+
+EXCEL_EXTS = ['.xlsx', '.xls']
+IMAGE_EXTS = ['.png', '.jpg', '.jpeg', '.bmp']
+PLAIN_TEXT_EXTS = ['.txt', '.md', '.py', '.json', '.csv', '.html']
+SUPPORTED_EXTS = EXCEL_EXTS + ['.pdf', '.docx'] + PLAIN_TEXT_EXTS
+
+# PDF 提取参数，由 KnowledgeBase 按 rag 配置设置 (configure_pdf_extraction)
+PDF_OPTIONS = {"workers": 0, "min_pages": 32, "cache_path": os.path.join("chroma_db", "pdf_pages.db"), "cache_max_mb": 512}
+
+def configure_pdf_extraction(**options):
+    PDF_OPTIONS.update({k: v for k, v in options.items() if k in PDF_OPTIONS})
+
+def is_supported(file_path):
+    return os.path.splitext(file_path)[1].lower() in SUPPORTED_EXTS
+
+def calculate_hash(file_path, block_size=1024 * 1024):
+    """分块计算 MD5，避免一次性把整个文件读入内存"""
+    h = hashlib.md5()
+    with open(file_path, 'rb') as f:
+        for block in iter(lambda: f.read(block_size), b""):
+            h.update(block)
+    return h.hexdigest()
+
+def chunk_hash(text):
+    """切片内容哈希，用于增量更新时比对新旧切片"""
+    return hashlib.md5(text.encode("utf-8")).hexdigest()
+
+def iter_text_segments(file_path):
+    """
+    流式提取文本：PDF 按页、Docx 按段落、Excel 按行、纯文本按行逐段产出。
+    各片段之间以换行连接即得到完整文本。不支持的格式不产出任何内容。
+    """
+    ext = os.path.splitext(file_path)[1].lower()
+
+    # 1. Excel (只读模式逐行读取)
+    if ext in EXCEL_EXTS:
+        for sheet, rows in iter_excel_rows(file_path):
+            yield f"--- Sheet: {sheet} ---"
+            yield from rows
+
+    # 2. PDF (逐页缓存，页数多时按页段多进程并行提取)
+    elif ext == '.pdf':
+        if not pypdf: raise ImportError("缺少 pypdf 库，无法解析 PDF")
+        fhash = calculate_hash(file_path) if PDF_OPTIONS["cache_path"] else None
+        yield from iter_pdf_pages(file_path, fhash, **PDF_OPTIONS)
+
+    # 3. Word (Docx)
+    elif ext == '.docx':
+        if not docx: raise ImportError("缺少 python-docx 库，无法解析 Docx")
+        doc = docx.Document(file_path)
+        for p in doc.paragraphs:
+            yield p.text
+
+    # 4. 纯文本
+    elif ext in PLAIN_TEXT_EXTS:
+        with open(file_path, 'r', encoding='utf-8', errors='ignore') as f:
+            for line in f:
+                yield line.rstrip('\n')
+
+def _format_row(row):
+    """单元格按位置保留 (空单元格为空串)，与表头列对齐；去掉行尾空单元格，全空行返回空串"""
+    cells = ["" if c is None else str(c).strip() for c in row]
+    while cells and not cells[-1]: cells.pop()
+    return " | ".join(cells)
+
+def iter_excel_rows(file_path):
+    """
+    只读模式流式读取工作簿：逐个工作表产出 (表名, 行文本生成器)，只保留当前行，内存占用与行数无关
+    行生成器须在取下一个工作表之前消费完
+    """
+    import openpyxl
+    wb = openpyxl.load_workbook(file_path, read_only=True, data_only=True)
+    try:
+        for sheet in wb.worksheets:
+            yield sheet.title, (text for text in map(_format_row, sheet.iter_rows(values_only=True)) if text)
+    finally:
+        wb.close() # 只读模式持有文件句柄，需显式关闭
+
+def iter_excel_chunks(file_path, chunk_size=600, overlap=100):
+    """
+    Excel 按行组切片：每个切片都以 "表名 + 表头行" 开头，后接若干完整数据行，
+    切片不会在行中间断开 (单行超长时才在行内切分，并同样带上表头)
+    """
+    for sheet, rows in iter_excel_rows(file_path):
+        header = next(rows, None)
+        if header is None: continue
+        prefix = f"--- Sheet: {sheet} ---\n{header}"
+        group, size, emitted = [], len(prefix), False
+        for row in rows:
+            if group and size + 1 + len(row) > chunk_size:
+                yield prefix + "\n" + "\n".join(group)
+                group, size, emitted = [], len(prefix), True
+            if len(prefix) + 1 + len(row) > chunk_size:
+                for piece in iter_chunks([row], max(100, chunk_size - len(prefix) - 1), overlap):
+                    yield prefix + "\n" + piece
+                emitted = True
+                continue
+            group.append(row)
+            size += 1 + len(row)
+        if group: yield prefix + "\n" + "\n".join(group)
+        elif not emitted: yield prefix # 只有表头的工作表
+
+def iter_file_chunks(file_path, chunk_size=600, overlap=100):
+    """按文件类型选择切分方式：Excel 按行组 (带表头)，其余格式按文本流切分"""
+    if os.path.splitext(file_path)[1].lower() in EXCEL_EXTS:
+        return iter_excel_chunks(file_path, chunk_size, overlap)
+    return iter_chunks(iter_text_segments(file_path), chunk_size, overlap)
+
+def find_split_end(text, start, chunk_size, total_len):
+    """在 [start, start+chunk_size] 窗口内寻找最合适的切分点"""
+    # 确定硬截止点
+    end = min(start + chunk_size, total_len)
+
+    # 如果还没到文件末尾，尝试优化切分点（找换行符）
+    if end < total_len:
+        # 在窗口后半部分寻找最近的换行符
+        # 搜索范围：[end - chunk_size//2, end]
+        lookback_limit = max(start, end - chunk_size // 2)
+
+        # 优先找双换行（段落）
+        last_newline = text.rfind('\n\n', lookback_limit, end)
+        if last_newline != -1:
+            end = last_newline + 2 # 保留换行符
+        else:
+            # 其次找单换行
+            last_newline = text.rfind('\n', lookback_limit, end)
+            if last_newline != -1:
+                end = last_newline + 1
+            else:
+                # 再其次找句号
+                last_period = text.rfind('。', lookback_limit, end)
+                if last_period != -1:
+                    end = last_period + 1
+
+                # 实在找不到分隔符，就硬切，不回退，防止死循环
+    return end
+
+def iter_chunks(segments, chunk_size=600, overlap=100):
+    """
+    流式切分：与一次性切分整段文本的结果完全一致，
+    但缓冲区只保留尚未切完的尾部，内存占用与文件大小无关。
+    """
+    buf = ""
+    start = 0
+    first = True
+
+    def _emit(final):
+        nonlocal buf, start
+        total_len = len(buf)
+        # 非末尾时，只在窗口之后还有数据的情况下切分，保证与整段切分一致
+        while start < total_len and (final or total_len - start > chunk_size):
+            end = find_split_end(buf, start, chunk_size, total_len)
+
+            # 提取切片
+            chunk = buf[start:end].strip()
+            if chunk:
+                yield chunk
+
+            # 如果是硬切且到了末尾，直接退出
+            if end == total_len:
+                start = total_len
+                break
+
+            # 正常步进是 chunk长度 - overlap，但强制至少前进 1，防止死循环
+            start += max(1, (end - start) - overlap)
+
+        # 丢弃已处理的前缀
+        if start:
+            buf = buf[start:]
+            start = 0
+
+    for seg in segments:
+        buf += seg if first else "\n" + seg
+        first = False
+        if len(buf) - start > chunk_size:
+            yield from _emit(final=False)
+
+    yield from _emit(final=True)
+
+def extract_chunks(file_path, chunk_size=600, overlap=100, pdf_options=None):
+    """
+    进程池 worker 入口：解析并切分单个文件 (CPU 密集，放在子进程绕开 GIL)。
+    返回 (file_path, chunks, error)，异常以字符串形式返回便于跨进程传递。
+    pdf_options 为父进程的 PDF 提取参数 (spawn 子进程不继承模块状态)。
+    """
+    if pdf_options: configure_pdf_extraction(**pdf_options)
+    try:
+        return file_path, list(iter_file_chunks(file_path, chunk_size, overlap)), None
+    except Exception as e:
+        return file_path, [], str(e)
@@ -0,0 +1,117 @@
+import os
+import sqlite3
+import threading
+from utils.logger import logger
+
+try:
+    import numpy as np
+    HAS_NUMPY = True
+except ImportError:
+    HAS_NUMPY = False
+
+class DocSummaryIndex:
+    """
+    文档级摘要向量索引 (分层检索的第一层)，每个 collection 一份
+    - 每个文件一条：该文件全部切片向量的归一化均值 (质心) 作为摘要向量
+    - 同时记录文件所在目录，供按目录限定检索范围
+    - 文件数远小于切片数，查询时整体载入内存做一次矩阵乘即可
+    """
+    def __init__(self, db_path):
+        if not HAS_NUMPY: raise ImportError("缺少 numpy，无法使用分层检索")
+        self.db_path = db_path
+        self._lock = threading.RLock()
+        self._matrix = None # (sources, folders, 归一化向量矩阵)，写入后置空、查询时重建
+        os.makedirs(os.path.dirname(db_path) or ".", exist_ok=True)
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS docs ("
+            "source TEXT PRIMARY KEY, file_hash TEXT, folder TEXT, chunk_count INTEGER, vector BLOB NOT NULL)"
+        )
+        self._conn.commit()
+
+    def __len__(self):
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM docs").fetchone()[0]
+
+    @staticmethod
+    def folder_of(file_path):
+        """统一成正斜杠的相对目录，便于跨平台比较前缀"""
+        if not file_path: return ""
+        return os.path.dirname(os.path.normpath(file_path)).replace("\\", "/")
+
+    def upsert(self, source, file_hash, embeddings, file_path=None, folder=None):
+        """用文件的全部切片向量计算质心并写入；没有向量时删除该文件"""
+        vecs = np.asarray(embeddings, dtype=np.float32)
+        if not len(vecs):
+            self.remove(source)
+            return
+        vecs = vecs / np.clip(np.linalg.norm(vecs, axis=1, keepdims=True), 1e-12, None)
+        centroid = vecs.mean(axis=0)
+        centroid /= max(float(np.linalg.norm(centroid)), 1e-12)
+        folder = self.folder_of(file_path) if folder is None else folder
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO docs (source, file_hash, folder, chunk_count, vector) VALUES (?, ?, ?, ?, ?)",
+                (source, file_hash, folder, len(vecs), centroid.astype(np.float32).tobytes())
+            )
+            self._matrix = None
+
+    def remove(self, source):
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM docs WHERE source=?", (source,))
+            self._matrix = None
+
+    def folders(self):
+        """{文件名: 所在目录}"""
+        with self._lock:
+            return dict(self._conn.execute("SELECT source, folder FROM docs"))
+
+    def _load(self):
+        if self._matrix is None:
+            rows = self._conn.execute("SELECT source, folder, vector FROM docs ORDER BY source").fetchall()
+            mat = np.stack([np.frombuffer(r[2], dtype=np.float32) for r in rows]) if rows else np.zeros((0, 0), dtype=np.float32)
+            self._matrix = ([r[0] for r in rows], [r[1] or "" for r in rows], mat)
+        return self._matrix
+
+    def scope(self, sources=None, folder=None):
+        """调用方给出的范围 -> 文件名列表；都未给出时返回 None (不限定)"""
+        if not sources and not folder: return None
+        with self._lock:
+            names, folders, _ = self._load()
+        allowed = set(sources or names)
+        if folder:
+            prefix = self.folder_of(os.path.join(folder, "_")).rstrip("/")
+            allowed &= {n for n, f in zip(names, folders) if f == prefix or f.startswith(prefix + "/")}
+        return sorted(allowed)
+
+    def search(self, query_vectors, top_docs, allowed=None):
+        """
+        对每个查询向量选出最相关的 top_docs 个文件，返回并集 (按最高得分排序)
+        allowed 为 None 时在全部文件中选
+        """
+        with self._lock:
+            names, _, mat = self._load()
+        if not names: return []
+        q = np.asarray(query_vectors, dtype=np.float32)
+        q = q / np.clip(np.linalg.norm(q, axis=1, keepdims=True), 1e-12, None)
+        if q.shape[1] != mat.shape[1]: return []
+        scores = mat @ q.T
+        if allowed is not None:
+            allowed = set(allowed)
+            keep = np.array([n in allowed for n in names], dtype=bool)
+            scores[~keep] = -np.inf
+        best = {}
+        k = min(top_docs, len(names))
+        for col in scores.T:
+            for i in np.argpartition(-col, k - 1)[:k]:
+                if np.isfinite(col[i]): best[names[i]] = max(best.get(names[i], -np.inf), float(col[i]))
+        return [n for n, _ in sorted(best.items(), key=lambda x: x[1], reverse=True)]
+
+    def rebuild_from(self, catalog, load_vectors):
+        """按文档目录逐个文件重建 (老数据一次性迁移，目录未知)；load_vectors(source) 返回该文件的切片向量"""
+        count = 0
+        for entry in catalog.list_files():
+            self.upsert(entry["source"], entry["file_hash"], load_vectors(entry["source"]), folder="")
+            count += 1
+        logger.info(f"[DocSummary] 已重建 {count} 个文件的摘要向量")
@@ -0,0 +1,130 @@
+import os
+import sqlite3
+import hashlib
+import threading
+import time
+from array import array
+from utils.logger import logger
+
+class EmbeddingCache:
+    """
+    持久化的内容寻址嵌入缓存 (SQLite)
+    - 键: (嵌入模型, 切片文本 sha256)
+    - 超过 max_entries 时按最近访问时间 (LRU) 淘汰
+    - 记录命中/未命中次数
+    """
+    def __init__(self, db_path=os.path.join("cache", "embeddings.db"), max_entries=200000):
+        self.db_path = db_path
+        self.max_entries = max(1, int(max_entries))
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(db_path) or ".", exist_ok=True)
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings ("
+            "model TEXT NOT NULL, text_hash TEXT NOT NULL, vector BLOB NOT NULL, "
+            "last_access REAL NOT NULL, PRIMARY KEY (model, text_hash))"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_emb_access ON embeddings(last_access)")
+        self._conn.commit()
+
+    @staticmethod
+    def text_hash(text):
+        return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+    @staticmethod
+    def _pack(vec):
+        return array("f", vec).tobytes()
+
+    @staticmethod
+    def _unpack(blob):
+        arr = array("f")
+        arr.frombytes(blob)
+        return arr.tolist()
+
+    def get_many(self, model, hashes):
+        """批量查询，返回 {text_hash: vector}，并刷新命中项的访问时间"""
+        if not hashes: return {}
+        found = {}
+        uniq = list(set(hashes))
+        with self._lock:
+            # SQLite 变量数上限，分段查询
+            for i in range(0, len(uniq), 500):
+                part = uniq[i:i + 500]
+                marks = ",".join("?" * len(part))
+                rows = self._conn.execute(
+                    f"SELECT text_hash, vector FROM embeddings WHERE model=? AND text_hash IN ({marks})",
+                    [model] + part
+                ).fetchall()
+                for h, blob in rows:
+                    found[h] = self._unpack(blob)
+            if found:
+                now = time.time()
+                self._conn.executemany(
+                    "UPDATE embeddings SET last_access=? WHERE model=? AND text_hash=?",
+                    [(now, model, h) for h in found]
+                )
+                self._conn.commit()
+            self.hits += sum(1 for h in hashes if h in found)
+            self.misses += sum(1 for h in hashes if h not in found)
+        return found
+
+    def put_many(self, model, items):
+        """items: [(text_hash, vector)]"""
+        if not items: return
+        now = time.time()
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO embeddings (model, text_hash, vector, last_access) VALUES (?, ?, ?, ?)",
+                [(model, h, self._pack(v), now) for h, v in items]
+            )
+            self._conn.commit()
+            self._evict()
+
+    def _evict(self):
+        count = self._conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+        overflow = count - self.max_entries
+        if overflow > 0:
+            self._conn.execute(
+                "DELETE FROM embeddings WHERE rowid IN "
+                "(SELECT rowid FROM embeddings ORDER BY last_access ASC LIMIT ?)",
+                (overflow,)
+            )
+            self._conn.commit()
+            logger.info(f"[EmbeddingCache] 淘汰 {overflow} 条最久未使用的嵌入")
+
+    def stats(self):
+        with self._lock:
+            size = self._conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+        total = self.hits + self.misses
+        return {
+            "entries": size,
+            "max_entries": self.max_entries,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / total, 3) if total else 0.0
+        }
+
+    def clear(self):
+        with self._lock:
+            self._conn.execute("DELETE FROM embeddings")
+            self._conn.commit()
+            self.hits = 0
+            self.misses = 0
+
+_shared_caches = {}
+_shared_lock = threading.Lock()
+
+def get_embedding_cache(db_path=os.path.join("cache", "embeddings.db"), max_entries=200000):
+    """按路径共享缓存实例，多个 collection / 嵌入函数复用同一个连接"""
+    with _shared_lock:
+        cache = _shared_caches.get(db_path)
+        if cache is None:
+            cache = EmbeddingCache(db_path, max_entries)
+            _shared_caches[db_path] = cache
+        else:
+            cache.max_entries = max(1, int(max_entries))
+        return cache
@@ -7,6 +7,7 @@ class AppError(Exception):
 class ToolError(AppError): pass
 class SecurityError(AppError): pass
 class ConfigError(AppError): pass
+class TaskCancelled(AppError): pass
 
 def safe_execute(error_msg="操作失败"):
     def decorator(func):
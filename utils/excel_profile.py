@@ -0,0 +1,193 @@
+import os
+import json
+import time
+import heapq
+import hashlib
+import datetime
+import threading
+import openpyxl
+from openpyxl.utils import get_column_letter
+from utils.logger import logger
+from utils.ttl_cache import TTLCache
+from utils.excel_query import SIDECAR_DIR, file_hash, prune_cache
+
+# 工作簿概览：只读流式遍历一次，逐列累计类型、空值、最值、不同值估计与高频值
+# 结果按文件哈希缓存到 cache/excel/<文件哈希>/profile.json (与列式查询缓存同目录、一同淘汰)
+PROFILE_FILE = "profile.json"
+KMV_SIZE = 1024  # 不同值估计保留的最小哈希个数，不同值少于该数时结果精确
+TOP_SLOTS = 64   # 高频值计数器个数 (Misra-Gries)
+TOP_SHOW = 5
+
+_KIND_NAMES = {"int": "整数", "float": "小数", "date": "日期", "bool": "布尔", "str": "文本"}
+
+def _kind(value):
+    if isinstance(value, bool): return "bool"
+    if isinstance(value, int): return "int"
+    if isinstance(value, float): return "float"
+    if isinstance(value, (datetime.datetime, datetime.date)): return "date"
+    return "str"
+
+def _fmt(value):
+    if value is None: return None
+    if isinstance(value, datetime.datetime) and value.time() == datetime.time(): return value.date().isoformat()
+    return str(value)
+
+def _hash64(text):
+    return int.from_bytes(hashlib.blake2b(text.encode("utf-8"), digest_size=8).digest(), "little")
+
+class ColumnStats:
+    """单列的流式统计，内存占用与行数无关"""
+    def __init__(self):
+        self.nulls = 0
+        self.kinds = {}
+        self.min = {} # 类型 -> 最小值 (各类型分别记录，文本按字典序)
+        self.max = {}
+        self._kmv = []       # 最小的 KMV_SIZE 个哈希 (取负存为大顶堆)
+        self._kmv_set = set()
+        self.top = {}        # 值 -> 计数 (Misra-Gries，计数为下界)
+        self.top_exact = True
+
+    def add(self, value):
+        if value is None or (isinstance(value, str) and not value.strip()):
+            self.nulls += 1
+            return
+        kind = _kind(value)
+        self.kinds[kind] = self.kinds.get(kind, 0) + 1
+        if kind == "str": value = str(value).strip()
+        elif kind == "date" and not isinstance(value, datetime.datetime): # date 与 datetime 不能直接比较
+            value = datetime.datetime.combine(value, datetime.time())
+        if kind in self.min:
+            if value < self.min[kind]: self.min[kind] = value
+            elif value > self.max[kind]: self.max[kind] = value
+        else:
+            self.min[kind] = self.max[kind] = value
+
+        text = str(value)
+        h = _hash64(text)
+        if h not in self._kmv_set:
+            if len(self._kmv) < KMV_SIZE:
+                heapq.heappush(self._kmv, -h)
+                self._kmv_set.add(h)
+            elif h < -self._kmv[0]:
+                self._kmv_set.discard(-heapq.heapreplace(self._kmv, -h))
+                self._kmv_set.add(h)
+
+        if text in self.top:
+            self.top[text] += 1
+        elif len(self.top) < TOP_SLOTS:
+            self.top[text] = 1
+        else: # 计数器已满：全部减一，淘汰归零的
+            self.top_exact = False
+            self.top = {k: c - 1 for k, c in self.top.items() if c > 1}
+
+    def distinct(self):
+        """(估计值, 是否精确)"""
+        if len(self._kmv) < KMV_SIZE: return len(self._kmv), True
+        return int((KMV_SIZE - 1) * 2 ** 64 / (-self._kmv[0] + 1)), False
+
+    def summary(self, name, rows):
+        filled = rows - self.nulls
+        kinds = sorted(self.kinds.items(), key=lambda kv: -kv[1])
+        main = kinds[0][0] if kinds else None
+        if main in ("int", "float") and "int" in self.kinds and "float" in self.kinds: main = "float" # 整数与小数混合视为数值
+        numeric = main in ("int", "float")
+        others = {k: n for k, n in kinds if k != main and not (numeric and k in ("int", "float"))}
+        lo = hi = None
+        if numeric:
+            los = [self.min[k] for k in ("int", "float") if k in self.min]
+            his = [self.max[k] for k in ("int", "float") if k in self.max]
+            lo, hi = min(los), max(his)
+        elif main:
+            lo, hi = self.min[main], self.max[main]
+        distinct, exact = self.distinct()
+        top = sorted(self.top.items(), key=lambda kv: -kv[1])[:TOP_SHOW]
+        return {
+            "name": name, "type": main, "others": others, "nulls": self.nulls, "filled": filled,
+            "min": _fmt(lo), "max": _fmt(hi),
+            "distinct": distinct, "distinct_exact": exact,
+            "top": [[v, c] for v, c in top if c > 1], "top_exact": self.top_exact
+        }
+
+def profile_workbook(path, sheets=None):
+    """只读模式流式遍历一次，返回各工作表的概览 (首行为表头)"""
+    start = time.perf_counter()
+    wb = openpyxl.load_workbook(path, read_only=True, data_only=True)
+    result = []
+    try:
+        for name in (sheets or wb.sheetnames):
+            it = wb[name].iter_rows(values_only=True)
+            header = list(next(it, None) or ())
+            stats = [ColumnStats() for _ in header]
+            rows = 0
+            for row in it:
+                if all(c is None for c in row): continue
+                rows += 1
+                if len(row) > len(stats):
+                    for _ in range(len(row) - len(stats)):
+                        col = ColumnStats()
+                        col.nulls = rows - 1
+                        stats.append(col)
+                    header.extend([None] * (len(row) - len(header)))
+                for i, col in enumerate(stats):
+                    col.add(row[i] if i < len(row) else None)
+            columns = [s.summary(get_column_letter(i + 1) + (f":{header[i]}" if header[i] not in (None, "") else ""), rows)
+                       for i, s in enumerate(stats)]
+            result.append({"sheet": name, "rows": rows, "columns": columns})
+    finally:
+        wb.close()
+    logger.info(f"[ExcelProfile] {os.path.basename(path)}: {len(result)} 个工作表 ({time.perf_counter() - start:.1f}s)")
+    return {"sheets": result, "seconds": round(time.perf_counter() - start, 2)}
+
+_profiles = TTLCache(max_entries=16, ttl=3600)
+_profile_lock = threading.Lock()
+
+def get_profile(path, cache_dir=SIDECAR_DIR):
+    """按文件哈希取概览：内存 -> 磁盘缓存 -> 重新统计；返回 (概览, 是否来自缓存)"""
+    fhash = file_hash(path)
+    with _profile_lock:
+        profile = _profiles.get(fhash)
+        if profile is not None: return profile, True
+        cache_file = os.path.join(cache_dir, fhash, PROFILE_FILE)
+        if os.path.exists(cache_file):
+            with open(cache_file, 'r', encoding='utf-8') as f:
+                profile = json.load(f)
+            _profiles.set(fhash, profile)
+            return profile, True
+        profile = profile_workbook(path)
+        os.makedirs(os.path.dirname(cache_file), exist_ok=True)
+        with open(cache_file, 'w', encoding='utf-8') as f:
+            json.dump(profile, f, ensure_ascii=False)
+        prune_cache(cache_dir, keep=fhash)
+        _profiles.set(fhash, profile)
+        return profile, False
+
+def _short(value, max_len=30):
+    text = str(value).replace("\n", " ")
+    return text if len(text) <= max_len else text[:max_len] + "…"
+
+def render_profile(profile, sheet=None, cached=False):
+    """渲染为紧凑文本：每列一行"""
+    sheets = profile["sheets"]
+    if sheet not in (None, ""):
+        names = [s["sheet"] for s in sheets]
+        if sheet not in names and str(sheet).isdigit() and 1 <= int(sheet) <= len(names): sheet = names[int(sheet) - 1]
+        if sheet not in names: raise ValueError(f"工作表 {sheet} 不存在，可选: {', '.join(names)}")
+        sheets = [s for s in sheets if s["sheet"] == sheet]
+    source = "缓存" if cached else f"统计用时 {profile['seconds']}s"
+    lines = []
+    for s in sheets:
+        lines.append(f"[工作表: {s['sheet']} | {s['rows']} 行数据 x {len(s['columns'])} 列 | {source}]")
+        lines.append("列 | 类型 | 空值 | 不同值 | 最小 | 最大 | 高频值")
+        for c in s["columns"]:
+            kind = _KIND_NAMES.get(c["type"], "空")
+            if c["others"]: kind += " (" + ", ".join(f"{_KIND_NAMES[k]} {n}" for k, n in c["others"].items()) + ")"
+            distinct = str(c["distinct"]) if c["distinct_exact"] else f"≈{c['distinct']}"
+            if c["top"] and c["distinct"] < c["filled"]:
+                mark = "" if c["top_exact"] else "≥"
+                top = ", ".join(f"{_short(v)}({mark}{n})" for v, n in c["top"])
+            else:
+                top = "-"
+            lines.append(" | ".join([c["name"], kind, str(c["nulls"]), distinct,
+                                     _short(c["min"]) if c["min"] is not None else "-",
+                                     _short(c["max"]) if c["max"] is not None else "-", top]))
+    return "\n".join(lines)
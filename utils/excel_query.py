@@ -0,0 +1,591 @@
+import os
+import re
+import json
+import time
+import shutil
+import pickle
+import datetime
+import threading
+import openpyxl
+from openpyxl.utils import get_column_letter
+from utils.logger import logger
+from utils.ttl_cache import TTLCache
+from utils.doc_extract import calculate_hash
+
+try:
+    import numpy as np
+    HAS_NUMPY = True
+except ImportError:
+    HAS_NUMPY = False
+
+# 列式旁路缓存：cache/excel/<文件哈希>/<工作表序号>/
+# - meta.json  表名、行数、各列名称与类型
+# - c<i>.npy   数值列 float64 (NaN 为空)、日期列 datetime64[s] (NaT 为空)、文本列 int32 字典编码 (-1 为空)
+# - c<i>.json  文本列的字典
+# 另有 _row 列记录 Excel 行号。转换只做一次，之后的查询直接以内存映射方式读取各列做向量化计算。
+SIDECAR_DIR = os.path.join("cache", "excel")
+SIDECAR_KEEP = 20 # 保留最近使用的文件数
+ROW_COL = "_row"
+DEFAULT_LIMIT = 50
+MAX_LIMIT = 500
+SIDECAR_BLOCK_ROWS = 8192 # 转换时每块的行数，决定转换过程的内存上限
+
+# === 列式旁路缓存 ===
+class Column:
+    def __init__(self, name, kind, data, dictionary=None):
+        self.name = name
+        self.kind = kind # num / date / str
+        self.data = data
+        self.dictionary = dictionary
+
+    def notnull(self):
+        if self.kind == "num": return ~np.isnan(self.data)
+        if self.kind == "date": return ~np.isnat(self.data)
+        return self.data >= 0
+
+    def display(self, i):
+        v = self.data[i]
+        if self.kind == "str": return self.dictionary[v] if v >= 0 else ""
+        if self.kind == "date": return "" if np.isnat(v) else str(v).replace("T", " ").replace(" 00:00:00", "")
+        return format_number(v)
+
+    def sort_key(self):
+        """可直接参与 np.lexsort 的排序键 (文本列按字典序排名)，空值排在最后"""
+        if self.kind == "str":
+            rank = np.empty(len(self.dictionary) + 1, dtype=np.int64)
+            rank[:-1] = np.argsort(np.argsort(np.array(self.dictionary, dtype=object)))
+            rank[-1] = len(self.dictionary) # -1 (空) 映射到最后
+            return rank[self.data]
+        if self.kind == "date":
+            key = self.data.astype("datetime64[s]").astype(np.int64).astype(np.float64)
+            key[np.isnat(self.data)] = np.inf
+            return key
+        return np.where(np.isnan(self.data), np.inf, self.data)
+
+class Table:
+    def __init__(self, sheet, rows, columns):
+        self.sheet = sheet
+        self.rows = rows
+        self.columns = columns
+        self._by_name = {c.name.lower(): c for c in columns}
+
+    def column(self, name):
+        col = self._by_name.get(str(name).strip().lower())
+        if col is None:
+            raise ValueError(f"列 {name} 不存在，可用列: {', '.join(c.name for c in self.columns)}")
+        return col
+
+def format_number(v):
+    v = float(v)
+    if np.isnan(v): return ""
+    if v.is_integer() and abs(v) < 1e15: return str(int(v))
+    return f"{v:.6f}".rstrip("0").rstrip(".")
+
+def _merge_kind(kind, value):
+    """
+    逐值推断列类型：全为数值 -> num，全为日期 -> date，其余 (含数值/日期/文本混合) -> str
+    混合列整列按文本存储，比较、排序与 MIN/MAX 都按字典序 ("10" < "9")
+    """
+    if value is None or kind == "str": return kind
+    if isinstance(value, (bool, str)): return "str"
+    if isinstance(value, (int, float)): k = "num"
+    elif isinstance(value, (datetime.datetime, datetime.date)): k = "date"
+    else: return "str"
+    return k if kind is None or kind == k else "str"
+
+def _encode(values, kind, lookup=None, dictionary=None):
+    """一段值 -> 数组；文本列的 lookup / dictionary 跨段共享，由调用方持有"""
+    if kind == "num":
+        return np.array([np.nan if v is None else float(v) for v in values], dtype=np.float64)
+    if kind == "date":
+        return np.array([np.datetime64("NaT") if v is None else np.datetime64(v, "s") for v in values], dtype="datetime64[s]")
+    codes = np.empty(len(values), dtype=np.int32)
+    for i, v in enumerate(values):
+        if v is None or v == "":
+            codes[i] = -1
+            continue
+        s = str(v)
+        code = lookup.get(s)
+        if code is None:
+            code = lookup[s] = len(dictionary)
+            dictionary.append(s)
+        codes[i] = code
+    return codes
+
+_DTYPES = {"num": np.float64, "date": "datetime64[s]", "str": np.int32}
+
+def _column_file(path, dtype, n):
+    """预分配 .npy 文件并以内存映射方式打开 (0 行时 mmap 不可用，直接写空数组)"""
+    if n == 0:
+        np.save(path, np.empty(0, dtype=dtype))
+        return None
+    return np.lib.format.open_memmap(path, mode="w+", dtype=dtype, shape=(n,))
+
+def build_sidecar(path, sheet_name, out_dir):
+    """
+    只读流式遍历一次工作表，写出列式文件；首行为表头，全空行跳过
+    内存占用与行数无关：遍历时每 SIDECAR_BLOCK_ROWS 行写入临时文件并逐列累计类型，
+    之后按块读回、编码并写入预分配的内存映射 .npy (文本列的字典除外)
+    """
+    start = time.perf_counter()
+    tmp_dir = out_dir + ".tmp"
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    os.makedirs(tmp_dir)
+    spool_path = os.path.join(tmp_dir, "rows.spool")
+    kinds, n_rows = [], 0
+    wb = openpyxl.load_workbook(path, read_only=True, data_only=True)
+    try:
+        it = wb[sheet_name].iter_rows(values_only=True)
+        header = list(next(it, None) or ())
+        kinds = [None] * len(header)
+        with open(spool_path, "wb") as spool:
+            block = []
+            for row_no, row in enumerate(it, start=2):
+                if all(c is None for c in row): continue
+                if len(row) > len(kinds): kinds.extend([None] * (len(row) - len(kinds)))
+                for i, v in enumerate(row):
+                    kinds[i] = _merge_kind(kinds[i], v)
+                block.append((row_no, row))
+                if len(block) >= SIDECAR_BLOCK_ROWS:
+                    pickle.dump(block, spool, protocol=pickle.HIGHEST_PROTOCOL)
+                    n_rows += len(block)
+                    block = []
+            if block:
+                pickle.dump(block, spool, protocol=pickle.HIGHEST_PROTOCOL)
+                n_rows += len(block)
+    finally:
+        wb.close()
+
+    header.extend([None] * (len(kinds) - len(header)))
+    kinds = [k or "str" for k in kinds]
+    row_file = _column_file(os.path.join(tmp_dir, "row.npy"), np.int64, n_rows)
+    files = [_column_file(os.path.join(tmp_dir, f"c{i}.npy"), _DTYPES[k], n_rows) for i, k in enumerate(kinds)]
+    lookups = [({}, []) if k == "str" else (None, None) for k in kinds]
+    offset = 0
+    with open(spool_path, "rb") as spool:
+        for _ in range(0, n_rows, SIDECAR_BLOCK_ROWS):
+            block = pickle.load(spool)
+            end = offset + len(block)
+            row_file[offset:end] = [row_no for row_no, _ in block]
+            for i, (kind, data, (lookup, dictionary)) in enumerate(zip(kinds, files, lookups)):
+                data[offset:end] = _encode([row[i] if i < len(row) else None for _, row in block], kind, lookup, dictionary)
+            offset = end
+    for data in [row_file] + files:
+        if data is not None: data.flush()
+    del row_file, files
+    os.remove(spool_path)
+
+    names, columns = set(), []
+    for i, (head, kind, (_, dictionary)) in enumerate(zip(header, kinds, lookups)):
+        name = str(head).strip() if head not in (None, "") else get_column_letter(i + 1)
+        base, n = name, 2
+        while name.lower() in names or name == ROW_COL: # 重名列加后缀
+            name, n = f"{base}_{n}", n + 1
+        names.add(name.lower())
+        if dictionary is not None:
+            with open(os.path.join(tmp_dir, f"c{i}.json"), 'w', encoding='utf-8') as f:
+                json.dump(dictionary, f, ensure_ascii=False)
+        columns.append({"name": name, "kind": kind, "file": f"c{i}"})
+    with open(os.path.join(tmp_dir, "meta.json"), 'w', encoding='utf-8') as f:
+        json.dump({"sheet": sheet_name, "rows": n_rows, "columns": columns}, f, ensure_ascii=False)
+    shutil.rmtree(out_dir, ignore_errors=True)
+    os.replace(tmp_dir, out_dir)
+    logger.info(f"[ExcelQuery] {os.path.basename(path)}/{sheet_name}: {n_rows} 行 x {len(columns)} 列已转为列式缓存 ({time.perf_counter() - start:.1f}s)")
+
+def load_sidecar(sheet_dir):
+    with open(os.path.join(sheet_dir, "meta.json"), 'r', encoding='utf-8') as f:
+        meta = json.load(f)
+    columns = [Column(ROW_COL, "num", np.load(os.path.join(sheet_dir, "row.npy"), mmap_mode='r').astype(np.float64))]
+    for c in meta["columns"]:
+        data = np.load(os.path.join(sheet_dir, c["file"] + ".npy"), mmap_mode='r')
+        dictionary = None
+        if c["kind"] == "str":
+            with open(os.path.join(sheet_dir, c["file"] + ".json"), 'r', encoding='utf-8') as f:
+                dictionary = json.load(f)
+        columns.append(Column(c["name"], c["kind"], data, dictionary))
+    return Table(meta["sheet"], meta["rows"], columns)
+
+_hashes = TTLCache(max_entries=256, ttl=0) # (路径, 修改时间, 大小) -> 文件哈希；键含修改时间，无需过期
+_tables = TTLCache(max_entries=8, ttl=1800)
+_build_lock = threading.Lock()
+
+def file_hash(path):
+    """文件内容哈希；文件未改动 (修改时间与大小不变) 时不再重新计算"""
+    st = os.stat(path)
+    stat_key = (os.path.abspath(path), st.st_mtime_ns, st.st_size)
+    value = _hashes.get(stat_key)
+    if value is None:
+        value = calculate_hash(path)
+        _hashes.set(stat_key, value)
+    return value
+
+def get_table(path, sheet=None, cache_dir=SIDECAR_DIR):
+    """取工作表的列式数据：按文件哈希 + 工作表定位旁路缓存，不存在时转换一次"""
+    if not HAS_NUMPY: raise ImportError("缺少 numpy，无法执行 Excel 查询")
+    fhash = file_hash(path)
+    with _build_lock:
+        file_dir = os.path.join(cache_dir, fhash)
+        sheets_file = os.path.join(file_dir, "sheets.json")
+        if os.path.exists(sheets_file):
+            with open(sheets_file, 'r', encoding='utf-8') as f:
+                info = json.load(f)
+        else:
+            wb = openpyxl.load_workbook(path, read_only=True)
+            info = {"sheets": list(wb.sheetnames), "active": wb.active.title if wb.active is not None else wb.sheetnames[0]}
+            wb.close()
+            os.makedirs(file_dir, exist_ok=True)
+            with open(sheets_file, 'w', encoding='utf-8') as f:
+                json.dump(info, f, ensure_ascii=False)
+        names = info["sheets"]
+        if sheet in (None, ""): sheet = info["active"]
+        elif sheet not in names and str(sheet).isdigit() and 1 <= int(sheet) <= len(names): sheet = names[int(sheet) - 1]
+        if sheet not in names: raise ValueError(f"工作表 {sheet} 不存在，可选: {', '.join(names)}")
+        os.utime(file_dir) # 记录最近使用，供淘汰
+        key = (fhash, sheet)
+        table = _tables.get(key)
+        if table is None:
+            sheet_dir = os.path.join(file_dir, str(names.index(sheet)))
+            if not os.path.exists(os.path.join(sheet_dir, "meta.json")):
+                build_sidecar(path, sheet, sheet_dir)
+                prune_cache(cache_dir, keep=fhash)
+            table = load_sidecar(sheet_dir)
+            _tables.set(key, table)
+        return table, names
+
+def prune_cache(cache_dir=SIDECAR_DIR, keep=None):
+    """只保留最近使用的 SIDECAR_KEEP 个文件的缓存"""
+    dirs = [d for d in os.listdir(cache_dir) if d != keep and os.path.isdir(os.path.join(cache_dir, d))]
+    dirs.sort(key=lambda d: os.path.getmtime(os.path.join(cache_dir, d)), reverse=True)
+    for d in dirs[SIDECAR_KEEP - 1:]:
+        shutil.rmtree(os.path.join(cache_dir, d), ignore_errors=True)
+
+# === 查询语言 ===
+# [SELECT 列 | 聚合(列) [AS 别名], ...] [WHERE 条件] [GROUP BY 列, ...] [ORDER BY 列|别名 [ASC|DESC], ...] [LIMIT n]
+# 条件支持 = != <> > >= < <=、IN (...)、LIKE '%x%'、BETWEEN a AND b、IS [NOT] NULL，以 AND / OR / NOT / 括号组合
+# 聚合: COUNT(*) COUNT(列) COUNT(DISTINCT 列) SUM AVG MIN MAX；含空格的列名用 "列 名" 或 `列 名`
+# 数值与文本混合的列按文本列处理 (见 _merge_kind)，其上的比较为字典序
+_TOKEN = re.compile(r"""\s*(?:(?P<str>'(?:[^']|'')*')|(?P<ident>"[^"]+"|`[^`]+`)|(?P<num>-?\d+(?:\.\d+)?(?![\w.]))|(?P<op>>=|<=|!=|<>|[=<>(),*])|(?P<word>[^\s=<>!(),*'"`]+))""")
+_KEYWORDS = {"SELECT", "WHERE", "GROUP", "BY", "ORDER", "ASC", "DESC", "LIMIT", "AND", "OR", "NOT",
+             "IN", "LIKE", "IS", "NULL", "AS", "DISTINCT", "BETWEEN"}
+_AGGS = {"COUNT", "SUM", "AVG", "MIN", "MAX"}
+
+def _tokenize(text):
+    tokens, pos = [], 0
+    text = text.strip().rstrip(";")
+    while pos < len(text):
+        m = _TOKEN.match(text, pos)
+        if not m or m.end() == pos:
+            if not text[pos:].strip(): break
+            raise ValueError(f"无法解析查询: ...{text[pos:pos + 20]}")
+        pos = m.end()
+        kind = m.lastgroup
+        value = m.group(kind)
+        if kind == "str": tokens.append(("lit", value[1:-1].replace("''", "'")))
+        elif kind == "num": tokens.append(("lit", float(value)))
+        elif kind == "ident": tokens.append(("ident", value[1:-1]))
+        elif kind == "op": tokens.append(("op", value))
+        elif value.upper() in _KEYWORDS or value.upper() in _AGGS: tokens.append(("kw", value.upper()))
+        else: tokens.append(("ident", value))
+    return tokens
+
+class _Parser:
+    def __init__(self, text):
+        self.tokens = _tokenize(text)
+        self.pos = 0
+
+    def peek(self, kind=None, value=None):
+        if self.pos >= len(self.tokens): return None
+        tok = self.tokens[self.pos]
+        if kind and tok[0] != kind: return None
+        if value is not None and tok[1] != value: return None
+        return tok
+
+    def take(self, kind=None, value=None):
+        tok = self.peek(kind, value)
+        if tok is None:
+            found = self.tokens[self.pos][1] if self.pos < len(self.tokens) else "查询结尾"
+            raise ValueError(f"查询语法错误: 需要 {value or kind}，实际为 {found}")
+        self.pos += 1
+        return tok
+
+    def accept(self, kind, value=None):
+        if self.peek(kind, value):
+            self.pos += 1
+            return True
+        return False
+
+    def ident(self):
+        tok = self.peek()
+        # 与关键字同名的列名 (如 "count") 需加引号；聚合函数名后不跟括号时按列名处理
+        if tok and (tok[0] == "ident" or (tok[1] in _AGGS and not self._next_is_paren())):
+            self.pos += 1
+            return str(tok[1])
+        return self.take("ident")[1]
+
+    def _next_is_paren(self):
+        return self.pos + 1 < len(self.tokens) and self.tokens[self.pos + 1] == ("op", "(")
+
+    def parse(self):
+        q = {"select": None, "where": None, "group": [], "order": [], "limit": None}
+        if self.accept("kw", "SELECT"):
+            if self.accept("op", "*"):
+                q["select"] = None
+            else:
+                q["select"] = [self.select_item()]
+                while self.accept("op", ","): q["select"].append(self.select_item())
+        if self.accept("kw", "WHERE"): q["where"] = self.cond()
+        if self.accept("kw", "GROUP"):
+            self.take("kw", "BY")
+            q["group"] = [self.ident()]
+            while self.accept("op", ","): q["group"].append(self.ident())
+        if self.accept("kw", "ORDER"):
+            self.take("kw", "BY")
+            q["order"] = [self.order_item()]
+            while self.accept("op", ","): q["order"].append(self.order_item())
+        if self.accept("kw", "LIMIT"):
+            value = self.take("lit")[1]
+            if not isinstance(value, float) or value < 0 or not value.is_integer(): raise ValueError(f"LIMIT 须为非负整数: {value}")
+            q["limit"] = int(value)
+        if self.pos < len(self.tokens): raise ValueError(f"查询语法错误: 多余的 {self.tokens[self.pos][1]}")
+        return q
+
+    def expr(self):
+        """列名，或 聚合(列) / COUNT(*) / COUNT(DISTINCT 列)"""
+        tok = self.peek("kw")
+        if tok and tok[1] in _AGGS and self._next_is_paren():
+            self.pos += 1
+            self.take("op", "(")
+            distinct = self.accept("kw", "DISTINCT")
+            col = None if self.accept("op", "*") else self.ident()
+            self.take("op", ")")
+            if col is None and tok[1] != "COUNT": raise ValueError(f"{tok[1]}(*) 不受支持")
+            func = "COUNT_DISTINCT" if distinct else tok[1]
+            label = f"{tok[1]}({'DISTINCT ' if distinct else ''}{col or '*'})"
+            return {"agg": func, "col": col, "label": label}
+        col = self.ident()
+        return {"agg": None, "col": col, "label": col}
+
+    def select_item(self):
+        item = self.expr()
+        if self.accept("kw", "AS"): item["label"] = self.ident()
+        return item
+
+    def order_item(self):
+        item = self.expr()
+        desc = self.accept("kw", "DESC")
+        if not desc: self.accept("kw", "ASC")
+        return item, desc
+
+    def cond(self):
+        node = self.and_cond()
+        while self.accept("kw", "OR"): node = ("or", node, self.and_cond())
+        return node
+
+    def and_cond(self):
+        node = self.not_cond()
+        while self.accept("kw", "AND"): node = ("and", node, self.not_cond())
+        return node
+
+    def not_cond(self):
+        if self.accept("kw", "NOT"): return ("not", self.not_cond())
+        if self.accept("op", "("):
+            node = self.cond()
+            self.take("op", ")")
+            return node
+        col = self.ident()
+        if self.accept("kw", "IS"):
+            negate = self.accept("kw", "NOT")
+            self.take("kw", "NULL")
+            return ("notnull" if negate else "isnull", col)
+        negate = self.accept("kw", "NOT")
+        if self.accept("kw", "IN"):
+            self.take("op", "(")
+            values = [self.take("lit")[1]]
+            while self.accept("op", ","): values.append(self.take("lit")[1])
+            self.take("op", ")")
+            node = ("in", col, values)
+        elif self.accept("kw", "LIKE"):
+            node = ("like", col, str(self.take("lit")[1]))
+        elif self.accept("kw", "BETWEEN"):
+            low = self.take("lit")[1]
+            self.take("kw", "AND")
+            node = ("and", ("cmp", col, ">=", low), ("cmp", col, "<=", self.take("lit")[1]))
+        else:
+            if negate: raise ValueError("NOT 只能用于 IN / LIKE / BETWEEN")
+            op = self.take("op")[1]
+            if op not in ("=", "!=", "<>", ">", ">=", "<", "<="): raise ValueError(f"不支持的比较运算符 {op}")
+            return ("cmp", col, "!=" if op == "<>" else op, self.take("lit")[1])
+        return ("not", node) if negate else node
+
+# === 执行 ===
+_CMP = {"=": np.equal, "!=": np.not_equal, ">": np.greater, ">=": np.greater_equal, "<": np.less, "<=": np.less_equal} if HAS_NUMPY else {}
+_PY_CMP = {"=": lambda a, b: a == b, "!=": lambda a, b: a != b, ">": lambda a, b: a > b,
+           ">=": lambda a, b: a >= b, "<": lambda a, b: a < b, "<=": lambda a, b: a <= b}
+
+def _literal(col, value):
+    """字面量转换为列的类型"""
+    if col.kind == "num":
+        try:
+            return float(value)
+        except (TypeError, ValueError):
+            raise ValueError(f"列 {col.name} 是数值列，无法与 '{value}' 比较")
+    if col.kind == "date":
+        try:
+            return np.datetime64(str(value).strip().replace(" ", "T"), "s")
+        except ValueError:
+            raise ValueError(f"列 {col.name} 是日期列，'{value}' 不是有效日期 (如 2024-01-31)")
+    return format_number(value) if isinstance(value, float) else str(value)
+
+def _dict_mask(col, predicate):
+    """文本列：先对字典逐项求值，再按编码向量化映射到各行"""
+    lut = np.zeros(len(col.dictionary) + 1, dtype=bool)
+    lut[:-1] = [predicate(v) for v in col.dictionary]
+    return lut[col.data]
+
+def _eval(node, table):
+    kind = node[0]
+    if kind == "and": return _eval(node[1], table) & _eval(node[2], table)
+    if kind == "or": return _eval(node[1], table) | _eval(node[2], table)
+    if kind == "not": return ~_eval(node[1], table)
+    col = table.column(node[1])
+    if kind == "isnull": return ~col.notnull()
+    if kind == "notnull": return col.notnull()
+    if kind == "like":
+        pattern = re.compile("^" + ".*".join(".".join(re.escape(p) for p in part.split("_")) for part in node[2].split("%")) + "$", re.I | re.S)
+        if col.kind != "str": raise ValueError(f"LIKE 只能用于文本列，{col.name} 是{'数值' if col.kind == 'num' else '日期'}列")
+        return _dict_mask(col, lambda v: pattern.match(v) is not None)
+    if kind == "in":
+        if col.kind == "str":
+            wanted = {_literal(col, v) for v in node[2]}
+            return _dict_mask(col, lambda v: v in wanted)
+        values = np.array([_literal(col, v) for v in node[2]])
+        return np.isin(col.data, values) & col.notnull()
+    _, _, op, value = node
+    value = _literal(col, value)
+    if col.kind == "str":
+        if op == "=": # 等值比较直接查编码
+            code = col.dictionary.index(value) if value in col.dictionary else -2
+            return col.data == code
+        return _dict_mask(col, lambda v: _PY_CMP[op](v, value))
+    return _CMP[op](col.data, value) & col.notnull()
+
+class _Result:
+    """结果列：display(i) 给出第 i 行的显示文本，key 为排序键"""
+    def __init__(self, label, display, key):
+        self.label = label
+        self.display = display
+        self.key = key
+
+def _row_column(col, idx):
+    key = col.sort_key()[idx]
+    return _Result(col.name, lambda i: col.display(idx[i]), key)
+
+def _group_ids(table, group_cols, idx):
+    """分组键 -> (每行的组号, 组数, 每组首行在 idx 中的位置)"""
+    if not group_cols:
+        return np.zeros(len(idx), dtype=np.int64), 1 if len(idx) else 0, np.zeros(1 if len(idx) else 0, dtype=np.int64)
+    combined = np.zeros(len(idx), dtype=np.int64)
+    for c in group_cols: # 多列键折叠为一维整数键，避免 np.unique(axis=0) 的逐行比较
+        _, inverse = np.unique(table.column(c).sort_key()[idx], return_inverse=True)
+        inverse = inverse.reshape(-1)
+        combined = combined * (int(inverse.max(initial=0)) + 1) + inverse
+    _, first, gid = np.unique(combined, return_index=True, return_inverse=True)
+    return gid.reshape(-1), len(first), first
+
+def _aggregate(item, table, idx, gid, n_groups):
+    func = item["agg"]
+    if item["col"] is None: # COUNT(*)
+        values = np.bincount(gid, minlength=n_groups).astype(np.float64)
+        return _Result(item["label"], lambda i: format_number(values[i]), values)
+    col = table.column(item["col"])
+    valid = col.notnull()[idx]
+    if func == "COUNT":
+        values = np.bincount(gid, weights=valid.astype(np.float64), minlength=n_groups)
+    elif func == "COUNT_DISTINCT":
+        _, inverse = np.unique(col.sort_key()[idx][valid], return_inverse=True)
+        pairs = np.unique(gid[valid] * (len(inverse) + 1) + inverse.reshape(-1))
+        values = np.bincount(pairs // (len(inverse) + 1), minlength=n_groups).astype(np.float64)
+    elif func in ("SUM", "AVG"):
+        if col.kind != "num": raise ValueError(f"{func} 只能用于数值列，{col.name} 不是数值列")
+        data = np.asarray(col.data)[idx]
+        values = np.bincount(gid, weights=np.where(valid, data, 0.0), minlength=n_groups)
+        if func == "AVG":
+            counts = np.bincount(gid, weights=valid.astype(np.float64), minlength=n_groups)
+            with np.errstate(invalid="ignore", divide="ignore"):
+                values = np.where(counts > 0, values / counts, np.nan)
+    else: # MIN / MAX：按组排序后分段归约，文本/日期列在排序键上计算后映射回原值
+        key = col.sort_key()[idx][valid]
+        g = gid[valid]
+        order = np.lexsort((key, g))
+        g_sorted = g[order]
+        if func == "MIN":
+            pick = order[np.flatnonzero(np.r_[True, g_sorted[1:] != g_sorted[:-1]])] if len(g) else order
+        else:
+            pick = order[np.flatnonzero(np.r_[g_sorted[1:] != g_sorted[:-1], True])] if len(g) else order
+        rows = np.full(n_groups, -1, dtype=np.int64)
+        rows[g[pick]] = np.flatnonzero(valid)[pick]
+        source = idx
+        values = np.full(n_groups, np.inf)
+        values[g[pick]] = key[pick]
+        return _Result(item["label"], lambda i: col.display(source[rows[i]]) if rows[i] >= 0 else "", values)
+    return _Result(item["label"], lambda i: format_number(values[i]), np.where(np.isnan(values), np.inf, values))
+
+def execute(table, query):
+    """执行查询，返回 (结果列列表, 输出行序, 匹配行数, 分组数)"""
+    q = _Parser(query).parse()
+    mask = _eval(q["where"], table) if q["where"] is not None else np.ones(table.rows, dtype=bool)
+    idx = np.flatnonzero(mask)
+    select = q["select"]
+    aggregated = q["group"] or any(item["agg"] for item in (select or []))
+
+    if aggregated:
+        group_lower = {g.lower() for g in q["group"]}
+        for item in select or []:
+            if not item["agg"] and item["col"].lower() not in group_lower:
+                raise ValueError(f"列 {item['col']} 既不在 GROUP BY 中也不是聚合，请加入 GROUP BY 或使用聚合函数")
+        gid, n_groups, first = _group_ids(table, q["group"], idx)
+        items = select or [{"agg": None, "col": g, "label": g} for g in q["group"]] + [{"agg": "COUNT", "col": None, "label": "COUNT(*)"}]
+        group_first_rows = idx[first] if len(first) else first
+
+        def _build(item):
+            if item["agg"]: return _aggregate(item, table, idx, gid, n_groups)
+            result = _row_column(table.column(item["col"]), group_first_rows)
+            result.label = item["label"]
+            return result
+        n_out = n_groups
+    else:
+        for item, _ in q["order"]:
+            if item["agg"]: raise ValueError(f"ORDER BY {item['label']} 是聚合，需要配合 GROUP BY 或在 SELECT 中使用聚合函数")
+        items = select or [{"agg": None, "col": c.name, "label": c.name} for c in table.columns]
+
+        def _build(item):
+            result = _row_column(table.column(item["col"]), idx)
+            result.label = item["label"]
+            return result
+        n_out = len(idx)
+
+    results = [_build(item) for item in items]
+    order = np.arange(n_out)
+    if q["order"]:
+        by_label = {r.label.lower(): r for r in results}
+        keys = []
+        for item, desc in q["order"]:
+            res = by_label.get(item["label"].lower()) or by_label.get((item["col"] or "").lower()) or _build(item)
+            key = np.asarray(res.key, dtype=np.float64)
+            keys.append(np.where(np.isinf(key), np.inf, -key) if desc else key) # 空值始终排在最后
+        order = np.lexsort(keys[::-1])
+    limit = min(MAX_LIMIT, DEFAULT_LIMIT if q["limit"] is None else q["limit"]) # LIMIT 0 只返回统计，不返回行
+    return results, order[:limit], len(idx), (n_groups if aggregated else None)
+
+def run_query(path, query, sheet=None):
+    """在列式缓存上执行查询，返回适合放入上下文的紧凑表格文本"""
+    start = time.perf_counter()
+    table, names = get_table(path, sheet)
+    results, order, matched, n_groups = execute(table, query)
+    lines = [" | ".join(r.label for r in results)]
+    lines += [" | ".join(r.display(int(i)) for r in results) for i in order]
+    total = n_groups if n_groups is not None else matched
+    stats = f"匹配 {matched}/{table.rows} 行" + (f"，{n_groups} 组" if n_groups is not None else "")
+    more = f"，显示前 {len(order)} 条 (用 LIMIT 调整，最多 {MAX_LIMIT})" if total > len(order) else ""
+    head = f"[工作表: {table.sheet} | {stats}{more} | {(time.perf_counter() - start) * 1000:.0f}ms]"
+    return "\n".join([head] + lines)
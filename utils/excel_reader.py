@@ -0,0 +1,151 @@
+import os
+import threading
+from collections import OrderedDict
+import openpyxl
+from openpyxl.utils import get_column_letter, column_index_from_string
+from utils.ttl_cache import TTLCache
+
+class SheetRows:
+    """
+    单个工作表的只读行流，只在内存中保留最近读过的 WINDOW 行 (表头另存)
+    - 往后翻页时从流的当前位置继续读取，窗口内的行直接从内存返回
+    - 翻回窗口之前的行时重新打开只读流 (iter_rows(min_row=...))，代价是重新解析到该行
+    内存占用与工作表大小无关
+    """
+    WINDOW = 2000
+
+    def __init__(self, ws):
+        self.title = ws.title
+        self.dimension_rows = ws.max_row # 来自 <dimension> 标记，可能缺失或不准
+        self.complete = False # 是否已读到过工作表末尾
+        self.last_row = 0     # 已读到的最后一个非空行号；complete 后即为总行数
+        self._ws = ws
+        self._window = OrderedDict() # 行号 -> 值元组，按最近使用排序
+        self._open(1)
+        self._header = self._get(1) or ()
+
+    def _open(self, start_row):
+        self._iter = self._ws.iter_rows(min_row=start_row, values_only=True)
+        self._next = start_row # 流中下一行的行号
+
+    def _get(self, row_no):
+        """第 row_no 行的值元组，超出工作表时为 None"""
+        values = self._window.get(row_no)
+        if values is not None:
+            self._window.move_to_end(row_no)
+            return values
+        if self.complete and row_no > self.last_row: return None
+        if row_no < self._next or self._iter is None: self._open(row_no)
+        while self._next <= row_no:
+            try:
+                values = next(self._iter)
+            except StopIteration:
+                self._iter = None
+                self.complete = True
+                return None
+            if any(c is not None for c in values): self.last_row = max(self.last_row, self._next)
+            self._window[self._next] = values
+            if len(self._window) > self.WINDOW: self._window.popitem(last=False)
+            self._next += 1
+        return values
+
+    def header(self):
+        return self._header
+
+    def total_rows(self):
+        """已读完时为准确行数，否则为维度标记给出的估计值 (None 表示未知)"""
+        return self.last_row if self.complete else self.dimension_rows
+
+    def iter_from(self, start_row=1):
+        """
+        从第 start_row 行开始逐行产出 (行号, 值元组)
+        只读模式会按维度补出尾部空行：连续的空行只有在其后还有数据时才产出
+        """
+        row_no, empty = start_row, 0
+        while True:
+            values = self._get(row_no)
+            if values is None: return
+            if any(c is not None for c in values):
+                for r in range(row_no - empty, row_no): yield r, ()
+                empty = 0
+                yield row_no, values
+            else:
+                empty += 1
+            row_no += 1
+
+    def has_row(self, row_no):
+        """第 row_no 行或其后是否还有数据"""
+        return next(self.iter_from(row_no), None) is not None
+
+class ParsedWorkbook:
+    """只读打开的工作簿及其各工作表的行缓存；同一时刻只允许一个调用方读取"""
+    def __init__(self, path):
+        self.path = path
+        self._wb = openpyxl.load_workbook(path, read_only=True, data_only=True)
+        self.sheetnames = list(self._wb.sheetnames)
+        self.active = self._wb.active.title if self._wb.active is not None else self.sheetnames[0]
+        self._sheets = {}
+        self.lock = threading.RLock()
+
+    def sheet(self, name=None):
+        """name 为表名或从 1 开始的序号，省略时为活动工作表"""
+        if name in (None, ""):
+            name = self.active
+        elif name not in self.sheetnames and str(name).isdigit() and 1 <= int(name) <= len(self.sheetnames):
+            name = self.sheetnames[int(name) - 1]
+        if name not in self.sheetnames:
+            raise ValueError(f"工作表 {name} 不存在，可选: {', '.join(self.sheetnames)}")
+        rows = self._sheets.get(name)
+        if rows is None:
+            rows = self._sheets[name] = SheetRows(self._wb[name])
+        return rows
+
+_workbooks = TTLCache(max_entries=4, ttl=600)
+_open_lock = threading.Lock()
+
+def _file_key(path):
+    st = os.stat(path)
+    return (os.path.abspath(path), st.st_mtime_ns, st.st_size)
+
+def get_workbook(path):
+    """按 (路径, 修改时间, 大小) 缓存已解析的工作簿；文件被改写后自动失效"""
+    key = _file_key(path)
+    with _open_lock:
+        wb = _workbooks.get(key)
+        if wb is None:
+            invalidate(path)
+            wb = ParsedWorkbook(path)
+            _workbooks.set(key, wb)
+        return wb
+
+def invalidate(path):
+    """丢弃该文件的缓存 (写入/删除前调用)；只读句柄随对象释放而关闭"""
+    abspath = os.path.abspath(path)
+    return _workbooks.invalidate(lambda key: key[0] == abspath)
+
+def resolve_columns(header, columns):
+    """列选择 -> 列下标列表；每项可以是表头名 (不区分大小写) 或列字母 (A, BC)"""
+    if not columns: return list(range(len(header)))
+    if isinstance(columns, str): columns = [c for c in columns.split(",")]
+    names = {str(h).strip().lower(): i for i, h in enumerate(header) if h is not None}
+    indices = []
+    for col in columns:
+        col = str(col).strip()
+        if not col: continue
+        if col.lower() in names:
+            indices.append(names[col.lower()])
+            continue
+        try:
+            indices.append(column_index_from_string(col.upper()) - 1)
+        except ValueError:
+            raise ValueError(f"列 {col} 不存在，表头为: {', '.join(str(h) for h in header if h is not None)}")
+    return indices
+
+def format_cell(value, max_len=200):
+    if value is None: return ""
+    text = str(value).replace("\n", " ")
+    return text if len(text) <= max_len else text[:max_len] + "…"
+
+def column_label(index, header):
+    name = header[index] if index < len(header) else None
+    return f"{get_column_letter(index + 1)}:{name}" if name not in (None, "") else get_column_letter(index + 1)
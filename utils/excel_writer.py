@@ -0,0 +1,182 @@
+import os
+import ast
+import atexit
+import bisect
+import threading
+import openpyxl
+from openpyxl.worksheet.cell_range import CellRange, MultiCellRange
+from utils.logger import logger
+from utils.excel_reader import invalidate
+
+def parse_row(data):
+    """模型有时把列表当字符串传入 ("['a', 'b']")，能解析就解析，否则当作单列"""
+    if isinstance(data, str):
+        try:
+            data = ast.literal_eval(data)
+        except (ValueError, SyntaxError):
+            return [data]
+    if isinstance(data, (list, tuple)): return list(data)
+    return [data]
+
+def parse_row_spec(spec):
+    """
+    行号说明 -> [(起始行, 结束行)]，支持 "2,3"、"5-9" 及其组合
+    只记录区间端点，不展开 (超出工作表的部分由 delete_rows 按实际行数截断)
+    """
+    ranges = []
+    for part in str(spec).replace("，", ",").split(","):
+        part = part.strip()
+        if not part: continue
+        if "-" in part:
+            start, _, end = part.partition("-")
+            if not (start.strip().isdigit() and end.strip().isdigit()): raise ValueError(f"无法识别的行范围: {part}")
+            start, end = int(start), int(end)
+            if start > end: raise ValueError(f"行范围起点大于终点: {part}")
+            ranges.append((start, end))
+        elif part.isdigit():
+            ranges.append((int(part), int(part)))
+        else:
+            raise ValueError(f"无法识别的行号: {part}")
+    return ranges
+
+def delete_rows(ws, rows=None, predicate=None):
+    """
+    一次遍历删除多行，返回被删除的行号列表
+    - rows 为 [(起始行, 结束行)] 区间列表 (见 parse_row_spec)，超出工作表的部分忽略
+    - 行 r 被删除的条件: (rows 为空或 r 在 rows 中) 且 (predicate 为空或 predicate(该行值列表) 为真)；
+      只给 predicate 时不检查第 1 行 (表头)
+    - 保留的行按其上方已删除的行数整体上移，每个单元格只移动一次；单元格值与逐行调用 ws.delete_rows 的结果一致，
+      但不会因每删一行就移动下方所有行而退化为平方复杂度
+    - 合并单元格、行高等行格式、超链接和数据验证随所在行一起移动 (ws.delete_rows 不处理这些)；
+      公式与条件格式不改写
+    """
+    if rows is None and predicate is None: return []
+    by_row = {}
+    for (r, _), cell in ws._cells.items():
+        by_row.setdefault(r, []).append(cell)
+    max_row = ws.max_row
+    candidates = set(by_row) if rows is None else {
+        r for start, end in rows for r in range(max(1, start), min(end, max_row) + 1)
+    }
+    deleted = []
+    for r in sorted(candidates):
+        if rows is None and r == 1: continue
+        if predicate is None or predicate([c.value for c in sorted(by_row.get(r, ()), key=lambda c: c.column)]):
+            deleted.append(r)
+    if deleted: _remove_rows(ws, deleted)
+    return deleted
+
+def _shift_span(deleted, min_row, max_row):
+    """删除 deleted (升序) 后，行区间 [min_row, max_row] 的新区间；整段被删时返回 None"""
+    lo, hi = bisect.bisect_left(deleted, min_row), bisect.bisect_right(deleted, max_row)
+    if hi - lo == max_row - min_row + 1: return None
+    return min_row - lo, max_row - hi
+
+def _remove_rows(ws, deleted):
+    """按升序的行号列表一次性删除行并上移其余行"""
+    gone = set(deleted)
+    first = deleted[0]
+    # 合并单元格：先取消合并，单元格移动后按新位置重新合并 (首行被删时由剩余的第一行接替)
+    remerge = []
+    for mcr in list(ws.merged_cells.ranges):
+        if mcr.max_row < first: continue
+        span = _shift_span(deleted, mcr.min_row, mcr.max_row)
+        ws.unmerge_cells(mcr.coord)
+        if span and (span[0] != span[1] or mcr.min_col != mcr.max_col):
+            remerge.append((span[0], mcr.min_col, span[1], mcr.max_col))
+
+    cells = {}
+    for (r, c), cell in ws._cells.items():
+        if r in gone: continue
+        shift = bisect.bisect_left(deleted, r)
+        if shift:
+            cell.row = r - shift
+            link = getattr(cell, "hyperlink", None)
+            if link is not None: link.ref = cell.coordinate
+        cells[(cell.row, c)] = cell
+    ws._cells = cells
+    ws._current_row = ws.max_row if cells else 0 # 与 ws.delete_rows 一致，供之后的 append 定位
+
+    for min_row, min_col, max_row, max_col in remerge:
+        ws.merge_cells(start_row=min_row, start_column=min_col, end_row=max_row, end_column=max_col)
+
+    dims = [(r, dim) for r, dim in ws.row_dimensions.items() if r not in gone]
+    ws.row_dimensions.clear()
+    for r, dim in dims:
+        dim.index = r - bisect.bisect_left(deleted, r)
+        ws.row_dimensions[dim.index] = dim
+
+    for dv in list(ws.data_validations.dataValidation):
+        ranges = []
+        for cr in dv.sqref.ranges:
+            span = _shift_span(deleted, cr.min_row, cr.max_row)
+            if span: ranges.append(CellRange(min_col=cr.min_col, min_row=span[0], max_col=cr.max_col, max_row=span[1]))
+        if ranges:
+            dv.sqref = MultiCellRange(ranges)
+        else:
+            ws.data_validations.dataValidation.remove(dv)
+
+def contains_predicate(text):
+    """任一单元格文本包含 text (不区分大小写) 的行"""
+    needle = str(text).strip().lower()
+    return lambda values: any(v is not None and needle in str(v).lower() for v in values)
+
+class ExcelWriteBuffer:
+    """
+    excel_write 的写入合并缓冲
+    同一文件的多次追加先记在内存里，在本步工具调用结束时 (或读取/删除该文件前) 一次加载、一次保存，
+    避免每追加一行就把整个文件重写一遍
+    """
+    def __init__(self, max_rows=20000):
+        self.max_rows = max_rows # 单个文件待写入行数达到该值时立即落盘，限制内存占用
+        self._pending = {} # 绝对路径 -> [(工作表名, 行)]
+        self._lock = threading.RLock()
+
+    def append(self, path, rows, sheet_name=None):
+        """加入待写入队列，返回该文件当前待写入的行数"""
+        key = os.path.abspath(path)
+        with self._lock:
+            queue = self._pending.setdefault(key, [])
+            queue.extend((sheet_name, row) for row in rows)
+            n = len(queue)
+        if n >= self.max_rows:
+            error = self.flush(path).get(key)
+            if error: raise RuntimeError(error)
+            return 0
+        return n
+
+    def pending(self, path=None):
+        with self._lock:
+            if path is None: return sum(len(q) for q in self._pending.values())
+            return len(self._pending.get(os.path.abspath(path), ()))
+
+    def flush(self, path=None):
+        """保存待写入的行 (path 为空表示全部文件)；返回 {路径: 错误信息}，全部成功时为空"""
+        errors = {}
+        with self._lock: # 保存期间阻塞新的追加，保证行序
+            if path is None:
+                items, self._pending = self._pending, {}
+            else:
+                key = os.path.abspath(path)
+                items = {key: self._pending.pop(key)} if key in self._pending else {}
+            for key, queue in items.items():
+                try:
+                    self._apply(key, queue)
+                except Exception as e:
+                    errors[key] = f"{os.path.basename(key)} 的 {len(queue)} 行未能写入: {e}"
+                    logger.error(f"[ExcelWrite] {errors[key]}")
+        return errors
+
+    @staticmethod
+    def _apply(path, queue):
+        invalidate(path)
+        wb = openpyxl.load_workbook(path)
+        for sheet_name, row in queue:
+            sheet = wb[sheet_name] if sheet_name and sheet_name in wb.sheetnames else wb.active
+            sheet.append(row)
+        wb.save(path)
+        invalidate(path)
+        logger.info(f"[ExcelWrite] {os.path.basename(path)}: 合并写入 {len(queue)} 行")
+
+write_buffer = ExcelWriteBuffer()
+atexit.register(write_buffer.flush) # 兜底：进程退出前写出残留的行
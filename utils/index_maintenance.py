@@ -0,0 +1,258 @@
+import os
+import json
+import time
+import uuid
+import argparse
+import threading
+from utils.logger import logger
+
+try:
+    import numpy as np
+    HAS_NUMPY = True
+except ImportError:
+    HAS_NUMPY = False
+
+# Chroma 自身的 HNSW 默认值 (M=16, construction_ef=100, search_ef=10)
+CHROMA_DEFAULT_HNSW = {"M": 16, "construction_ef": 100, "search_ef": 10}
+
+# === HNSW 参数 ===
+def hnsw_settings(coll_name, rag_conf):
+    """全局 rag.hnsw 与 rag.hnsw_overrides[collection] 合并后的参数"""
+    settings = dict(CHROMA_DEFAULT_HNSW)
+    settings.update(rag_conf.get("hnsw", {}))
+    settings.update(rag_conf.get("hnsw_overrides", {}).get(coll_name, {}))
+    return {k: int(settings[k]) for k in CHROMA_DEFAULT_HNSW}
+
+def hnsw_metadata(settings, space="l2"):
+    """创建 collection 时使用的元数据 (Chroma 0.4+ 通用写法，1.x 会自动转换为 configuration)"""
+    return {
+        "hnsw:space": space,
+        "hnsw:M": settings["M"],
+        "hnsw:construction_ef": settings["construction_ef"],
+        "hnsw:search_ef": settings["search_ef"]
+    }
+
+def current_hnsw(coll):
+    """读取 collection 实际生效的 HNSW 参数与距离类型"""
+    conf = getattr(coll, "configuration", None)
+    hnsw = conf.get("hnsw") if isinstance(conf, dict) else None
+    if hnsw:
+        return {
+            "M": hnsw.get("max_neighbors", CHROMA_DEFAULT_HNSW["M"]),
+            "construction_ef": hnsw.get("ef_construction", CHROMA_DEFAULT_HNSW["construction_ef"]),
+            "search_ef": hnsw.get("ef_search", CHROMA_DEFAULT_HNSW["search_ef"]),
+            "space": hnsw.get("space", "l2")
+        }
+    meta = coll.metadata or {}
+    return {
+        "M": meta.get("hnsw:M", CHROMA_DEFAULT_HNSW["M"]),
+        "construction_ef": meta.get("hnsw:construction_ef", CHROMA_DEFAULT_HNSW["construction_ef"]),
+        "search_ef": meta.get("hnsw:search_ef", CHROMA_DEFAULT_HNSW["search_ef"]),
+        "space": meta.get("hnsw:space", "l2")
+    }
+
+def apply_search_ef(coll, search_ef):
+    """
+    在线修改 search_ef (Chroma 1.x 支持)；老版本只能在创建时指定，返回 False 表示需要重建
+    注意不能用 modify(metadata=...)：它会整体替换元数据而 HNSW 参数并不生效
+    """
+    try:
+        coll.modify(configuration={"hnsw": {"ef_search": int(search_ef)}})
+        return True
+    except Exception as e:
+        logger.info(f"[IndexMaint] search_ef 不支持在线修改，需要重建: {e}")
+        return False
+
+# === 维护记录 ===
+class MaintenanceLog:
+    """chroma_db/maintenance.json：每个 collection 自上次重建以来删除的切片数、上次重建时间与参数"""
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._data = {}
+        if os.path.exists(path):
+            try:
+                with open(path, 'r', encoding='utf-8') as f:
+                    self._data = json.load(f)
+            except Exception as e:
+                logger.error(f"[IndexMaint] 维护记录读取失败: {e}")
+
+    def _save(self):
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        tmp = self.path + ".tmp"
+        with open(tmp, 'w', encoding='utf-8') as f:
+            json.dump(self._data, f, ensure_ascii=False, indent=2)
+        os.replace(tmp, self.path)
+
+    def get(self, name):
+        with self._lock:
+            return dict(self._data.get(name, {}))
+
+    def record_deletes(self, name, n):
+        if not n: return
+        with self._lock:
+            entry = self._data.setdefault(name, {})
+            entry["deleted_since_rebuild"] = entry.get("deleted_since_rebuild", 0) + n
+            self._save()
+
+    def record_rebuild(self, name, settings, count):
+        with self._lock:
+            self._data.setdefault(name, {}).update(
+                {"deleted_since_rebuild": 0, "last_rebuild": time.time(), "settings": settings, "count": count}
+            )
+            self._save()
+
+    def record_model(self, name, model):
+        """记录 collection 对应的嵌入模型 (collection 名由模型名转换而来，无法反推)"""
+        with self._lock:
+            entry = self._data.setdefault(name, {})
+            if entry.get("embed_model") == model: return
+            entry["embed_model"] = model
+            self._save()
+
+    def models(self):
+        """{collection 名: 嵌入模型名}"""
+        with self._lock:
+            return {name: e["embed_model"] for name, e in self._data.items() if e.get("embed_model")}
+
+# === 重建 / 压缩 ===
+def copy_collection(src, dst, page_size=1000, progress=None):
+    """按页拷贝向量、文本和元数据 (不重新嵌入)"""
+    total = src.count()
+    offset = copied = 0
+    while True:
+        data = src.get(include=['embeddings', 'documents', 'metadatas'], limit=page_size, offset=offset)
+        if not len(data['ids']): break
+        dst.add(ids=data['ids'], embeddings=data['embeddings'], documents=data['documents'], metadatas=data['metadatas'])
+        offset += len(data['ids'])
+        copied += len(data['ids'])
+        if progress: progress(copied, total)
+    return copied
+
+def rebuild_chroma_collection(client, coll, settings, embedding_function=None, progress=None):
+    """
+    用新的 HNSW 参数重建 collection：写入临时 collection -> 删除旧的 -> 改名。
+    重建后的索引不含已删除切片留下的墓碑。返回新的 collection。
+    """
+    name = coll.name
+    space = current_hnsw(coll)["space"]
+    tmp_name = f"{name}__rebuild"
+    try:
+        client.delete_collection(tmp_name) # 上次中断留下的临时 collection
+    except Exception:
+        pass
+    tmp = client.create_collection(name=tmp_name, metadata=hnsw_metadata(settings, space), embedding_function=embedding_function)
+    start = time.perf_counter()
+    copied = copy_collection(coll, tmp, progress=progress)
+    if copied != coll.count():
+        client.delete_collection(tmp_name)
+        raise RuntimeError(f"重建时切片数不一致: {copied} != {coll.count()}，已放弃")
+    client.delete_collection(name)
+    tmp.modify(name=name)
+    logger.info(f"[IndexMaint] {name} 重建完成: {copied} 个切片, {settings}, {time.perf_counter() - start:.1f}s")
+    return client.get_collection(name=name, embedding_function=embedding_function)
+
+# === 召回率 / 延迟探测 ===
+def _exact_top_k(base, queries, k, space):
+    if space == "cosine":
+        b = base / np.clip(np.linalg.norm(base, axis=1, keepdims=True), 1e-12, None)
+        q = queries / np.clip(np.linalg.norm(queries, axis=1, keepdims=True), 1e-12, None)
+        dist = -(q @ b.T)
+    elif space == "ip":
+        dist = -(queries @ base.T)
+    else:
+        dist = (queries ** 2).sum(axis=1)[:, None] - 2 * queries @ base.T + (base ** 2).sum(axis=1)[None, :]
+    return np.argsort(dist, axis=1)[:, :k]
+
+def probe_hnsw(coll, candidates, sample_size=5000, n_queries=100, k=10, progress=None):
+    """
+    在临时内存 collection 上评估各组 HNSW 参数：
+    从 collection 取 sample_size 个向量建索引，另取 n_queries 个向量作查询，
+    以暴力检索结果为准计算 recall@k，并统计单次查询延迟。不修改原 collection。
+    """
+    if not HAS_NUMPY: raise ImportError("缺少 numpy，无法运行探测")
+    import chromadb
+    space = current_hnsw(coll)["space"]
+    data = coll.get(include=['embeddings'], limit=sample_size + n_queries)
+    vecs = np.asarray(data['embeddings'], dtype=np.float32)
+    if len(vecs) < k + 2: raise ValueError(f"切片太少 ({len(vecs)})，无法探测")
+    rng = np.random.default_rng(0)
+    order = rng.permutation(len(vecs))
+    n_q = min(n_queries, max(1, len(vecs) // 10))
+    queries, base = vecs[order[:n_q]], vecs[order[n_q:]]
+    base_ids = [str(i) for i in range(len(base))]
+    k = min(k, len(base))
+    truth = _exact_top_k(base, queries, k, space)
+
+    client = chromadb.EphemeralClient()
+    report = []
+    for ci, settings in enumerate(candidates):
+        name = f"probe-{uuid.uuid4().hex[:12]}"
+        tmp = client.create_collection(name=name, metadata=hnsw_metadata(settings, space))
+        try:
+            t0 = time.perf_counter()
+            for i in range(0, len(base), 1000):
+                tmp.add(ids=base_ids[i:i + 1000], embeddings=base[i:i + 1000].tolist())
+            build_s = time.perf_counter() - t0
+            latencies, hits = [], 0
+            for qi, q in enumerate(queries):
+                t1 = time.perf_counter()
+                res = tmp.query(query_embeddings=[q.tolist()], n_results=k, include=[])
+                latencies.append(time.perf_counter() - t1)
+                found = {int(x) for x in res['ids'][0]}
+                hits += len(found & set(truth[qi].tolist()))
+            lat = np.array(latencies) * 1000
+            report.append({
+                **settings, "recall": round(hits / (k * len(queries)), 4),
+                "p50_ms": round(float(np.percentile(lat, 50)), 3), "p95_ms": round(float(np.percentile(lat, 95)), 3),
+                "build_s": round(build_s, 2)
+            })
+        finally:
+            client.delete_collection(name)
+        if progress: progress(ci + 1, len(candidates))
+    return {"space": space, "sample": len(base), "queries": len(queries), "k": k, "results": report}
+
+def format_probe(report):
+    lines = [f"space={report['space']} sample={report['sample']} queries={report['queries']} k={report['k']}",
+             f"{'M':>4} {'constr_ef':>9} {'search_ef':>9} {'recall':>7} {'p50_ms':>8} {'p95_ms':>8} {'build_s':>8}"]
+    for r in report["results"]:
+        lines.append(f"{r['M']:>4} {r['construction_ef']:>9} {r['search_ef']:>9} {r['recall']:>7.3f} {r['p50_ms']:>8.3f} {r['p95_ms']:>8.3f} {r['build_s']:>8.2f}")
+    return "\n".join(lines)
+
+# === 命令行 (离线维护，建议在应用停止时执行) ===
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="知识库向量索引维护: 查看 / 重建压缩 / 参数探测")
+    parser.add_argument("command", choices=["info", "rebuild", "probe"])
+    parser.add_argument("--model", default="nomic-embed-text", help="嵌入模型名 (决定 collection)")
+    parser.add_argument("--M", type=int)
+    parser.add_argument("--construction-ef", type=int)
+    parser.add_argument("--search-ef", type=int)
+    parser.add_argument("--save", action="store_true", help="rebuild 时把参数写入 settings.json 的 rag.hnsw_overrides")
+    parser.add_argument("--sample", type=int, default=5000)
+    parser.add_argument("--queries", type=int, default=100)
+    parser.add_argument("-k", type=int, default=10)
+    args = parser.parse_args(argv)
+
+    from tools.knowledge import knowledge_tool
+    overrides = {k: v for k, v in {"M": args.M, "construction_ef": args.construction_ef, "search_ef": args.search_ef}.items() if v}
+
+    if args.command == "info":
+        print(json.dumps(knowledge_tool.get_index_info(args.model), ensure_ascii=False, indent=2))
+    elif args.command == "rebuild":
+        print(knowledge_tool.rebuild_index(args.model, overrides or None, save=args.save,
+                                           progress=lambda done, total: print(f"\r{done}/{total}", end="", flush=True)))
+    else:
+        info = knowledge_tool.get_index_info(args.model)
+        base = info.get("hnsw_current") or info.get("hnsw_configured")
+        if not base:
+            print("当前向量库不是 HNSW 索引，无需探测")
+            return
+        base = {k: base[k] for k in CHROMA_DEFAULT_HNSW}
+        candidates = [base, {**base, **overrides}] if overrides else [
+            base, {**base, "search_ef": max(base["search_ef"] * 2, 50)}, {**base, "search_ef": 100},
+            {**base, "M": 32, "construction_ef": 200, "search_ef": 100}
+        ]
+        print(format_probe(knowledge_tool.probe_index(args.model, candidates, args.sample, args.queries, args.k)))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,172 @@
+import os
+import json
+import gzip
+import time
+import shutil
+import argparse
+from utils.logger import logger
+
+try:
+    import numpy as np
+    HAS_NUMPY = True
+except ImportError:
+    HAS_NUMPY = False
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+    HAS_PYARROW = True
+except ImportError:
+    HAS_PYARROW = False
+
+SNAPSHOT_VERSION = 1
+MANIFEST = "manifest.json"
+EMBEDDINGS = "embeddings.npy"
+CHUNKS_PARQUET = "chunks.parquet"
+CHUNKS_JSONL = "chunks.jsonl.gz"
+
+# 知识库快照是一个目录，可直接打包拷贝到其他节点，导入时直接写入向量，不调用嵌入模型
+# - manifest.json   版本、collection、嵌入模型、维度、切片数、文档目录、近似重复引用等
+# - embeddings.npy  N x dim 向量矩阵 (float32 / float16)，行序与切片文件一致
+# - chunks.parquet  id / document / metadata(JSON) 三列 (需要 pyarrow，否则写 chunks.jsonl.gz)
+
+# === 导出 ===
+class _ChunkWriter:
+    """按页追加切片：有 pyarrow 时写 Parquet (每页一个 row group)，否则写 gzip JSON Lines"""
+    def __init__(self, out_dir):
+        self.columnar = HAS_PYARROW
+        self.name = CHUNKS_PARQUET if self.columnar else CHUNKS_JSONL
+        self.path = os.path.join(out_dir, self.name)
+        self._writer = None
+        self._file = None if self.columnar else gzip.open(self.path, 'wt', encoding='utf-8')
+
+    def write(self, ids, documents, metadatas):
+        metas = [json.dumps(m, ensure_ascii=False) if m else None for m in metadatas]
+        if not self.columnar:
+            for cid, doc, meta in zip(ids, documents, metas):
+                self._file.write(json.dumps({"id": cid, "document": doc, "metadata": meta}, ensure_ascii=False) + "\n")
+            return
+        table = pa.table({"id": pa.array(ids, pa.string()), "document": pa.array(documents, pa.string()),
+                          "metadata": pa.array(metas, pa.string())})
+        if self._writer is None:
+            self._writer = pq.ParquetWriter(self.path, table.schema, compression="zstd")
+        self._writer.write_table(table)
+
+    def close(self):
+        if self._file is not None: self._file.close()
+        if self._writer is not None: self._writer.close()
+
+def write_snapshot(coll, out_dir, info=None, files=None, refs=None, dtype="float32", page_size=1000, progress=None):
+    """
+    把 collection 按页写成快照目录 (先写到临时目录，完成后改名)
+    info: 写入 manifest 的附加信息；files: 文档目录条目；refs: 近似重复引用 [(ref_id, chunk_id, source, file_hash)]
+    """
+    if not HAS_NUMPY: raise ImportError("缺少 numpy，无法导出快照")
+    if dtype not in ("float32", "float16"): raise ValueError(f"不支持的向量精度: {dtype}")
+    total = coll.count()
+    if not total: raise ValueError("知识库为空，无需导出")
+    tmp_dir = out_dir.rstrip("/\\") + ".tmp"
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    os.makedirs(tmp_dir)
+    start = time.perf_counter()
+    writer = _ChunkWriter(tmp_dir)
+    vectors = None
+    offset = 0
+    try:
+        while offset < total:
+            data = coll.get(include=['embeddings', 'documents', 'metadatas'], limit=page_size, offset=offset)
+            if not len(data['ids']): break
+            page = np.asarray(data['embeddings'], dtype=np.float32)
+            if vectors is None:
+                vectors = np.lib.format.open_memmap(os.path.join(tmp_dir, EMBEDDINGS), mode='w+', dtype=dtype, shape=(total, page.shape[1]))
+            n = min(len(data['ids']), total - offset) # 导出期间有写入时只取开始时的数量
+            vectors[offset:offset + n] = page[:n]
+            writer.write(data['ids'][:n], data['documents'][:n], data['metadatas'][:n])
+            offset += n
+            if progress: progress(offset, total)
+    finally:
+        writer.close()
+    if offset != total:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        raise RuntimeError(f"导出时切片数不一致: {offset} != {total}，请在没有索引任务时重试")
+    vectors.flush()
+    manifest = {
+        **(info or {}), "version": SNAPSHOT_VERSION, "created_at": time.time(), "count": total,
+        "dim": int(vectors.shape[1]), "dtype": dtype, "chunks": writer.name,
+        "files": files or [], "refs": [list(r) for r in (refs or [])]
+    }
+    del vectors
+    with open(os.path.join(tmp_dir, MANIFEST), 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=2)
+    shutil.rmtree(out_dir, ignore_errors=True)
+    os.replace(tmp_dir, out_dir)
+    logger.info(f"[Snapshot] 已导出 {total} 个切片到 {out_dir} ({time.perf_counter() - start:.1f}s)")
+    return manifest
+
+# === 导入 ===
+def read_manifest(snapshot_dir):
+    path = os.path.join(snapshot_dir, MANIFEST)
+    if not os.path.exists(path): raise FileNotFoundError(f"不是有效的快照目录: {snapshot_dir}")
+    with open(path, 'r', encoding='utf-8') as f:
+        manifest = json.load(f)
+    if manifest.get("version", 0) > SNAPSHOT_VERSION:
+        raise ValueError(f"快照版本 {manifest['version']} 高于当前支持的 {SNAPSHOT_VERSION}")
+    return manifest
+
+def _iter_chunk_pages(path, page_size):
+    if path.endswith(".parquet"):
+        if not HAS_PYARROW: raise ImportError("快照切片为 Parquet 格式，需要安装 pyarrow")
+        for batch in pq.ParquetFile(path).iter_batches(batch_size=page_size, columns=["id", "document", "metadata"]):
+            cols = batch.to_pydict()
+            yield cols["id"], cols["document"], cols["metadata"]
+        return
+    ids, docs, metas = [], [], []
+    with gzip.open(path, 'rt', encoding='utf-8') as f:
+        for line in f:
+            rec = json.loads(line)
+            ids.append(rec["id"]); docs.append(rec["document"]); metas.append(rec["metadata"])
+            if len(ids) >= page_size:
+                yield ids, docs, metas
+                ids, docs, metas = [], [], []
+    if ids: yield ids, docs, metas
+
+def iter_snapshot(snapshot_dir, manifest=None, page_size=1000):
+    """按页读出 (ids, documents, metadatas, embeddings)，向量以内存映射方式读取"""
+    if not HAS_NUMPY: raise ImportError("缺少 numpy，无法导入快照")
+    manifest = manifest or read_manifest(snapshot_dir)
+    vectors = np.load(os.path.join(snapshot_dir, EMBEDDINGS), mmap_mode='r')
+    if vectors.shape != (manifest["count"], manifest["dim"]):
+        raise ValueError(f"向量文件形状 {vectors.shape} 与 manifest 不一致")
+    offset = 0
+    for ids, docs, metas in _iter_chunk_pages(os.path.join(snapshot_dir, manifest["chunks"]), page_size):
+        vecs = np.asarray(vectors[offset:offset + len(ids)], dtype=np.float32)
+        if len(vecs) != len(ids): raise ValueError("切片文件与向量文件行数不一致")
+        offset += len(ids)
+        yield ids, docs, [json.loads(m) if m else None for m in metas], vecs.tolist()
+    if offset != manifest["count"]: raise ValueError(f"快照切片数不一致: {offset} != {manifest['count']}")
+
+# === 命令行 ===
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="知识库快照: 导出向量与切片 / 在新节点上免嵌入导入")
+    parser.add_argument("command", choices=["export", "import", "info"])
+    parser.add_argument("path", help="快照目录")
+    parser.add_argument("--model", help="嵌入模型名 (export 必填；import 默认取快照中的模型)")
+    parser.add_argument("--float16", action="store_true", help="export 时以 float16 存储向量，体积减半")
+    args = parser.parse_args(argv)
+
+    if args.command == "info":
+        manifest = read_manifest(args.path)
+        manifest["files"] = len(manifest["files"])
+        manifest["refs"] = len(manifest["refs"])
+        print(json.dumps(manifest, ensure_ascii=False, indent=2))
+        return
+    from tools.knowledge import knowledge_tool
+    show = lambda done, total: print(f"\r{done}/{total}", end="", flush=True)
+    if args.command == "export":
+        if not args.model: parser.error("export 需要 --model")
+        print(knowledge_tool.export_snapshot(args.path, args.model, "float16" if args.float16 else "float32", progress=show))
+    else:
+        print(knowledge_tool.import_snapshot(args.path, args.model, progress=show))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,166 @@
+import os
+import re
+import math
+import heapq
+import sqlite3
+import threading
+from collections import Counter, defaultdict
+from utils.logger import logger
+
+# ASCII 词 (保留型号/编号中的 - _ . /)，以及连续的 CJK 字符
+_ASCII_TOKEN = re.compile(r"[a-z0-9]+(?:[-_./][a-z0-9]+)*")
+_CJK_RUN = re.compile(r"[㐀-䶿一-鿿豈-﫿]+")
+
+def tokenize(text):
+    """
+    轻量分词：英文/数字按词 (编号整体保留，同时拆出子词)，中文按单字 + 相邻二元组。
+    不依赖 jieba 等分词库，保证中文关键词与零件号都能精确命中。
+    """
+    if not text: return []
+    text = text.lower()
+    tokens = []
+    for m in _ASCII_TOKEN.finditer(text):
+        tok = m.group()
+        tokens.append(tok)
+        if len(tok) > 1 and any(c in tok for c in "-_./"):
+            tokens.extend(p for p in re.split(r"[-_./]", tok) if p)
+    for m in _CJK_RUN.finditer(text):
+        run = m.group()
+        tokens.extend(run)
+        tokens.extend(run[i:i + 2] for i in range(len(run) - 1))
+    return tokens
+
+class BM25Index:
+    """
+    与向量 collection 并存的 BM25 倒排索引
+    - 持久化在 SQLite (docs / postings 两张表)
+    - 首次使用时整体载入内存，查询只做字典查找，亚毫秒级
+    """
+    def __init__(self, db_path, k1=1.5, b=0.75):
+        self.db_path = db_path
+        self.k1 = k1
+        self.b = b
+        self._lock = threading.RLock()
+        self._postings = defaultdict(dict) # term -> {doc_id: tf}
+        self._doc_len = {}                 # doc_id -> 词数
+        self._total_len = 0
+        os.makedirs(os.path.dirname(db_path) or ".", exist_ok=True)
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS docs (doc_id TEXT PRIMARY KEY, file_hash TEXT, source TEXT, length INTEGER)")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS postings (term TEXT, doc_id TEXT, tf INTEGER)")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_post_doc ON postings(doc_id)")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_docs_hash ON docs(file_hash)")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_docs_source ON docs(source)")
+        self._conn.commit()
+        self._load()
+
+    def _load(self):
+        with self._lock:
+            for doc_id, length in self._conn.execute("SELECT doc_id, length FROM docs"):
+                self._doc_len[doc_id] = length
+                self._total_len += length
+            for term, doc_id, tf in self._conn.execute("SELECT term, doc_id, tf FROM postings"):
+                self._postings[term][doc_id] = tf
+
+    def __len__(self):
+        return len(self._doc_len)
+
+    def add(self, ids, documents, metadatas):
+        rows_docs, rows_post = [], []
+        with self._lock:
+            for doc_id, text, meta in zip(ids, documents, metadatas):
+                if doc_id in self._doc_len: continue
+                tf = Counter(tokenize(text))
+                length = sum(tf.values())
+                self._doc_len[doc_id] = length
+                self._total_len += length
+                for term, n in tf.items():
+                    self._postings[term][doc_id] = n
+                    rows_post.append((term, doc_id, n))
+                meta = meta or {}
+                rows_docs.append((doc_id, meta.get("file_hash"), meta.get("source"), length))
+            self._conn.executemany("INSERT OR REPLACE INTO docs VALUES (?, ?, ?, ?)", rows_docs)
+            self._conn.executemany("INSERT INTO postings VALUES (?, ?, ?)", rows_post)
+            self._conn.commit()
+
+    def update_metadata(self, ids, metadatas):
+        """同步切片的 source / file_hash (内容不变，倒排表无需改动)"""
+        with self._lock:
+            self._conn.executemany(
+                "UPDATE docs SET file_hash=?, source=? WHERE doc_id=?",
+                [((m or {}).get("file_hash"), (m or {}).get("source"), doc_id) for doc_id, m in zip(ids, metadatas)]
+            )
+            self._conn.commit()
+
+    def delete(self, where):
+        """where 与 Chroma 一致: {"source": ...} 或 {"file_hash": ...}"""
+        (key, value), = where.items()
+        if key not in ("source", "file_hash"): return 0
+        with self._lock:
+            ids = [r[0] for r in self._conn.execute(f"SELECT doc_id FROM docs WHERE {key}=?", (value,))]
+            return self.delete_ids(ids)
+
+    def delete_ids(self, ids):
+        if not ids: return 0
+        with self._lock:
+            for i in range(0, len(ids), 500):
+                part = ids[i:i + 500]
+                marks = ",".join("?" * len(part))
+                for term, doc_id in self._conn.execute(f"SELECT term, doc_id FROM postings WHERE doc_id IN ({marks})", part):
+                    plist = self._postings.get(term)
+                    if plist is not None:
+                        plist.pop(doc_id, None)
+                        if not plist: del self._postings[term]
+                self._conn.execute(f"DELETE FROM postings WHERE doc_id IN ({marks})", part)
+                self._conn.execute(f"DELETE FROM docs WHERE doc_id IN ({marks})", part)
+            for doc_id in ids:
+                self._total_len -= self._doc_len.pop(doc_id, 0)
+            self._conn.commit()
+        return len(ids)
+
+    def clear(self):
+        with self._lock:
+            self._postings.clear()
+            self._doc_len.clear()
+            self._total_len = 0
+            self._conn.execute("DELETE FROM postings")
+            self._conn.execute("DELETE FROM docs")
+            self._conn.commit()
+
+    def search(self, query, top_k=5):
+        """返回 [(doc_id, score)]，按 BM25 分数降序"""
+        terms = set(tokenize(query))
+        with self._lock:
+            n_docs = len(self._doc_len)
+            if not n_docs or not terms: return []
+            avgdl = self._total_len / n_docs or 1.0
+            scores = defaultdict(float)
+            for term in terms:
+                plist = self._postings.get(term)
+                if not plist: continue
+                df = len(plist)
+                idf = math.log(1 + (n_docs - df + 0.5) / (df + 0.5))
+                for doc_id, tf in plist.items():
+                    dl = self._doc_len[doc_id]
+                    scores[doc_id] += idf * tf * (self.k1 + 1) / (tf + self.k1 * (1 - self.b + self.b * dl / avgdl))
+        return heapq.nlargest(top_k, scores.items(), key=lambda x: x[1])
+
+    def rebuild_from(self, coll, page_size=1000):
+        """从已有的 Chroma collection 重建 (老版本数据没有词法索引时使用)"""
+        self.clear()
+        offset = 0
+        while True:
+            data = coll.get(include=['documents', 'metadatas'], limit=page_size, offset=offset)
+            if not data['ids']: break
+            self.add(data['ids'], data['documents'], data['metadatas'])
+            offset += len(data['ids'])
+        logger.info(f"[BM25] 已从向量库重建词法索引: {len(self)} 个切片")
+
+def reciprocal_rank_fusion(rankings, k=60):
+    """RRF: score(d) = Σ 1 / (k + rank)，rankings 为多个按相关度排序的 id 列表"""
+    scores = defaultdict(float)
+    for ranking in rankings:
+        for rank, doc_id in enumerate(ranking):
+            scores[doc_id] += 1.0 / (k + rank + 1)
+    return [doc_id for doc_id, _ in sorted(scores.items(), key=lambda x: x[1], reverse=True)]
@@ -72,10 +72,20 @@ class LLMFactory:
     @staticmethod
     def get_local_rerank_models(models_dir="models"):
         if not os.path.exists(models_dir): return []
-        models = [d for d in os.listdir(models_dir) if os.path.isdir(os.path.join(models_dir, d))]
+        from tools.knowledge import is_local_embedding_model
+        models = [d for d in os.listdir(models_dir)
+                  if os.path.isdir(os.path.join(models_dir, d)) and not is_local_embedding_model(os.path.join(models_dir, d))]
         if not models: return ["ms-marco-TinyBERT-L-2-v2 (Auto Download)"]
         return models
 
+    @staticmethod
+    def get_local_embedding_models(models_dir="models"):
+        """models/ 下可在进程内运行的 ONNX 嵌入模型，以 onnx: 前缀区分"""
+        if not os.path.exists(models_dir): return []
+        from tools.knowledge import is_local_embedding_model, LOCAL_EMBED_PREFIX
+        return [f"{LOCAL_EMBED_PREFIX}{d}" for d in sorted(os.listdir(models_dir))
+                if is_local_embedding_model(os.path.join(models_dir, d))]
+
     @staticmethod
     def chat_stream(provider, config, model, messages, tools=None):
         """流式对话生成器，统一使用 OpenAI 协议"""
@@ -0,0 +1,188 @@
+import os
+import re
+import zlib
+import sqlite3
+import threading
+from utils.logger import logger
+
+try:
+    import numpy as np
+    HAS_NUMPY = True
+except ImportError:
+    HAS_NUMPY = False
+
+_MERSENNE = (1 << 31) - 1 # a * x 不超过 2^62，uint64 运算不会溢出
+_SEED = 20240601
+
+class NearDupIndex:
+    """
+    切片级近似去重 (MinHash + LSH)，每个 collection 一份，存放在 SQLite
+    - sigs:  已入库切片 (规范切片) 的 MinHash 签名
+    - bands: LSH 分桶，band 内全部相同即为候选，再用签名估算 Jaccard 复核
+    - refs:  被判为近似重复、未单独入库的切片，记录其来源并引用规范切片
+    规范切片所属文件被删除时，如仍有引用，则把它过户给其中一个引用方，而不是删掉。
+    """
+    def __init__(self, db_path, num_perm=64, bands=16, threshold=0.9, shingle=5):
+        if not HAS_NUMPY: raise ImportError("缺少 numpy，无法启用近似去重")
+        if num_perm % bands: raise ValueError("num_perm 必须能被 bands 整除")
+        self.db_path = db_path
+        self.num_perm = num_perm
+        self.bands = bands
+        self.rows = num_perm // bands
+        self.threshold = threshold
+        self.shingle = shingle
+        rng = np.random.RandomState(_SEED)
+        self._a = rng.randint(1, _MERSENNE, size=num_perm).astype(np.uint64)
+        self._b = rng.randint(0, _MERSENNE, size=num_perm).astype(np.uint64)
+        self._lock = threading.RLock()
+        os.makedirs(os.path.dirname(db_path) or ".", exist_ok=True)
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS sigs (chunk_id TEXT PRIMARY KEY, sig BLOB NOT NULL)")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS bands (band INTEGER, bucket TEXT, chunk_id TEXT)")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_bands_bucket ON bands(band, bucket)")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_bands_chunk ON bands(chunk_id)")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS refs (ref_id TEXT PRIMARY KEY, chunk_id TEXT NOT NULL, source TEXT, file_hash TEXT)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_refs_chunk ON refs(chunk_id)")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_refs_hash ON refs(file_hash)")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_refs_source ON refs(source)")
+        self._conn.commit()
+
+    def __len__(self):
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM sigs").fetchone()[0]
+
+    # === 签名 ===
+    def signature(self, text):
+        """字符 shingle (中英文通用) 的 MinHash 签名"""
+        text = re.sub(r"\s+", " ", text or "").strip().lower()
+        k = self.shingle
+        shingles = {text[i:i + k] for i in range(max(1, len(text) - k + 1))}
+        hv = np.fromiter((zlib.crc32(s.encode("utf-8")) % _MERSENNE for s in shingles), dtype=np.uint64, count=len(shingles))
+        return ((hv[:, None] * self._a + self._b) % _MERSENNE).min(axis=0).astype(np.uint32)
+
+    def _buckets(self, sig):
+        return [sig[i * self.rows:(i + 1) * self.rows].tobytes().hex() for i in range(self.bands)]
+
+    def _similarity(self, a, b):
+        return float(np.mean(a == b))
+
+    # === 查重 ===
+    def plan(self, ids, texts, exclude=None):
+        """
+        对一批新切片查重 (不落盘)：返回 (签名列表, {重复切片id: 规范切片id})
+        同批次内的切片之间也会互相查重；exclude 中的已有切片不作为规范切片候选
+        """
+        sigs = [self.signature(t) for t in texts]
+        dup_of = {}
+        local = {} # (band, bucket) -> [(chunk_id, sig)]，本批次内的规范切片
+        with self._lock:
+            for cid, sig in zip(ids, sigs):
+                buckets = self._buckets(sig)
+                candidates = {}
+                for band, bucket in enumerate(buckets):
+                    for other_id, other_sig in local.get((band, bucket), []):
+                        candidates[other_id] = other_sig
+                    for (other_id,) in self._conn.execute("SELECT chunk_id FROM bands WHERE band=? AND bucket=?", (band, bucket)):
+                        if exclude and other_id in exclude: continue
+                        candidates.setdefault(other_id, None)
+                best, best_sim = None, 0.0
+                for other_id, other_sig in candidates.items():
+                    if other_sig is None: other_sig = self._load_sig(other_id)
+                    if other_sig is None: continue
+                    sim = self._similarity(sig, other_sig)
+                    if sim > best_sim: best, best_sim = other_id, sim
+                if best is not None and best_sim >= self.threshold:
+                    dup_of[cid] = best
+                    continue
+                for band, bucket in enumerate(buckets):
+                    local.setdefault((band, bucket), []).append((cid, sig))
+        return sigs, dup_of
+
+    def _load_sig(self, chunk_id):
+        row = self._conn.execute("SELECT sig FROM sigs WHERE chunk_id=?", (chunk_id,)).fetchone()
+        return np.frombuffer(row[0], dtype=np.uint32) if row else None
+
+    def commit(self, kept, refs):
+        """kept: [(chunk_id, sig)] 已写入向量库的规范切片；refs: [(ref_id, chunk_id, source, file_hash)]"""
+        with self._lock, self._conn:
+            self._conn.executemany("INSERT OR REPLACE INTO sigs (chunk_id, sig) VALUES (?, ?)", [(cid, sig.tobytes()) for cid, sig in kept])
+            self._conn.executemany(
+                "INSERT INTO bands (band, bucket, chunk_id) VALUES (?, ?, ?)",
+                [(band, bucket, cid) for cid, sig in kept for band, bucket in enumerate(self._buckets(sig))]
+            )
+            self._conn.executemany("INSERT OR REPLACE INTO refs (ref_id, chunk_id, source, file_hash) VALUES (?, ?, ?, ?)", refs)
+
+    # === 引用维护 ===
+    def drop_refs(self, where):
+        """删除某个文件 (where 为 {"source": ...} 或 {"file_hash": ...}) 的全部引用"""
+        key, value = next(iter(where.items()))
+        if key not in ("source", "file_hash"): return
+        with self._lock, self._conn:
+            self._conn.execute(f"DELETE FROM refs WHERE {key}=?", (value,))
+
+    def take_ref(self, chunk_id):
+        """取出并删除规范切片的一条引用 (用于过户)，没有引用时返回 None"""
+        with self._lock, self._conn:
+            row = self._conn.execute("SELECT ref_id, source, file_hash FROM refs WHERE chunk_id=? LIMIT 1", (chunk_id,)).fetchone()
+            if not row: return None
+            self._conn.execute("DELETE FROM refs WHERE ref_id=?", (row[0],))
+        return {"source": row[1], "file_hash": row[2]}
+
+    def refs_for(self, chunk_ids):
+        """{规范切片id: [引用方 source, ...]}"""
+        result = {}
+        chunk_ids = list(chunk_ids)
+        with self._lock:
+            for i in range(0, len(chunk_ids), 500):
+                part = chunk_ids[i:i + 500]
+                for cid, source in self._conn.execute(
+                    f"SELECT chunk_id, source FROM refs WHERE chunk_id IN ({','.join('?' * len(part))})", part
+                ):
+                    if source not in result.setdefault(cid, []): result[cid].append(source)
+        return result
+
+    def chunks_referenced_by(self, sources):
+        """这些文件以引用方式包含的规范切片 id"""
+        sources = list(sources)
+        found = set()
+        with self._lock:
+            for i in range(0, len(sources), 500):
+                part = sources[i:i + 500]
+                found.update(r[0] for r in self._conn.execute(
+                    f"SELECT chunk_id FROM refs WHERE source IN ({','.join('?' * len(part))})", part
+                ))
+        return found
+
+    def remove_chunks(self, chunk_ids):
+        chunk_ids = list(chunk_ids)
+        with self._lock, self._conn:
+            for i in range(0, len(chunk_ids), 500):
+                part = chunk_ids[i:i + 500]
+                marks = ','.join('?' * len(part))
+                self._conn.execute(f"DELETE FROM sigs WHERE chunk_id IN ({marks})", part)
+                self._conn.execute(f"DELETE FROM bands WHERE chunk_id IN ({marks})", part)
+                self._conn.execute(f"DELETE FROM refs WHERE chunk_id IN ({marks})", part)
+
+    def all_refs(self):
+        """全部引用 [(ref_id, chunk_id, source, file_hash)]，用于导出快照"""
+        with self._lock:
+            return self._conn.execute("SELECT ref_id, chunk_id, source, file_hash FROM refs ORDER BY ref_id").fetchall()
+
+    def stats(self):
+        with self._lock:
+            canonical = self._conn.execute("SELECT COUNT(*) FROM sigs").fetchone()[0]
+            refs = self._conn.execute("SELECT COUNT(*) FROM refs").fetchone()[0]
+        return {"canonical": canonical, "refs": refs}
+
+    def rebuild_from(self, coll, page_size=1000):
+        """为已有切片补算签名 (老数据一次性迁移，只建索引，不合并已存在的重复)"""
+        offset = 0
+        while True:
+            data = coll.get(include=['documents'], limit=page_size, offset=offset)
+            if not data['ids']: break
+            self.commit([(cid, self.signature(doc)) for cid, doc in zip(data['ids'], data['documents'])], [])
+            offset += len(data['ids'])
+        logger.info(f"[NearDup] 已为向量库中的 {offset} 个切片补算 MinHash 签名")
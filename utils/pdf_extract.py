@@ -0,0 +1,153 @@
+import os
+import time
+import sqlite3
+import threading
+import multiprocessing
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from utils.logger import logger
+
+# === 可选依赖导入 ===
+try:
+    import pypdf
+except ImportError:
+    pypdf = None
+
+class PdfPageCache:
+    """
+    PDF 逐页文本缓存 (SQLite)，键为 (文件哈希, 页码)
+    - 提取失败或被取消后重试时，已完成的页直接复用
+    - 同一文件用其他嵌入模型再次索引时无需重新解析
+    - 总大小超过上限时按文件淘汰最久未使用的
+    """
+    def __init__(self, db_path, max_bytes=512 * 1024 * 1024):
+        self.db_path = db_path
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(db_path) or ".", exist_ok=True)
+        self._conn = sqlite3.connect(db_path, check_same_thread=False, timeout=30)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS pages (file_hash TEXT, page INTEGER, text TEXT, PRIMARY KEY (file_hash, page))")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS files (file_hash TEXT PRIMARY KEY, bytes INTEGER, last_used REAL)")
+        self._conn.commit()
+
+    def pages(self, file_hash):
+        """已缓存的页码集合"""
+        with self._lock, self._conn:
+            self._conn.execute("UPDATE files SET last_used=? WHERE file_hash=?", (time.time(), file_hash))
+            return {r[0] for r in self._conn.execute("SELECT page FROM pages WHERE file_hash=?", (file_hash,))}
+
+    def get(self, file_hash, page):
+        with self._lock:
+            row = self._conn.execute("SELECT text FROM pages WHERE file_hash=? AND page=?", (file_hash, page)).fetchone()
+        return row[0] if row else None
+
+    def put(self, file_hash, items):
+        """items: [(页码, 文本)]"""
+        if not items: return
+        size = sum(len(t.encode("utf-8")) for _, t in items)
+        with self._lock, self._conn:
+            self._conn.executemany("INSERT OR REPLACE INTO pages (file_hash, page, text) VALUES (?, ?, ?)",
+                                   [(file_hash, p, t) for p, t in items])
+            self._conn.execute(
+                "INSERT INTO files (file_hash, bytes, last_used) VALUES (?, ?, ?) "
+                "ON CONFLICT(file_hash) DO UPDATE SET bytes = bytes + excluded.bytes, last_used = excluded.last_used",
+                (file_hash, size, time.time())
+            )
+
+    def prune(self, keep=None):
+        """超过上限时按最久未使用淘汰整个文件 (keep 为正在使用的文件哈希，不淘汰)"""
+        with self._lock, self._conn:
+            total = self._conn.execute("SELECT COALESCE(SUM(bytes), 0) FROM files").fetchone()[0]
+            if total <= self.max_bytes: return
+            for file_hash, size in self._conn.execute("SELECT file_hash, bytes FROM files ORDER BY last_used").fetchall():
+                if total <= self.max_bytes: break
+                if file_hash == keep: continue
+                self._conn.execute("DELETE FROM pages WHERE file_hash=?", (file_hash,))
+                self._conn.execute("DELETE FROM files WHERE file_hash=?", (file_hash,))
+                total -= size
+
+_caches = {}
+_caches_lock = threading.Lock()
+
+def get_page_cache(db_path, max_mb=512):
+    """同一路径共享一个实例"""
+    with _caches_lock:
+        cache = _caches.get(db_path)
+        if cache is None:
+            cache = _caches[db_path] = PdfPageCache(db_path, int(max_mb) * 1024 * 1024)
+        return cache
+
+def extract_pages(file_path, pages):
+    """进程池 worker 入口：提取给定页码 (升序) 的文本，返回 [(页码, 文本)]"""
+    reader = pypdf.PdfReader(file_path)
+    return [(i, reader.pages[i].extract_text() or "") for i in pages]
+
+RANGE_MAX_PAGES = 16 # 每个页段的最大页数
+INFLIGHT_PER_WORKER = 2 # 每个进程同时在途的页段数
+
+def _page_ranges(pages, n_ranges, max_pages=RANGE_MAX_PAGES):
+    """把待提取页码切成大致等长的连续段 (每段不超过 max_pages 页)，各段交给不同进程"""
+    size = min(max_pages, max(1, -(-len(pages) // n_ranges)))
+    return [pages[i:i + size] for i in range(0, len(pages), size)]
+
+def iter_pdf_pages(file_path, file_hash=None, workers=0, min_pages=32, cache_path=None, cache_max_mb=512):
+    """
+    按页序产出 PDF 文本
+    - cache_path 给出时先查逐页缓存，只提取缺失的页，提取结果随完成随写入缓存
+    - 缺失页数 >= min_pages 且 workers != 1 时，按页段分给多个进程并行提取 (0 表示 CPU 核数)；
+      前面的页一旦就绪就先产出，后续切分/嵌入不必等整个文件
+    - 同时在途的页段不超过 workers * INFLIGHT_PER_WORKER 个，按提交顺序取结果；
+      即使第一段很慢，内存中已提取未产出的页也不超过这个窗口
+    """
+    if not pypdf: raise ImportError("缺少 pypdf 库，无法解析 PDF")
+    reader = pypdf.PdfReader(file_path)
+    n_pages = len(reader.pages)
+    cache = get_page_cache(cache_path, cache_max_mb) if cache_path and file_hash else None
+    cached = cache.pages(file_hash) if cache else set()
+    missing = [i for i in range(n_pages) if i not in cached]
+    if cached: logger.info(f"[PDF] {os.path.basename(file_path)}: 复用缓存 {n_pages - len(missing)}/{n_pages} 页")
+
+    workers = min(workers or os.cpu_count() or 1, len(missing))
+    if workers <= 1 or len(missing) < min_pages:
+        for i in range(n_pages):
+            if i in cached:
+                yield cache.get(file_hash, i) or ""
+                continue
+            text = reader.pages[i].extract_text() or ""
+            if cache: cache.put(file_hash, [(i, text)])
+            yield text
+    else:
+        del reader
+        next_page = 0
+        start = time.perf_counter()
+        # spawn: 避免在多线程的 Streamlit 进程里 fork
+        pool = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"))
+        try:
+            # 段数多于进程数，前面的页能尽早完成并产出；只保留有限个在途页段，完成一段再补交一段
+            parts = iter(_page_ranges(missing, workers * 4))
+            inflight = deque()
+
+            def _submit():
+                part = next(parts, None)
+                if part: inflight.append(pool.submit(extract_pages, file_path, part))
+
+            for _ in range(workers * INFLIGHT_PER_WORKER): _submit()
+            while inflight:
+                items = inflight.popleft().result()
+                _submit()
+                if cache: cache.put(file_hash, items)
+                # 页段按页序提交，队首段之前只可能有缓存页
+                for page, text in items:
+                    while next_page < page:
+                        yield cache.get(file_hash, next_page) or ""
+                        next_page += 1
+                    yield text
+                    next_page += 1
+            while next_page < n_pages: # 末尾的缓存页
+                yield cache.get(file_hash, next_page) or ""
+                next_page += 1
+            logger.info(f"[PDF] {os.path.basename(file_path)}: {len(missing)} 页由 {workers} 个进程提取，耗时 {time.perf_counter() - start:.1f}s")
+        finally:
+            pool.shutdown(wait=False, cancel_futures=True)
+    if cache: cache.prune(keep=file_hash)
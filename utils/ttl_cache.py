@@ -0,0 +1,61 @@
+import time
+import threading
+from collections import OrderedDict
+
+class TTLCache:
+    """
+    线程安全的 LRU + TTL 内存缓存
+    - 超过 max_entries 淘汰最久未使用的条目
+    - 条目写入 ttl 秒后过期 (ttl<=0 表示不过期)
+    """
+    def __init__(self, max_entries=256, ttl=600):
+        self.max_entries = max(1, int(max_entries))
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict() # key -> (expire_at, value)
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            item = self._data.get(key)
+            if item is not None:
+                expire_at, value = item
+                if expire_at is None or expire_at > time.monotonic():
+                    self._data.move_to_end(key)
+                    self.hits += 1
+                    return value
+                del self._data[key]
+            self.misses += 1
+            return default
+
+    def set(self, key, value):
+        expire_at = time.monotonic() + self.ttl if self.ttl and self.ttl > 0 else None
+        with self._lock:
+            self._data[key] = (expire_at, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+
+    def invalidate(self, predicate=None):
+        """清除满足 predicate(key) 的条目；不传则清空"""
+        with self._lock:
+            if predicate is None:
+                n = len(self._data)
+                self._data.clear()
+                return n
+            keys = [k for k in self._data if predicate(k)]
+            for k in keys: del self._data[k]
+            return len(keys)
+
+    def __len__(self):
+        return len(self._data)
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            "entries": len(self._data),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / total, 3) if total else 0.0
+        }
@@ -0,0 +1,408 @@
+import os
+import json
+import sqlite3
+import threading
+from utils.logger import logger
+
+try:
+    import numpy as np
+    from numpy.lib.format import open_memmap
+    HAS_NUMPY = True
+except ImportError:
+    HAS_NUMPY = False
+
+SCAN_BLOCK_ROWS = 8192 # 分块扫描，单块反量化后的 float32 临时数组约 dim * 32KB
+
+class QuantizedVectorStore:
+    """
+    紧凑的本地向量库：与 KnowledgeBase 用到的 Chroma collection 接口兼容
+    (add / get / update / delete / query / count / name)
+    - 向量归一化后以 int8 (每行一个缩放系数) 或 float16 存在 .npy 内存映射文件中，
+      启动时不载入内存，按需分页读取
+    - 查询是分块的矩阵乘 + argpartition 取 top-k (余弦相似度)
+    - keep_full=True 时额外保留 float32 副本 (同样内存映射)，只对候选行做全精度重打分；
+      代价是磁盘占用比量化前还大，默认不保留
+    - 文本与元数据存在同目录的 SQLite，行号即向量矩阵的行
+    """
+    def __init__(self, path, name, embedding_function=None, dtype="int8", keep_full=False, rescore_k=50):
+        if not HAS_NUMPY: raise ImportError("缺少 numpy，无法使用量化向量库")
+        if dtype not in ("int8", "float16"): raise ValueError(f"不支持的向量精度: {dtype}")
+        self.path = path
+        self.name = name
+        self._embedding_function = embedding_function
+        self.rescore_k = max(0, int(rescore_k))
+        self._lock = threading.RLock()
+        os.makedirs(path, exist_ok=True)
+
+        # 精度等参数以首次创建时为准，之后改配置需重新迁移
+        meta_path = os.path.join(path, "meta.json")
+        if os.path.exists(meta_path):
+            with open(meta_path, 'r', encoding='utf-8') as f:
+                meta = json.load(f)
+        else:
+            meta = {"dtype": dtype, "keep_full": bool(keep_full), "dim": None}
+            with open(meta_path, 'w', encoding='utf-8') as f:
+                json.dump(meta, f)
+        self.dtype = meta["dtype"]
+        self.keep_full = meta["keep_full"]
+        self.dim = meta["dim"]
+        self._meta_path = meta_path
+
+        self._conn = sqlite3.connect(os.path.join(path, "chunks.db"), check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS chunks ("
+            "row INTEGER PRIMARY KEY, id TEXT NOT NULL UNIQUE, document TEXT, metadata TEXT, "
+            "source TEXT, file_hash TEXT)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_chunks_source ON chunks(source)")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_chunks_hash ON chunks(file_hash)")
+        self._conn.commit()
+
+        self._vecs = self._scales = self._full = None
+        if self.dim: self._open_arrays()
+        # 存活行掩码：行号存在于 SQLite 才算有效 (向量先写、SQLite 后提交，中途崩溃只会留下空闲行)
+        rows = [r[0] for r in self._conn.execute("SELECT row FROM chunks")]
+        self._size = max(rows) + 1 if rows else 0
+        self._alive = np.zeros(max(self._capacity(), self._size), dtype=bool)
+        if rows: self._alive[np.array(rows, dtype=np.int64)] = True
+
+    # === 内存映射文件 ===
+    def _file(self, kind):
+        return os.path.join(self.path, f"{kind}.npy")
+
+    def _open_arrays(self):
+        self._vecs = open_memmap(self._file("vectors"), mode='r+')
+        if self.dtype == "int8": self._scales = open_memmap(self._file("scales"), mode='r+')
+        if self.keep_full: self._full = open_memmap(self._file("full"), mode='r+')
+
+    def _capacity(self):
+        return 0 if self._vecs is None else self._vecs.shape[0]
+
+    def _layout(self):
+        """(文件名, dtype, 每行形状) 列表"""
+        files = [("vectors", self.dtype, (self.dim,))]
+        if self.dtype == "int8": files.append(("scales", "float32", ()))
+        if self.keep_full: files.append(("full", "float32", (self.dim,)))
+        return files
+
+    def _ensure_capacity(self, needed):
+        """容量不足时按 2 倍扩容"""
+        cap = self._capacity()
+        if needed <= cap: return
+        self._resize(max(1024, cap * 2, needed))
+
+    def _resize(self, new_cap):
+        """改变文件容量：写新文件 -> 拷贝前 _size 行 -> 替换 (Windows 下需先释放旧映射)"""
+        for kind, dtype, shape in self._layout():
+            tmp = self._file(kind) + ".tmp"
+            new_arr = open_memmap(tmp, mode='w+', dtype=dtype, shape=(new_cap,) + shape)
+            old = getattr(self, {"vectors": "_vecs", "scales": "_scales", "full": "_full"}[kind])
+            if old is not None and self._size:
+                new_arr[:self._size] = old[:self._size]
+            new_arr.flush()
+            del new_arr, old
+        self._vecs = self._scales = self._full = None
+        for kind, _, _ in self._layout():
+            os.replace(self._file(kind) + ".tmp", self._file(kind))
+        self._open_arrays()
+        alive = np.zeros(new_cap, dtype=bool)
+        n = min(len(self._alive), new_cap)
+        alive[:n] = self._alive[:n]
+        self._alive = alive
+
+    def compact(self):
+        """
+        压缩：把存活行前移到连续区间、按新行数缩小文件，返回回收的空行数。
+        新行号不大于旧行号，按升序分块搬运不会覆盖尚未搬运的数据。
+        """
+        with self._lock:
+            rows = np.flatnonzero(self._alive[:self._size])
+            removed = self._size - len(rows)
+            if self.dim is None: return 0
+            if removed:
+                for start in range(0, len(rows), SCAN_BLOCK_ROWS):
+                    blk = rows[start:start + SCAN_BLOCK_ROWS]
+                    for arr in (self._vecs, self._scales, self._full):
+                        if arr is not None: arr[start:start + len(blk)] = arr[blk]
+                self._flush()
+                with self._conn:
+                    self._conn.executemany(
+                        "UPDATE chunks SET row=? WHERE row=?",
+                        [(new, int(old)) for new, old in enumerate(rows) if new != old]
+                    )
+                self._size = len(rows)
+                self._alive[:] = False
+                self._alive[:self._size] = True
+            if self._capacity() > max(1024, self._size):
+                self._resize(max(1024, self._size))
+            logger.info(f"[VectorStore] {self.name} 压缩完成: 回收 {removed} 行，剩余 {self._size} 行")
+            return removed
+
+    # === 写入 ===
+    @staticmethod
+    def _normalize(vectors):
+        mat = np.asarray(vectors, dtype=np.float32)
+        if mat.ndim == 1: mat = mat[None, :]
+        return mat / np.clip(np.linalg.norm(mat, axis=1, keepdims=True), 1e-12, None)
+
+    def _write_rows(self, rows, mat):
+        if self.dtype == "int8":
+            scales = np.abs(mat).max(axis=1) / 127.0
+            safe = np.where(scales > 0, scales, 1.0)
+            self._vecs[rows] = np.rint(mat / safe[:, None]).astype(np.int8)
+            self._scales[rows] = scales
+        else:
+            self._vecs[rows] = mat.astype(np.float16)
+        if self.keep_full: self._full[rows] = mat
+
+    def _flush(self):
+        for arr in (self._vecs, self._scales, self._full):
+            if arr is not None: arr.flush()
+
+    @staticmethod
+    def _meta_columns(meta):
+        meta = meta or {}
+        return json.dumps(meta, ensure_ascii=False), meta.get("source"), meta.get("file_hash")
+
+    def add(self, ids, documents=None, metadatas=None, embeddings=None):
+        """写入切片 (id 已存在时覆盖)；未给出 embeddings 时调用嵌入函数"""
+        ids = list(ids)
+        if not ids: return
+        documents = list(documents) if documents is not None else [None] * len(ids)
+        metadatas = list(metadatas) if metadatas is not None else [None] * len(ids)
+        if embeddings is None:
+            embeddings = self._embedding_function(documents)
+        mat = self._normalize(embeddings)
+
+        with self._lock:
+            if self.dim is None:
+                self.dim = int(mat.shape[1])
+                with open(self._meta_path, 'w', encoding='utf-8') as f:
+                    json.dump({"dtype": self.dtype, "keep_full": self.keep_full, "dim": self.dim}, f)
+            elif mat.shape[1] != self.dim:
+                raise ValueError(f"向量维度不匹配: {mat.shape[1]} != {self.dim}")
+
+            # 已有 id 复用原行，其余优先填补删除留下的空行，再追加到末尾
+            existing = self._rows_for_ids(ids)
+            free = np.flatnonzero(~self._alive[:self._size])
+            rows, next_free, appended = [], 0, 0
+            for cid in ids:
+                if cid in existing:
+                    rows.append(existing[cid])
+                elif next_free < len(free):
+                    rows.append(int(free[next_free])); next_free += 1
+                else:
+                    rows.append(self._size + appended); appended += 1
+                existing.setdefault(cid, rows[-1]) # 同一批内重复 id 写同一行
+            rows = [existing[cid] for cid in ids]
+            self._ensure_capacity(self._size + appended)
+
+            row_arr = np.array(rows, dtype=np.int64)
+            self._write_rows(row_arr, mat)
+            self._flush()
+            with self._conn:
+                self._conn.executemany(
+                    "INSERT OR REPLACE INTO chunks (row, id, document, metadata, source, file_hash) VALUES (?, ?, ?, ?, ?, ?)",
+                    [(r, cid, doc, *self._meta_columns(m)) for r, cid, doc, m in zip(rows, ids, documents, metadatas)]
+                )
+            self._size += appended
+            self._alive[row_arr] = True
+
+    upsert = add
+
+    def update(self, ids, metadatas=None, documents=None, embeddings=None):
+        """更新元数据；给出 documents/embeddings 时整行重写"""
+        if documents is not None or embeddings is not None:
+            current = self.get(ids=ids, include=['documents', 'metadatas'])
+            lookup = dict(zip(current['ids'], zip(current['documents'], current['metadatas'])))
+            docs = list(documents) if documents is not None else [lookup.get(i, (None, None))[0] for i in ids]
+            metas = list(metadatas) if metadatas is not None else [lookup.get(i, (None, None))[1] for i in ids]
+            return self.add(ids, docs, metas, embeddings)
+        with self._lock, self._conn:
+            self._conn.executemany(
+                "UPDATE chunks SET metadata=?, source=?, file_hash=? WHERE id=?",
+                [(*self._meta_columns(m), cid) for cid, m in zip(ids, metadatas)]
+            )
+
+    def delete(self, ids=None, where=None):
+        with self._lock:
+            rows = list(self._rows_for_ids(ids).values()) if ids is not None else self._rows_for_where(where)
+            if not rows: return
+            with self._conn:
+                for i in range(0, len(rows), 500):
+                    part = rows[i:i + 500]
+                    self._conn.execute(f"DELETE FROM chunks WHERE row IN ({','.join('?' * len(part))})", part)
+            self._alive[np.array(rows, dtype=np.int64)] = False
+
+    # === 读取 ===
+    def _rows_for_ids(self, ids):
+        found = {}
+        ids = list(ids or [])
+        for i in range(0, len(ids), 500):
+            part = ids[i:i + 500]
+            found.update(self._conn.execute(
+                f"SELECT id, row FROM chunks WHERE id IN ({','.join('?' * len(part))})", part
+            ).fetchall())
+        return found
+
+    def _where_sql(self, where):
+        """支持等值 {"key": value} 与 {"key": {"$in": [...]}}；source / file_hash 走索引列"""
+        if not where: return "", []
+        clauses, params = [], []
+        for key, value in where.items():
+            if key in ("source", "file_hash"):
+                column = key
+            else:
+                column = "json_extract(metadata, ?)"
+                params.append(f"$.{key}")
+            if isinstance(value, dict) and "$in" in value:
+                values = list(value["$in"])
+                clauses.append(f"{column} IN ({','.join('?' * len(values))})" if values else "0")
+                params.extend(values)
+            else:
+                clauses.append(f"{column}=?")
+                params.append(value)
+        return " WHERE " + " AND ".join(clauses), params
+
+    def _rows_for_where(self, where):
+        sql, params = self._where_sql(where)
+        return [r[0] for r in self._conn.execute(f"SELECT row FROM chunks{sql}", params)]
+
+    def count(self):
+        with self._lock:
+            return int(self._alive[:self._size].sum())
+
+    def get(self, ids=None, where=None, include=None, limit=None, offset=None):
+        include = ['documents', 'metadatas'] if include is None else include
+        with self._lock:
+            if ids is not None:
+                ids = list(ids)
+                rows_by_id = self._rows_for_ids(ids)
+                rows = [rows_by_id[i] for i in ids if i in rows_by_id]
+                data = self._load_rows(rows)
+            else:
+                sql, params = self._where_sql(where)
+                sql = f"SELECT row, id, document, metadata FROM chunks{sql} ORDER BY row"
+                if limit is not None:
+                    sql += " LIMIT ? OFFSET ?"
+                    params = params + [int(limit), int(offset or 0)]
+                data = self._conn.execute(sql, params).fetchall()
+            result = {
+                "ids": [r[1] for r in data],
+                "documents": [r[2] for r in data] if 'documents' in include else None,
+                "metadatas": [json.loads(r[3]) if r[3] else None for r in data] if 'metadatas' in include else None
+            }
+            if 'embeddings' in include:
+                result["embeddings"] = self._vectors(np.array([r[0] for r in data], dtype=np.int64)).tolist() if data else []
+            return result
+
+    def _load_rows(self, rows):
+        """按给定行号顺序取出 (row, id, document, metadata)"""
+        found = {}
+        for i in range(0, len(rows), 500):
+            part = [int(r) for r in rows[i:i + 500]]
+            for rec in self._conn.execute(
+                f"SELECT row, id, document, metadata FROM chunks WHERE row IN ({','.join('?' * len(part))})", part
+            ):
+                found[rec[0]] = rec
+        return [found[r] for r in rows if r in found]
+
+    def _vectors(self, rows):
+        """取出指定行的 float32 向量 (有全精度副本时直接读副本)"""
+        if self.keep_full: return np.asarray(self._full[rows], dtype=np.float32)
+        vecs = np.asarray(self._vecs[rows], dtype=np.float32)
+        if self.dtype == "int8": vecs *= np.asarray(self._scales[rows])[:, None]
+        return vecs
+
+    # === 检索 ===
+    def _scan(self, queries, n, mask):
+        """分块计算近似相似度，返回每个查询的候选行号 (按近似分数降序)"""
+        best_rows = [np.empty(0, dtype=np.int64) for _ in range(len(queries))]
+        best_scores = [np.empty(0, dtype=np.float32) for _ in range(len(queries))]
+        qt = queries.T
+        for start in range(0, self._size, SCAN_BLOCK_ROWS):
+            end = min(start + SCAN_BLOCK_ROWS, self._size)
+            alive = mask[start:end]
+            if not alive.any(): continue
+            scores = np.asarray(self._vecs[start:end], dtype=np.float32) @ qt
+            if self.dtype == "int8": scores *= np.asarray(self._scales[start:end])[:, None]
+            scores[~alive] = -np.inf
+            for qi in range(len(queries)):
+                col = scores[:, qi]
+                k = min(n, int(alive.sum()))
+                top = np.argpartition(-col, k - 1)[:k] if k < len(col) else np.arange(len(col))
+                top = top[np.isfinite(col[top])]
+                rows = np.concatenate([best_rows[qi], top + start])
+                vals = np.concatenate([best_scores[qi], col[top]])
+                if len(rows) > n:
+                    keep = np.argpartition(-vals, n - 1)[:n]
+                    rows, vals = rows[keep], vals[keep]
+                best_rows[qi], best_scores[qi] = rows, vals
+        return [(rows[np.argsort(-vals)], np.sort(vals)[::-1]) for rows, vals in zip(best_rows, best_scores)]
+
+    def _score_rows(self, queries, rows, n):
+        """只对给定行计算近似相似度，返回每个查询的候选行号 (按近似分数降序)"""
+        if not len(rows): return [(rows, np.empty(0, dtype=np.float32)) for _ in range(len(queries))]
+        scores = np.asarray(self._vecs[rows], dtype=np.float32) @ queries.T
+        if self.dtype == "int8": scores *= np.asarray(self._scales[rows])[:, None]
+        result = []
+        for col in scores.T:
+            order = np.argsort(-col)[:n]
+            result.append((rows[order], col[order]))
+        return result
+
+    def query(self, query_embeddings=None, query_texts=None, n_results=10, where=None, include=None):
+        """返回与 Chroma 相同结构的结果，distances 为余弦距离 (1 - cos)"""
+        if query_embeddings is None:
+            query_embeddings = self._embedding_function(list(query_texts))
+        queries = self._normalize(query_embeddings)
+        out = {"ids": [], "documents": [], "metadatas": [], "distances": []}
+        with self._lock:
+            if self.dim is None or not self._size:
+                for _ in range(len(queries)):
+                    for key in out: out[key].append([])
+                return out
+            n_candidates = max(n_results, self.rescore_k) if self.keep_full else n_results
+            if where:
+                # 带过滤条件时只读取命中的行，耗时与过滤后的行数成正比
+                candidates = self._score_rows(queries, np.array(sorted(self._rows_for_where(where)), dtype=np.int64), n_candidates)
+            else:
+                candidates = self._scan(queries, n_candidates, self._alive[:self._size])
+
+            for q, (rows, scores) in zip(queries, candidates):
+                if self.keep_full and self.rescore_k and len(rows):
+                    # 全精度重打分：只读取候选行的 float32 副本
+                    scores = self._vectors(rows) @ q
+                    order = np.argsort(-scores)
+                    rows, scores = rows[order], scores[order]
+                rows, scores = rows[:n_results], scores[:n_results]
+                data = self._load_rows(rows.tolist())
+                out["ids"].append([r[1] for r in data])
+                out["documents"].append([r[2] for r in data])
+                out["metadatas"].append([json.loads(r[3]) if r[3] else None for r in data])
+                out["distances"].append([float(1.0 - s) for s in scores[:len(data)]])
+        return out
+
+    def stats(self):
+        with self._lock:
+            files = [self._file(kind) for kind, _, _ in self._layout()] if self.dim else []
+            return {
+                "count": self.count(), "dim": self.dim, "dtype": self.dtype, "keep_full": self.keep_full,
+                "capacity": self._capacity(), "dead_rows": self._size - self.count(),
+                "disk_mb": round(sum(os.path.getsize(f) for f in files if os.path.exists(f)) / 1e6, 2)
+            }
+
+def migrate_from_chroma(coll, store, page_size=1000):
+    """一次性把 Chroma collection 的向量、文本、元数据搬进量化向量库 (不重新嵌入)"""
+    offset = 0
+    while True:
+        data = coll.get(include=['embeddings', 'documents', 'metadatas'], limit=page_size, offset=offset)
+        if not len(data['ids']): break
+        store.add(ids=data['ids'], documents=data['documents'], metadatas=data['metadatas'], embeddings=data['embeddings'])
+        offset += len(data['ids'])
+    logger.info(f"[VectorStore] 已从 Chroma 迁移 {store.count()} 个切片到 {store.path} ({store.dtype})")
+    if store.keep_full:
+        logger.warning(f"[VectorStore] {store.name} 保留了 float32 副本用于重打分 (vector_rescore > 0)，磁盘占用不会低于 Chroma")
+    return store.count()